@@ -0,0 +1,33 @@
+"""Add composite index for listing sessions by status
+
+Revision ID: 4c7d8e2f1a36
+Revises: 9b2e41d7c0a5
+Create Date: 2026-10-15 14:37:51.118406
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = '4c7d8e2f1a36'
+down_revision: Union[str, Sequence[str], None] = '9b2e41d7c0a5'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Serves the paged listing (status filter, newest first) and the
+    # per-status summary from the index alone
+    op.create_index(
+        'ix_sessions_status_created_at',
+        'sessions',
+        ['status', 'created_at', 'session_id'],
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_sessions_status_created_at', 'sessions')
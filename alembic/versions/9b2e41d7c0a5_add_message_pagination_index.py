@@ -0,0 +1,33 @@
+"""Add composite index for paginating session messages
+
+Revision ID: 9b2e41d7c0a5
+Revises: f3665c33c3a6
+Create Date: 2026-10-15 10:12:08.402913
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9b2e41d7c0a5'
+down_revision: Union[str, Sequence[str], None] = 'f3665c33c3a6'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Serves both the latest page and before/after cursors of a session's
+    # history without scanning or sorting the rest of it
+    op.create_index(
+        'ix_messages_session_timestamp_id',
+        'messages',
+        ['session_id', 'timestamp', 'message_id'],
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_messages_session_timestamp_id', 'messages')
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Benchmark AgentService update delivery latency and idle CPU usage.
+
+Runs N concurrent sessions whose sampling loop is replaced by a
+MockAgentService-style fake loop: each session emits a burst of content blocks
+and tool results, then stays idle while the agent is "thinking". We measure the
+delay between a callback firing inside the sampling loop and the resulting
+update reaching StreamHandler.broadcast_update, and the CPU consumed by the
+process while every session is idle.
+
+Usage:
+    python benchmarks/agent_update_latency.py --sessions 100 --updates 20 --idle 5
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+from unittest import mock
+
+from computer_use_demo.tools import ToolResult
+from computer_use_backend.logging_config import setup_logging
+from computer_use_backend.services.agent_service import AgentService
+from computer_use_backend.services.stream_handler import StreamHandler
+
+
+def make_fake_loop(emitted_at: dict, updates: int, gap: float, idle: asyncio.Event):
+    """Build a fake sampling_loop that records when each block was emitted."""
+
+    async def _loop(*, messages, output_callback, tool_output_callback, **kwargs):
+        for i in range(updates):
+            key = f"{id(messages)}-{i}"
+            emitted_at[key] = time.perf_counter()
+            if i % 2:
+                tool_output_callback(ToolResult(output=key), key)
+            else:
+                output_callback({"type": "text", "text": key})
+            await asyncio.sleep(gap)
+        # Simulate a long model round-trip with nothing to report
+        await idle.wait()
+        return messages
+
+    return _loop
+
+
+async def run_session(
+    session_id: str,
+    stream_handler: StreamHandler,
+    latencies: list[float],
+    emitted_at: dict,
+) -> None:
+    service = AgentService(session_id)
+
+    async def broadcast(update):
+        received = time.perf_counter()
+        key = update.metadata.get("tool_id") or update.content
+        if key in emitted_at:
+            latencies.append(received - emitted_at[key])
+        await stream_handler.broadcast_update(session_id, update)
+
+    async for update in service.process_message("benchmark"):
+        await broadcast(update)
+
+
+async def main(args: argparse.Namespace) -> None:
+    setup_logging("WARNING")
+    stream_handler = StreamHandler()
+    latencies: list[float] = []
+    emitted_at: dict = {}
+    idle = asyncio.Event()
+
+    fake_loop = make_fake_loop(emitted_at, args.updates, args.gap, idle)
+    with mock.patch(
+        "computer_use_backend.services.agent_service.sampling_loop", fake_loop
+    ):
+        tasks = [
+            asyncio.create_task(
+                run_session(f"bench-{i}", stream_handler, latencies, emitted_at)
+            )
+            for i in range(args.sessions)
+        ]
+
+        # Wait for every burst to be delivered before measuring idle CPU
+        expected = args.sessions * args.updates
+        while len(latencies) < expected:
+            await asyncio.sleep(0.01)
+
+        cpu_start = time.process_time()
+        wall_start = time.perf_counter()
+        await asyncio.sleep(args.idle)
+        idle_cpu = time.process_time() - cpu_start
+        idle_wall = time.perf_counter() - wall_start
+
+        idle.set()
+        await asyncio.gather(*tasks)
+
+    latencies_ms = sorted(latency * 1000 for latency in latencies)
+    p99 = latencies_ms[int(len(latencies_ms) * 0.99) - 1]
+    print(f"sessions:            {args.sessions}")
+    print(f"updates delivered:   {len(latencies_ms)}")
+    print(f"latency mean (ms):   {statistics.mean(latencies_ms):.3f}")
+    print(f"latency p50 (ms):    {statistics.median(latencies_ms):.3f}")
+    print(f"latency p99 (ms):    {p99:.3f}")
+    print(f"latency max (ms):    {latencies_ms[-1]:.3f}")
+    print(f"idle CPU (%):        {100 * idle_cpu / idle_wall:.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sessions", type=int, default=100)
+    parser.add_argument("--updates", type=int, default=20)
+    parser.add_argument("--gap", type=float, default=0.01, help="seconds between updates")
+    parser.add_argument("--idle", type=float, default=5.0, help="idle window in seconds")
+    asyncio.run(main(parser.parse_args()))
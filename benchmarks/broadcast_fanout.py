@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Benchmark StreamHandler.broadcast_update fan-out.
+
+Compares the current handler against the original approach (one send_json per
+client, sent one after another under a global lock) in two shapes:
+1,000 subscribers on one session, and 1,000 sessions with one subscriber each.
+Clients are in-memory stand-ins that encode JSON the way Starlette's
+send_json does and yield to the event loop like a real socket write.
+
+Usage:
+    python benchmarks/broadcast_fanout.py --subscribers 1000 --sessions 1000 --updates 50
+"""
+
+import argparse
+import asyncio
+import json
+import statistics
+import time
+from datetime import datetime
+
+from computer_use_backend.logging_config import setup_logging
+from computer_use_backend.models.schemas import AgentUpdate, UpdateType
+from computer_use_backend.services.stream_handler import StreamHandler
+
+
+class FakeWebSocket:
+    def __init__(self):
+        self.bytes_sent = 0
+
+    async def send_text(self, data: str) -> None:
+        self.bytes_sent += len(data)
+        await asyncio.sleep(0)
+
+    async def send_json(self, data) -> None:
+        await self.send_text(json.dumps(data, separators=(",", ":"), ensure_ascii=False))
+
+
+class SequentialStreamHandler(StreamHandler):
+    """The original broadcast: serialize per client, send one at a time, global lock."""
+
+    def __init__(self):
+        super().__init__()
+        self._lock = asyncio.Lock()
+
+    async def register_client(self, session_id: str, websocket) -> None:
+        self.connections[session_id] = self.connections.get(session_id, frozenset()) | {websocket}
+
+    async def broadcast_update(self, session_id: str, update: AgentUpdate) -> None:
+        if session_id not in self.connections:
+            return
+        update_data = {
+            "type": "agent_update",
+            "update_type": update.update_type.value,
+            "content": update.content,
+            "timestamp": update.timestamp.isoformat(),
+            "metadata": update.metadata,
+        }
+        async with self._lock:
+            clients = list(self.connections.get(session_id, []))
+        for websocket in clients:
+            await websocket.send_json(update_data)
+
+
+def make_update() -> AgentUpdate:
+    return AgentUpdate(
+        update_type=UpdateType.TOOL_RESULT,
+        content="x" * 2000,
+        timestamp=datetime.utcnow(),
+        metadata={"tool_id": "toolu_01", "partial": True, "stream": "stdout"},
+    )
+
+
+async def run_case(handler: StreamHandler, sessions: int, per_session: int, updates: int) -> list[float]:
+    for s in range(sessions):
+        for _ in range(per_session):
+            await handler.register_client(f"session-{s}", FakeWebSocket())
+
+    update = make_update()
+    latencies = []
+    for _ in range(updates):
+        start = time.perf_counter()
+        # Every session gets an update at the same time, as with concurrent agents
+        await asyncio.gather(
+            *(handler.broadcast_update(f"session-{s}", update) for s in range(sessions))
+        )
+        # Timed until delivered, not just queued
+        await handler.wait_idle()
+        latencies.append(time.perf_counter() - start)
+    await handler.close()
+    return latencies
+
+
+def report(name: str, latencies: list[float], deliveries: int) -> None:
+    latencies_ms = sorted(latency * 1000 for latency in latencies)
+    p95 = latencies_ms[int(len(latencies_ms) * 0.95) - 1]
+    print(f"  {name}:")
+    print(f"    deliveries/sec:    {deliveries * len(latencies) / sum(latencies):,.0f}")
+    print(f"    round p50 (ms):    {statistics.median(latencies_ms):.2f}")
+    print(f"    round p95 (ms):    {p95:.2f}")
+
+
+async def main(args: argparse.Namespace) -> None:
+    setup_logging("WARNING")
+    cases = [
+        (f"{args.subscribers} subscribers on one session", 1, args.subscribers),
+        (f"{args.sessions} sessions with one subscriber", args.sessions, 1),
+    ]
+    for title, sessions, per_session in cases:
+        print(f"{title}:")
+        for name, handler_cls in (
+            ("sequential send_json (original)", SequentialStreamHandler),
+            ("serialize once, per-client writers", StreamHandler),
+        ):
+            latencies = await run_case(handler_cls(), sessions, per_session, args.updates)
+            report(name, latencies, sessions * per_session)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--subscribers", type=int, default=1000)
+    parser.add_argument("--sessions", type=int, default=1000)
+    parser.add_argument("--updates", type=int, default=50)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Benchmark ComputerTool input latency: persistent XTEST channel vs. xdotool subprocesses.
+
+Starts a private Xvfb display and sends N mouse-move-and-click actions through
+BaseComputerTool.shell, once over the in-process XTEST channel and once by
+forking xdotool, and reports per-action latency.
+
+Requires Xvfb and python-xlib, plus xdotool for the subprocess path.
+
+Usage:
+    python benchmarks/input_latency.py --count 200
+"""
+
+import argparse
+import asyncio
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import time
+
+
+async def measure(tool, count: int) -> list[float]:
+    latencies = []
+    for i in range(count):
+        command = f"{tool.xdotool} mousemove --sync {i % 500} {i % 300} click 1"
+        start = time.perf_counter()
+        result = await tool.shell(command, take_screenshot=False)
+        latencies.append(time.perf_counter() - start)
+        assert not result.error, result.error
+    return latencies
+
+
+def report(name: str, latencies: list[float]) -> None:
+    latencies_us = sorted(latency * 1e6 for latency in latencies)
+    p95 = latencies_us[int(len(latencies_us) * 0.95) - 1]
+    print(f"{name}:")
+    print(f"  actions/sec:       {len(latencies) / sum(latencies):.1f}")
+    print(f"  latency p50 (us):  {statistics.median(latencies_us):.1f}")
+    print(f"  latency p95 (us):  {p95:.1f}")
+
+
+async def main(args: argparse.Namespace) -> None:
+    if not shutil.which("Xvfb"):
+        sys.exit("Xvfb is required for this benchmark")
+
+    xvfb = subprocess.Popen(
+        ["Xvfb", f":{args.display}", "-screen", "0", "1024x768x24", "-nolisten", "tcp"],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        os.environ.update(WIDTH="1024", HEIGHT="768", DISPLAY_NUM=str(args.display))
+        os.environ.pop("XVFB_FBDIR", None)
+        from computer_use_demo.tools import ComputerTool20250124
+
+        for _ in range(100):
+            tool = ComputerTool20250124()
+            if tool._input is not None:
+                break
+            await asyncio.sleep(0.05)
+        else:
+            sys.exit("could not open an XTEST connection (is python-xlib installed?)")
+
+        report("XTEST channel (in-process)", await measure(tool, args.count))
+
+        if shutil.which("xdotool"):
+            tool._input = None
+            report("xdotool subprocess", await measure(tool, args.count))
+        else:
+            print("subprocess path skipped: xdotool is required")
+    finally:
+        xvfb.terminate()
+        xvfb.wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--count", type=int, default=200)
+    parser.add_argument("--display", type=int, default=98)
+    asyncio.run(main(parser.parse_args()))
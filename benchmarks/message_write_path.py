@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+"""
+Benchmark database round trips on the message write path.
+
+Replays what POST /sessions/{id}/messages and the assistant reply do to the
+database, for the original path (look the session up in the router, again in
+SessionManager.create_message, INSERT, COMMIT, refresh) and the current one
+(live-session cache, one INSERT ... SELECT ... RETURNING, COMMIT), then with
+the write-behind buffer batching every session's messages. Every statement
+the driver executes and every COMMIT counts as a round trip; an exchange is
+one user message plus its assistant reply. The write-behind case sends each
+round of messages from all sessions concurrently, as separate clients would.
+
+Usage:
+    python benchmarks/message_write_path.py --sessions 20 --messages 50
+    python benchmarks/message_write_path.py --database-url postgresql+asyncpg://...
+"""
+
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+import uuid
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+
+from computer_use_backend.logging_config import setup_logging
+from computer_use_backend.models.database import Base, Message
+from computer_use_backend.models.schemas import MessageCreate, MessageRole, SessionCreate
+from computer_use_backend.services.message_writer import MessageWriter
+from computer_use_backend.services.session_cache import LiveSessionCache
+from computer_use_backend.services.session_manager import SessionManager
+
+
+class RoundTripCounter:
+    def __init__(self, engine):
+        self.count = 0
+        sync_engine = engine.sync_engine
+        event.listen(sync_engine, "before_cursor_execute", self._statement)
+        event.listen(sync_engine, "commit", self._statement)
+
+    def _statement(self, *args) -> None:
+        self.count += 1
+
+
+class OriginalSessionManager(SessionManager):
+    """create_message as it was: lookup, INSERT, COMMIT, refresh."""
+
+    async def create_message(self, db, session_id, message_data):
+        session = await self.get_session(db, session_id)
+        if not session:
+            raise ValueError(f"Session {session_id} not found")
+        message = Message(
+            session_id=uuid.UUID(session_id),
+            role=message_data.role.value,
+            content=message_data.content,
+            message_metadata=message_data.message_metadata or {},
+        )
+        db.add(message)
+        await db.commit()
+        await db.refresh(message)
+        return message
+
+
+async def original_path(mgr: SessionManager, db: AsyncSession, session_id: str) -> None:
+    # Router's existence check, then the user message and the assistant reply
+    await mgr.get_session(db, session_id)
+    await mgr.create_message(db, session_id, MessageCreate(content="hello"))
+    await mgr.create_message(
+        db, session_id, MessageCreate(content="hi there", role=MessageRole.ASSISTANT)
+    )
+
+
+async def current_path(mgr: SessionManager, db: AsyncSession, session_id: str) -> None:
+    await mgr.check_session(db, session_id)
+    await mgr.create_message(db, session_id, MessageCreate(content="hello"))
+    await mgr.create_message(
+        db, session_id, MessageCreate(content="hi there", role=MessageRole.ASSISTANT)
+    )
+
+
+async def write_behind_path(
+    mgr: SessionManager, db: AsyncSession, writer: MessageWriter, session_id: str
+) -> None:
+    await mgr.check_session(db, session_id)
+    await writer.write(session_id, MessageCreate(content="hello"))
+    await writer.submit(session_id, MessageCreate(content="hi there", role=MessageRole.ASSISTANT))
+
+
+async def run_case(database_url: str, manager: SessionManager, path, sessions: int, messages: int):
+    engine = create_async_engine(database_url)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(Base.metadata.create_all)
+    maker = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+
+    async with maker() as db:
+        session_ids = [
+            str((await manager.create_session(db, SessionCreate())).session_id)
+            for _ in range(sessions)
+        ]
+
+    counter = RoundTripCounter(engine)
+    start = time.perf_counter()
+    async with maker() as db:
+        for _ in range(messages):
+            for session_id in session_ids:
+                await path(manager, db, session_id)
+    elapsed = time.perf_counter() - start
+    await engine.dispose()
+    return counter.count, elapsed
+
+
+async def run_write_behind(database_url: str, manager: SessionManager, sessions: int, messages: int,
+                           batch_size: int, flush_interval: float):
+    engine = create_async_engine(database_url)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(Base.metadata.create_all)
+    maker = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+
+    async with maker() as db:
+        session_ids = [
+            str((await manager.create_session(db, SessionCreate())).session_id)
+            for _ in range(sessions)
+        ]
+
+    writer = MessageWriter(maker, batch_size=batch_size, flush_interval=flush_interval)
+    counter = RoundTripCounter(engine)
+    start = time.perf_counter()
+    async with maker() as db:
+        for _ in range(messages):
+            await asyncio.gather(*(
+                write_behind_path(manager, db, writer, session_id) for session_id in session_ids
+            ))
+    await writer.close()
+    elapsed = time.perf_counter() - start
+    await engine.dispose()
+    return counter.count, elapsed
+
+
+async def main(args: argparse.Namespace) -> None:
+    setup_logging("WARNING")
+    database_url = args.database_url
+    temp_path = None
+    if database_url is None:
+        fd, temp_path = tempfile.mkstemp(suffix=".db")
+        os.close(fd)
+        database_url = f"sqlite+aiosqlite:///{temp_path}"
+
+    exchanges = args.sessions * args.messages
+    print(f"{args.sessions} sessions x {args.messages} messages, each with an assistant reply:")
+    try:
+        for name, manager, path in (
+            ("lookup + INSERT + COMMIT + refresh (original)", OriginalSessionManager(), original_path),
+            ("cached check + INSERT ... RETURNING", SessionManager(
+                session_cache=LiveSessionCache(ttl=args.cache_ttl, max_size=args.sessions)
+            ), current_path),
+        ):
+            round_trips, elapsed = await run_case(
+                database_url, manager, path, args.sessions, args.messages
+            )
+            print(f"  {name}:")
+            print(f"    round trips per exchange: {round_trips / exchanges:.2f}")
+            print(f"    exchanges/sec:            {exchanges / elapsed:,.0f}")
+        round_trips, elapsed = await run_write_behind(
+            database_url,
+            SessionManager(session_cache=LiveSessionCache(ttl=args.cache_ttl, max_size=args.sessions)),
+            args.sessions,
+            args.messages,
+            args.batch_size,
+            args.flush_interval,
+        )
+        print(f"  write-behind, batches of up to {args.batch_size}:")
+        print(f"    round trips per exchange: {round_trips / exchanges:.2f}")
+        print(f"    exchanges/sec:            {exchanges / elapsed:,.0f}")
+    finally:
+        if temp_path:
+            os.unlink(temp_path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sessions", type=int, default=20)
+    parser.add_argument("--messages", type=int, default=50)
+    parser.add_argument("--cache-ttl", type=float, default=5.0)
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--flush-interval", type=float, default=0.05)
+    parser.add_argument("--database-url", default=None)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Benchmark screenshot capture: in-process framebuffer vs. screenshot subprocesses.
+
+Starts a private Xvfb display with -fbdir, then takes N screenshots through
+ComputerTool using the memory-mapped framebuffer and N through the legacy
+gnome-screenshot/scrot + ImageMagick path, and reports throughput and latency.
+
+Requires Xvfb, plus scrot (or gnome-screenshot) and ImageMagick for the legacy path.
+
+Usage:
+    python benchmarks/screenshot_capture.py --count 50 --width 1280 --height 800
+"""
+
+import argparse
+import asyncio
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+
+async def measure(tool, count: int) -> list[float]:
+    latencies = []
+    for _ in range(count):
+        start = time.perf_counter()
+        result = await tool.screenshot()
+        latencies.append(time.perf_counter() - start)
+        assert result.base64_image
+    return latencies
+
+
+def report(name: str, latencies: list[float]) -> None:
+    latencies_ms = sorted(latency * 1000 for latency in latencies)
+    p95 = latencies_ms[int(len(latencies_ms) * 0.95) - 1]
+    print(f"{name}:")
+    print(f"  screenshots/sec:   {len(latencies) / sum(latencies):.1f}")
+    print(f"  latency p50 (ms):  {statistics.median(latencies_ms):.2f}")
+    print(f"  latency p95 (ms):  {p95:.2f}")
+
+
+async def main(args: argparse.Namespace) -> None:
+    if not shutil.which("Xvfb"):
+        sys.exit("Xvfb is required for this benchmark")
+
+    fbdir = tempfile.mkdtemp(prefix="xvfb-bench-")
+    xvfb = subprocess.Popen(
+        [
+            "Xvfb", f":{args.display}",
+            "-screen", "0", f"{args.width}x{args.height}x24",
+            "-fbdir", fbdir,
+            "-ac", "-nolisten", "tcp",
+        ],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        framebuffer = Path(fbdir) / "Xvfb_screen0"
+        for _ in range(100):
+            if framebuffer.exists():
+                break
+            await asyncio.sleep(0.05)
+        else:
+            sys.exit("Xvfb did not create its framebuffer file")
+
+        os.environ.update(
+            WIDTH=str(args.width),
+            HEIGHT=str(args.height),
+            DISPLAY_NUM=str(args.display),
+            XVFB_FBDIR=fbdir,
+        )
+        from computer_use_demo.tools import ComputerTool20250124
+
+        tool = ComputerTool20250124()
+        assert tool._framebuffer is not None, "framebuffer capture unavailable"
+        report("framebuffer (in-process)", await measure(tool, args.count))
+
+        if shutil.which("convert") and (
+            shutil.which("scrot") or shutil.which("gnome-screenshot")
+        ):
+            tool._framebuffer = None
+            report("subprocess (scrot + convert)", await measure(tool, args.count))
+        else:
+            print("legacy path skipped: scrot/gnome-screenshot and convert are required")
+    finally:
+        xvfb.terminate()
+        xvfb.wait()
+        shutil.rmtree(fbdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--count", type=int, default=50)
+    parser.add_argument("--width", type=int, default=1280)
+    parser.add_argument("--height", type=int, default=800)
+    parser.add_argument("--display", type=int, default=97)
+    asyncio.run(main(parser.parse_args()))
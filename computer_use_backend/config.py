@@ -1,5 +1,5 @@
 from functools import lru_cache
-from typing import List
+from typing import List, Literal, Optional
 from pydantic import Field
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
@@ -27,18 +27,107 @@ class Settings(BaseSettings):
     anthropic_api_key: str = Field(default="")
     default_model: str = Field(default="claude-sonnet-4-5-20250929")
     max_tokens: int = Field(default=4096)
+    anthropic_base_url: Optional[str] = Field(default=None)
+    stream_responses: bool = Field(default=True)
+    # Live tool output is sent at most once per interval, capped per update
+    tool_output_flush_interval: float = Field(default=0.1)
+    tool_output_max_chars: int = Field(default=8192)
+    
+    # Shared HTTP connection pool for model API calls
+    anthropic_max_connections: int = Field(default=100)
+    anthropic_max_keepalive_connections: int = Field(default=20)
+    anthropic_keepalive_expiry: float = Field(default=30.0)
+    anthropic_timeout: float = Field(default=600.0)
+    anthropic_connect_timeout: float = Field(default=5.0)
     
     width: int = Field(default=1024)
     height: int = Field(default=768)
     display_num: int = Field(default=1)
+    # Xvfb exposes each display's framebuffer under <xvfb_fbdir>/<display_num>
+    xvfb_fbdir: str = Field(default="/tmp/xvfb")
+    # After an action, wait until the screen is unchanged for the quiet window,
+    # but never longer than the timeout, before taking the screenshot
+    screen_settle_quiet_window: float = Field(default=0.3)
+    screen_settle_timeout: float = Field(default=2.0)
     
     max_concurrent_sessions: int = Field(default=100)
+    # Seconds a worker may sit idle before the reaper tears it down
     worker_timeout: int = Field(default=300)
+    worker_reap_interval: float = Field(default=30.0)
+    # Requests beyond max_concurrent_sessions wait in a bounded queue
+    admission_queue_size: int = Field(default=50)
+    admission_timeout: float = Field(default=30.0)
+    admission_retry_after: int = Field(default=10)
+    # Initialized workers kept ready so new sessions don't wait for Xvfb/x11vnc
+    warm_pool_size: int = Field(default=2)
+    # "inline" runs agents on the API event loop; "process" gives each worker
+    # a child process so agent work spreads across cores
+    worker_execution: Literal["inline", "process"] = Field(default="inline")
+    worker_process_startup_timeout: float = Field(default=30.0)
+    worker_process_stop_timeout: float = Field(default=5.0)
     
     vnc_base_port: int = Field(default=5900)
     vnc_display_base: int = Field(default=1)
+    # Seconds to wait for Xvfb and x11vnc to accept connections
+    vnc_startup_timeout: float = Field(default=10.0)
+    # Seconds between SIGTERM and SIGKILL when stopping them
+    vnc_stop_timeout: float = Field(default=2.0)
+    # Read buffer for relaying VNC traffic to browsers
+    vnc_proxy_buffer_size: int = Field(default=65536)
     
     max_message_size: int = Field(default=1024 * 1024)
+    # Messages per page of GET /sessions/{id}/messages, and the most a client may ask for
+    message_page_size: int = Field(default=100)
+    message_page_max: int = Field(default=1000)
+    # Stored messages replayed into the agent when a session that lost its
+    # worker (evicted, reaped or crashed) gets a new one
+    history_restore_messages: int = Field(default=100)
+    # Same for GET /sessions/
+    session_page_size: int = Field(default=50)
+    session_page_max: int = Field(default=500)
+    # Seconds this process trusts that a session it has seen is still live,
+    # saving the lookup on every message; 0 disables the cache
+    session_cache_ttl: float = Field(default=5.0)
+    session_cache_size: int = Field(default=10000)
+    # Batch message inserts from all sessions through a write-behind buffer.
+    # A batch is written once it holds message_batch_size messages or
+    # message_flush_interval seconds after its first one; writers wait once
+    # message_max_pending messages are buffered
+    message_write_behind: bool = Field(default=True)
+    message_batch_size: int = Field(default=100)
+    message_flush_interval: float = Field(default=0.05)
+    message_max_pending: int = Field(default=10000)
+    # Outbound updates buffered per WebSocket client, and what to do with a
+    # client that falls that far behind: drop_oldest, coalesce or disconnect
+    stream_client_queue_size: int = Field(default=256)
+    stream_slow_client_policy: Literal["drop_oldest", "coalesce", "disconnect"] = Field(
+        default="drop_oldest"
+    )
+    # Recent updates kept per session for clients resuming with ?since=<seq>
+    stream_replay_size: int = Field(default=1000)
+    # How updates reach WebSocket clients: "memory" for a single process, or
+    # "redis" to share them between uvicorn workers and replicas
+    broadcast_backend: Literal["memory", "redis"] = Field(default="memory")
+    redis_url: str = Field(default="redis://localhost:6379/0")
+    broadcast_channel_prefix: str = Field(default="stream")
+    # Where session ownership is recorded: "memory" for a single process, or
+    # "redis" so any process can route a session to the one running its worker
+    worker_registry: Literal["memory", "redis"] = Field(default="memory")
+    registry_prefix: str = Field(default="registry")
+    # This process's identity (hostname by default) and the base URL other
+    # processes use to reach it; without one they answer with a hint instead
+    node_id: Optional[str] = Field(default=None)
+    node_url: Optional[str] = Field(default=None)
+    node_heartbeat_interval: float = Field(default=5.0)
+    # A process that hasn't sent a heartbeat for this long is presumed dead
+    node_ttl: float = Field(default=15.0)
+    # Forward requests to the owning process (off: reply with a redirect hint)
+    session_forwarding: bool = Field(default=True)
+    forward_timeout: float = Field(default=60.0)
+    # Shared by all processes and sent with forwarded requests; only requests
+    # carrying it are served without routing. Unset, every request is routed
+    forward_secret: Optional[str] = Field(default=None)
+    # Seconds without activity after which a session is terminated
     session_timeout: int = Field(default=3600)
 
 
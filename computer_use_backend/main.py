@@ -13,8 +13,18 @@ from fastapi.staticfiles import StaticFiles
 from fastapi.responses import FileResponse
 
 from .config import get_settings
-from .database import init_database
+from .database import init_database, get_db_session
 from .logging_config import setup_logging
+from .services import (
+    close_shared_http_client,
+    close_shared_message_writer,
+    get_shared_message_writer,
+    get_shared_session_affinity,
+    get_shared_session_cache,
+    get_shared_stream_handler,
+    get_shared_worker_pool,
+)
+from .services.session_manager import SessionManager
 from .routers import sessions, health, websocket, vnc
 
 @asynccontextmanager
@@ -30,10 +40,42 @@ async def lifespan(app: FastAPI) -> AsyncGenerator[None, None]:
     logger.info("Initializing database...")
     await init_database()
     
+    # Batch message inserts; None when disabled or the database is unavailable
+    message_writer = get_shared_message_writer()
+    if message_writer is not None:
+        message_writer.start()
+    
+    # Subscribe to updates published by other server processes
+    await get_shared_stream_handler().start()
+    
+    # Start pre-warming workers for new sessions and reaping idle ones
+    worker_pool = get_shared_worker_pool()
+    
+    async def expire_session(session_id: str) -> None:
+        async for db in get_db_session():
+            await SessionManager(worker_pool, get_shared_session_cache()).terminate_session(db, session_id)
+            break
+        get_shared_stream_handler().discard_session(session_id)
+        await get_shared_session_affinity().release(session_id)
+    
+    worker_pool.on_session_expired = expire_session
+    # A session without a worker produces no updates; free its replay ring meanwhile
+    worker_pool.on_worker_retired = get_shared_stream_handler().trim_session
+    await worker_pool.start()
+    
+    # Advertise this process for session placement and routing
+    await get_shared_session_affinity().start()
+    
     logger.info("Computer Use Backend started successfully")
     yield
     
     logger.info("Computer Use Backend shutting down...")
+    await get_shared_session_affinity().close()
+    await worker_pool.cleanup_all()
+    await get_shared_stream_handler().close()
+    # After the workers, so their final replies are buffered before the last flush
+    await close_shared_message_writer()
+    await close_shared_http_client()
 
 def create_app() -> FastAPI:
     """Create and configure the FastAPI application."""
@@ -53,6 +95,8 @@ def create_app() -> FastAPI:
         allow_credentials=True,
         allow_methods=["*"],
         allow_headers=["*"],
+        # Message history paging cursors
+        expose_headers=["X-Cursor-Before", "X-Cursor-After", "X-Has-More"],
     )
     
     # Include routers
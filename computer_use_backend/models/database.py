@@ -3,10 +3,10 @@ SQLAlchemy database models for Computer Use Backend.
 """
 
 import uuid
-from datetime import datetime
+from datetime import datetime, timezone
 from typing import Dict, Any, Optional
 
-from sqlalchemy import Column, String, DateTime, Text, JSON, ForeignKey, Integer
+from sqlalchemy import Column, String, DateTime, Text, JSON, ForeignKey, Index, Integer
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
@@ -18,6 +18,11 @@ class Session(Base):
     """Session model for storing session information."""
     
     __tablename__ = "sessions"
+    __table_args__ = (
+        # Listing by status newest first, paged on (created_at, session_id),
+        # and per-status counts without touching the table
+        Index("ix_sessions_status_created_at", "status", "created_at", "session_id"),
+    )
     
     session_id = Column(
         UUID(as_uuid=True),
@@ -27,6 +32,7 @@ class Session(Base):
     )
     created_at = Column(
         DateTime(timezone=True),
+        default=lambda: datetime.now(timezone.utc),
         server_default=func.now(),
         nullable=False
     )
@@ -56,6 +62,10 @@ class Message(Base):
     """Message model for storing conversation messages."""
     
     __tablename__ = "messages"
+    __table_args__ = (
+        # Keyset pagination of a session's history in (timestamp, message_id) order
+        Index("ix_messages_session_timestamp_id", "session_id", "timestamp", "message_id"),
+    )
     
     message_id = Column(
         UUID(as_uuid=True),
@@ -77,6 +87,9 @@ class Message(Base):
     content = Column(Text, nullable=False)
     timestamp = Column(
         DateTime(timezone=True),
+        # Set by the app with full precision so messages written in the same
+        # second (SQLite's now()) still page in the order they were written
+        default=lambda: datetime.now(timezone.utc),
         server_default=func.now(),
         nullable=False,
         index=True
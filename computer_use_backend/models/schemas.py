@@ -25,6 +25,7 @@ class MessageRole(str, Enum):
 class UpdateType(str, Enum):
     """Agent update type enumeration."""
     THINKING = "thinking"
+    CONTENT_DELTA = "content_delta"
     TOOL_USE = "tool_use"
     TOOL_RESULT = "tool_result"
     SCREENSHOT = "screenshot"
@@ -76,12 +77,19 @@ class MessageResponse(BaseModel):
     class Config:
         from_attributes = True
 
+class SessionSummary(BaseModel):
+    """Session counts for dashboards."""
+    total: int
+    by_status: Dict[str, int] = Field(default_factory=dict)
+
 class AgentUpdate(BaseModel):
     """Schema for agent execution updates."""
     update_type: UpdateType
     content: str
     timestamp: datetime
     metadata: Dict[str, Any] = Field(default_factory=dict)
+    # Per-session position in the stream, assigned when broadcast
+    seq: Optional[int] = None
 
 class HealthResponse(BaseModel):
     """Schema for health check response."""
@@ -52,4 +52,11 @@ async def detailed_health_check() -> Dict[str, Any]:
         }
         logger.error("Database health check failed", error=str(e))
     
+    # Stream broadcast between server processes
+    from ..services import get_shared_stream_handler
+    broadcast = get_shared_stream_handler().backend.stats()
+    if broadcast.get("subscribed") is False:
+        health_status["status"] = "degraded"
+    health_status["components"]["broadcast"] = broadcast
+    
     return health_status
\ No newline at end of file
@@ -1,11 +1,23 @@
-from typing import List, Dict, Any
-from fastapi import APIRouter, Depends, HTTPException, status, BackgroundTasks
+import uuid
+from datetime import datetime
+from typing import List, Dict, Any, Optional
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, status, BackgroundTasks
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from ..config import get_settings
 from ..database import get_db_session
-from ..models.schemas import SessionCreate, SessionResponse, MessageResponse, MessageCreate, MessageRole, UpdateType
-from ..services.session_manager import SessionManager
-from ..services import get_shared_stream_handler, get_shared_worker_pool
+from ..models.schemas import SessionCreate, SessionResponse, SessionStatus, SessionSummary, MessageResponse, MessageCreate, MessageRole, UpdateType
+from ..services.message_writer import MessageWriter
+from ..services.session_affinity import SessionAffinity
+from ..services.session_manager import SessionManager, encode_message_cursor, encode_session_cursor
+from ..services.worker import AdmissionQueueFull, AdmissionTimeout
+from ..services import (
+    get_shared_message_writer,
+    get_shared_session_affinity,
+    get_shared_session_cache,
+    get_shared_stream_handler,
+    get_shared_worker_pool,
+)
 from ..logging_config import get_logger
 
 router = APIRouter()
@@ -14,7 +26,15 @@ logger = get_logger(__name__)
 
 def get_session_manager():
     pool = get_shared_worker_pool()
-    return SessionManager(pool)
+    return SessionManager(pool, get_shared_session_cache())
+
+
+def get_session_affinity() -> SessionAffinity:
+    return get_shared_session_affinity()
+
+
+def get_message_writer() -> Optional[MessageWriter]:
+    return get_shared_message_writer()
 
 
 @router.post("/", response_model=SessionResponse, status_code=status.HTTP_201_CREATED)
@@ -22,25 +42,80 @@ async def create_session(
     session_data: SessionCreate,
     db: AsyncSession = Depends(get_db_session),
     mgr: SessionManager = Depends(get_session_manager),
+    affinity: SessionAffinity = Depends(get_session_affinity),
 ):
+    session_id = uuid.uuid4()
     try:
-        sess = await mgr.create_session(db, session_data)
-        logger.info("Session created", session_id=str(sess.session_id))
+        # Place the session on the least-loaded node before it exists anywhere
+        owner = await affinity.place_session(str(session_id))
+        sess = await mgr.create_session(db, session_data, session_id=session_id, worker_id=owner)
+        logger.info("Session created", session_id=str(sess.session_id), owner=owner)
         return SessionResponse.model_validate(sess)
     except Exception as e:
         logger.error("Failed to create session", error=str(e))
+        try:
+            await affinity.release(str(session_id))
+        except Exception:
+            pass
         raise HTTPException(status_code=500, detail="Failed to create session")
 
 
 @router.get("/", response_model=List[SessionResponse])
 async def list_sessions(
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1),
+    before: Optional[str] = Query(None, description="Cursor; sessions created before it"),
+    status_filter: Optional[List[SessionStatus]] = Query(None, alias="status"),
+    created_after: Optional[datetime] = Query(None),
+    created_before: Optional[datetime] = Query(None),
     db: AsyncSession = Depends(get_db_session),
     mgr: SessionManager = Depends(get_session_manager),
 ):
-    sessions = await mgr.list_sessions(db)
+    """
+    List sessions newest first, one page at a time.
+    
+    Terminated sessions are left out unless asked for with `status`. Pass
+    X-Cursor-Before from the response as `before` to get the next page;
+    X-Has-More says whether there is one.
+    """
+    settings = get_settings()
+    limit = min(limit or settings.session_page_size, settings.session_page_max)
+    try:
+        sessions, has_more = await mgr.get_session_page(
+            db,
+            limit,
+            before=before,
+            statuses=[s.value for s in status_filter] if status_filter else None,
+            created_after=created_after,
+            created_before=created_before,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    
+    if sessions:
+        response.headers["X-Cursor-Before"] = encode_session_cursor(sessions[-1])
+    response.headers["X-Has-More"] = "true" if has_more else "false"
     return [SessionResponse.model_validate(s) for s in sessions]
 
 
+@router.get("/summary", response_model=SessionSummary)
+async def summarize_sessions(
+    status_filter: Optional[List[SessionStatus]] = Query(None, alias="status"),
+    created_after: Optional[datetime] = Query(None),
+    created_before: Optional[datetime] = Query(None),
+    db: AsyncSession = Depends(get_db_session),
+    mgr: SessionManager = Depends(get_session_manager),
+) -> SessionSummary:
+    """Session counts per status, with the same filters as the listing."""
+    by_status = await mgr.summarize_sessions(
+        db,
+        statuses=[s.value for s in status_filter] if status_filter else None,
+        created_after=created_after,
+        created_before=created_before,
+    )
+    return SessionSummary(total=sum(by_status.values()), by_status=by_status)
+
+
 @router.get("/{session_id}", response_model=SessionResponse)
 async def get_session(
     session_id: str,
@@ -55,10 +130,26 @@ async def get_session(
 @router.get("/{session_id}/messages", response_model=List[MessageResponse])
 async def get_session_messages(
     session_id: str,
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1),
+    before: Optional[str] = Query(None, description="Cursor; messages older than it"),
+    after: Optional[str] = Query(None, description="Cursor; messages newer than it"),
+    since: Optional[datetime] = Query(None, description="Messages at or after this time"),
     db: AsyncSession = Depends(get_db_session),
     session_manager: SessionManager = Depends(get_session_manager),
+    writer: Optional[MessageWriter] = Depends(get_message_writer),
 ) -> List[MessageResponse]:
-    """Get message history for a session."""
+    """
+    Get a page of message history for a session, oldest first.
+    
+    Without `after` or `since` this is the latest page. X-Cursor-Before and
+    X-Cursor-After hold the cursors of the first and last message, to page
+    back with `before` or poll for new messages with `after`. X-Has-More
+    says whether the page stopped short of the end it was read towards.
+    Messages still in the write-behind buffer are included.
+    """
+    settings = get_settings()
+    limit = min(limit or settings.message_page_size, settings.message_page_max)
     try:
         # Verify session exists
         session = await session_manager.get_session(db, session_id)
@@ -68,7 +159,19 @@ async def get_session_messages(
                 detail="Session not found"
             )
         
-        messages = await session_manager.get_session_messages(db, session_id)
+        try:
+            # Taken before the query so a batch committed meanwhile isn't missed
+            pending = writer.pending(session_id) if writer is not None else ()
+            messages, has_more = await session_manager.get_message_page(
+                db, session_id, limit, before=before, after=after, since=since, pending=pending
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+        
+        if messages:
+            response.headers["X-Cursor-Before"] = encode_message_cursor(messages[0])
+            response.headers["X-Cursor-After"] = encode_message_cursor(messages[-1])
+        response.headers["X-Has-More"] = "true" if has_more else "false"
         logger.info("Messages retrieved", session_id=session_id, count=len(messages))
         return [MessageResponse.model_validate(message) for message in messages]
     except HTTPException:
@@ -89,27 +192,78 @@ async def create_message(
     session_id: str,
     message_data: MessageCreate,
     background_tasks: BackgroundTasks,
+    request: Request,
     db: AsyncSession = Depends(get_db_session),
     session_manager: SessionManager = Depends(get_session_manager),
+    affinity: SessionAffinity = Depends(get_session_affinity),
+    writer: Optional[MessageWriter] = Depends(get_message_writer),
 ) -> MessageResponse:
     
     try:
         # Get shared stream handler
         stream_handler = get_shared_stream_handler()
         
-        # Verify session exists
-        session = await session_manager.get_session(db, session_id)
+        # Verify session exists; usually answered from the live-session cache
+        session = await session_manager.check_session(db, session_id)
         if not session:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="Session not found"
             )
-        # Create and persist the message
-        message = await session_manager.create_message(db, session_id, message_data)
         
-        # Get or create worker for this session
+        # The worker lives on the session's owning node; hand the request there
+        forwarded = await affinity.route(request, session_id, claim=True)
+        if forwarded is not None:
+            return forwarded
+        if session.owner != affinity.owner_id:
+            await session_manager.record_owner(db, session_id, affinity.owner_id)
+        
+        # Get or create worker for this session, queueing if the pool is full.
+        # Rejections happen before the message is stored so the client can retry.
+        async def report_queue_position(position: int) -> None:
+            await stream_handler.send_queue_position(session_id, position)
+        
+        try:
+            # The new message isn't stored yet, so it stays out of a restored history
+            worker = await session_manager.get_or_create_worker(
+                session_id,
+                on_queue_position=report_queue_position,
+                db=db,
+                pending=writer.pending(session_id) if writer is not None else (),
+            )
+        except AdmissionQueueFull as e:
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail=str(e),
+                headers={"Retry-After": str(e.retry_after)},
+            )
+        except AdmissionTimeout as e:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail=str(e),
+                headers={"Retry-After": str(e.retry_after)},
+            )
+        except Exception as worker_error:
+            logger.error("Failed to get/create worker", 
+                        session_id=session_id, 
+                        error=str(worker_error))
+            # Continue anyway - the message is still saved, worker can be created later
+            worker = None
+        
+        # Create and persist the message, batched with other sessions' messages
+        # when the write-behind buffer is on; either way it is committed on return
         try:
-            worker = await session_manager.get_or_create_worker(session_id)
+            if writer is not None:
+                message = await writer.write(session_id, message_data)
+            else:
+                message = await session_manager.create_message(db, session_id, message_data)
+        except ValueError:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Session not found"
+            )
+        
+        if worker:
             logger.info("Worker ready for message processing", 
                        session_id=session_id, 
                        worker_id=worker.worker_id,
@@ -148,23 +302,27 @@ async def create_message(
                     # Save agent response to database
                     if agent_response_parts:
                         agent_response = "\n".join(agent_response_parts)
+                        assistant_message = MessageCreate(
+                            content=agent_response,
+                            role=MessageRole.ASSISTANT,
+                            message_metadata={"worker_id": worker.worker_id}
+                        )
                         try:
-                            # Get a new database session for the background task
-                            async for db_session in get_db_session():
-                                assistant_message = MessageCreate(
-                                    content=agent_response,
-                                    role=MessageRole.ASSISTANT,
-                                    message_metadata={"worker_id": worker.worker_id}
-                                )
-                                await session_manager.create_message(
-                                    db_session, 
-                                    session_id, 
-                                    assistant_message
-                                )
-                                logger.info("Agent response saved", 
-                                          session_id=session_id,
-                                          response_length=len(agent_response))
-                                break
+                            if writer is not None:
+                                # Buffered; GET /messages sees it until the batch lands
+                                await writer.submit(session_id, assistant_message)
+                            else:
+                                # Get a new database session for the background task
+                                async for db_session in get_db_session():
+                                    await session_manager.create_message(
+                                        db_session, 
+                                        session_id, 
+                                        assistant_message
+                                    )
+                                    break
+                            logger.info("Agent response saved", 
+                                      session_id=session_id,
+                                      response_length=len(agent_response))
                         except Exception as save_error:
                             logger.error("Failed to save agent response",
                                        session_id=session_id,
@@ -188,12 +346,6 @@ async def create_message(
             
             # Start processing in background
             background_tasks.add_task(process_and_stream)
-            
-        except Exception as worker_error:
-            logger.error("Failed to get/create worker", 
-                        session_id=session_id, 
-                        error=str(worker_error))
-            # Continue anyway - message is saved, worker can be created later
         
         logger.info("Message created", session_id=session_id, message_id=str(message.message_id))
         
@@ -210,10 +362,15 @@ async def create_message(
 @router.get("/workers/health")
 async def get_workers_health(
     session_manager: SessionManager = Depends(get_session_manager),
+    affinity: SessionAffinity = Depends(get_session_affinity),
+    writer: Optional[MessageWriter] = Depends(get_message_writer),
 ) -> Dict[str, Any]:
-    """Get health status of all workers."""
+    """Get health status of this node's workers and the capacity every node advertises."""
     try:
         health_status = await session_manager.get_worker_health()
+        health_status["cluster"] = await affinity.stats()
+        health_status["session_cache"] = session_manager.session_cache.stats()
+        health_status["message_writer"] = writer.stats() if writer is not None else None
         logger.info("Worker health check completed", total_workers=health_status.get("total_workers", 0))
         return health_status
     except Exception as e:
@@ -226,17 +383,26 @@ async def get_workers_health(
 @router.delete("/{session_id}", status_code=status.HTTP_204_NO_CONTENT)
 async def terminate_session(
     session_id: str,
+    request: Request,
     db: AsyncSession = Depends(get_db_session),
     session_manager: SessionManager = Depends(get_session_manager),
-) -> None:
+    affinity: SessionAffinity = Depends(get_session_affinity),
+):
     """Terminate a session."""
     try:
+        # Only the owning node can stop the session's worker
+        forwarded = await affinity.route(request, session_id)
+        if forwarded is not None:
+            return forwarded
+        
         success = await session_manager.terminate_session(db, session_id)
         if not success:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="Session not found"
             )
+        await affinity.release(session_id)
+        get_shared_stream_handler().discard_session(session_id)
         logger.info("Session terminated", session_id=session_id)
     except HTTPException:
         raise
@@ -2,20 +2,27 @@
 VNC proxy endpoints for desktop access.
 """
 
-from fastapi import APIRouter, HTTPException, status, WebSocket, WebSocketDisconnect
+from fastapi import APIRouter, HTTPException, Request, status, WebSocket
 from fastapi.responses import Response
 
-from ..services import get_shared_worker_pool
+from ..config import get_settings
+from ..services import get_shared_session_affinity, get_shared_worker_pool
+from ..services.vnc_proxy import VNCProxy
 from ..logging_config import get_logger
 
 router = APIRouter()
 logger = get_logger(__name__)
 
 @router.get("/{session_id}/info")
-async def get_vnc_info(session_id: str):
+async def get_vnc_info(session_id: str, request: Request):
     """
     Get VNC connection information for a session.
     """
+    # The VNC server runs next to the worker on the session's owning node
+    forwarded = await get_shared_session_affinity().route(request, session_id)
+    if forwarded is not None:
+        return forwarded
+    
     worker_pool = get_shared_worker_pool()
     worker = await worker_pool.get_worker(session_id)
     
@@ -39,16 +46,25 @@ async def get_vnc_info(session_id: str):
         "vnc_port": worker.vnc_port,
         "vnc_url": worker.vnc_server.get_vnc_url(),
         "display": worker.vnc_server.get_display(),
-        "health": health
+        "health": health,
+        "proxy_connections": VNCProxy.session_stats(session_id),
     }
 
 @router.websocket("/{session_id}/stream")
 async def vnc_websocket_proxy(websocket: WebSocket, session_id: str):
     """
     WebSocket proxy for VNC connections.
-    This allows web-based VNC clients (like noVNC) to connect.
+    Relays binary RFB frames between web-based VNC clients (like noVNC) and
+    the session's x11vnc, so VNC ports don't need to be published.
+    Connections to a node that doesn't own the session get the owner hint.
     """
-    await websocket.accept()
+    # The proxy needs the worker's local VNC port, so only its node can serve this
+    if await get_shared_session_affinity().route_websocket(websocket, session_id):
+        return
+    
+    # noVNC asks for the "binary" subprotocol
+    subprotocol = "binary" if "binary" in websocket.scope.get("subprotocols", []) else None
+    await websocket.accept(subprotocol=subprotocol)
     logger.info("VNC WebSocket connection established", session_id=session_id)
     
     worker_pool = get_shared_worker_pool()
@@ -58,31 +74,32 @@ async def vnc_websocket_proxy(websocket: WebSocket, session_id: str):
         await websocket.close(code=1008, reason="VNC server not available")
         return
     
+    settings = get_settings()
+    proxy = VNCProxy(
+        websocket,
+        session_id,
+        worker.vnc_port,
+        buffer_size=settings.vnc_proxy_buffer_size,
+    )
     try:
-        # This would require:
-        # 1. Connect to the VNC server (localhost:vnc_port)
-        # 2. Proxy RFB protocol between WebSocket and VNC server
-        # 3. Handle bidirectional data flow
-        
-        # For now, send a message indicating VNC is available
-        await websocket.send_json({
-            "type": "vnc_info",
-            "vnc_port": worker.vnc_port,
-            "message": "VNC server is running. Use a VNC client to connect.",
-            "vnc_url": worker.vnc_server.get_vnc_url()
-        })
-        
-        # Keep connection alive
-        while True:
-            try:
-                data = await websocket.receive_text()
-                if data == "ping":
-                    await websocket.send_json({"type": "pong"})
-            except WebSocketDisconnect:
-                break
+        await proxy.connect()
+    except OSError as e:
+        logger.error("Failed to connect to VNC server",
+                    session_id=session_id,
+                    vnc_port=worker.vnc_port,
+                    error=str(e))
+        await websocket.close(code=1011, reason="VNC server unreachable")
+        return
     
+    try:
+        await proxy.run()
     except Exception as e:
         logger.error("VNC WebSocket error", session_id=session_id, error=str(e))
     
     finally:
+        try:
+            await websocket.close()
+        except RuntimeError:
+            # Already closed by the client
+            pass
         logger.info("VNC WebSocket connection closed", session_id=session_id)
@@ -2,6 +2,8 @@
 WebSocket endpoints for real-time streaming.
 """
 
+from typing import Optional
+
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Depends
 from sqlalchemy.ext.asyncio import AsyncSession
 
@@ -23,13 +25,16 @@ def get_worker_pool() -> WorkerPool:
 async def websocket_stream(
     websocket: WebSocket,
     session_id: str,
+    since: Optional[int] = None,
     worker_pool: WorkerPool = Depends(get_worker_pool),
 ):
     """
     WebSocket endpoint for real-time agent execution streaming.
     
     Clients connect to this endpoint to receive real-time updates
-    from the Computer Use Agent as it processes messages.
+    from the Computer Use Agent as it processes messages. A reconnecting
+    client passes `?since=<seq>` with the last sequence number it saw to
+    receive only the updates it missed.
     """
     await websocket.accept()
     logger.info("WebSocket connection established", session_id=session_id)
@@ -37,16 +42,23 @@ async def websocket_stream(
     stream_handler = get_shared_stream_handler()
     
     try:
-        # Register this WebSocket connection for the session
-        await stream_handler.register_client(session_id, websocket)
+        # A fresh client starts from now; anything broadcast while the
+        # confirmation is being sent is replayed on registration
+        last_seq = stream_handler.last_seq(session_id)
+        if since is None:
+            since = last_seq
         
-        # Send initial connection confirmation
+        # Send initial connection confirmation ahead of any replayed updates
         await websocket.send_json({
             "type": "connected",
             "session_id": session_id,
-            "message": "Connected to agent stream"
+            "message": "Connected to agent stream",
+            "last_seq": last_seq
         })
         
+        # Register this WebSocket connection for the session
+        await stream_handler.register_client(session_id, websocket, since=since)
+        
         # Keep connection alive and handle incoming messages
         while True:
             try:
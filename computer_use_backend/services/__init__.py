@@ -2,18 +2,31 @@
 Services package with shared instances.
 """
 
+import httpx
+
+from .. import database
+from ..config import get_settings
+from .broadcast import create_broadcast_backend
+from .message_writer import MessageWriter
+from .session_affinity import SessionAffinity
+from .session_cache import LiveSessionCache
 from .stream_handler import StreamHandler
 from .worker import WorkerPool
+from .worker_registry import create_worker_registry
 
 # Shared global instances
 _stream_handler: StreamHandler | None = None
 _worker_pool: WorkerPool | None = None
+_session_affinity: SessionAffinity | None = None
+_session_cache: LiveSessionCache | None = None
+_message_writer: MessageWriter | None = None
+_http_client: httpx.AsyncClient | None = None
 
 def get_shared_stream_handler() -> StreamHandler:
     """Get the shared StreamHandler instance."""
     global _stream_handler
     if _stream_handler is None:
-        _stream_handler = StreamHandler()
+        _stream_handler = StreamHandler(create_broadcast_backend())
     return _stream_handler
 
 def get_shared_worker_pool() -> WorkerPool:
@@ -22,3 +35,65 @@ def get_shared_worker_pool() -> WorkerPool:
     if _worker_pool is None:
         _worker_pool = WorkerPool()
     return _worker_pool
+
+def get_shared_session_affinity() -> SessionAffinity:
+    """Get the shared SessionAffinity instance."""
+    global _session_affinity
+    if _session_affinity is None:
+        _session_affinity = SessionAffinity(create_worker_registry(), get_shared_worker_pool())
+    return _session_affinity
+
+def get_shared_session_cache() -> LiveSessionCache:
+    """Get the shared cache of sessions known to be live."""
+    global _session_cache
+    if _session_cache is None:
+        settings = get_settings()
+        _session_cache = LiveSessionCache(settings.session_cache_ttl, settings.session_cache_size)
+    return _session_cache
+
+def get_shared_message_writer() -> MessageWriter | None:
+    """Get the shared message write-behind buffer, or None if it is disabled or there is no database."""
+    global _message_writer
+    if _message_writer is None:
+        settings = get_settings()
+        if not settings.message_write_behind or database.async_session_maker is None:
+            return None
+        _message_writer = MessageWriter(
+            lambda: database.async_session_maker(),
+            batch_size=settings.message_batch_size,
+            flush_interval=settings.message_flush_interval,
+            max_pending=settings.message_max_pending,
+        )
+    return _message_writer
+
+async def close_shared_message_writer() -> None:
+    """Write out buffered messages and stop the shared message writer."""
+    global _message_writer
+    if _message_writer is not None:
+        await _message_writer.close()
+        _message_writer = None
+
+def get_shared_http_client() -> httpx.AsyncClient:
+    """Get the shared keep-alive HTTP client used for model API calls."""
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        settings = get_settings()
+        _http_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=settings.anthropic_max_connections,
+                max_keepalive_connections=settings.anthropic_max_keepalive_connections,
+                keepalive_expiry=settings.anthropic_keepalive_expiry,
+            ),
+            timeout=httpx.Timeout(
+                settings.anthropic_timeout,
+                connect=settings.anthropic_connect_timeout,
+            ),
+        )
+    return _http_client
+
+async def close_shared_http_client() -> None:
+    """Close the shared HTTP client and its pooled connections."""
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
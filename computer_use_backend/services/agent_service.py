@@ -4,17 +4,20 @@ Agent service that integrates the Computer Use Agent from computer_use_demo.
 
 import asyncio
 import os
-from typing import AsyncIterator, List, Dict, Any, Optional
+from typing import AsyncIterator, Callable, List, Dict, Any, Optional, Tuple
 from datetime import datetime
 
 # Import from the existing computer_use_demo
 from computer_use_demo.loop import sampling_loop, APIProvider
 from computer_use_demo.tools import (
+    BashTool20250124,
     ToolCollection,
     TOOL_GROUPS_BY_VERSION,
     ToolVersion,
     ToolResult,
 )
+from computer_use_demo.tools.computer import BaseComputerTool
+from anthropic.lib.streaming import BetaMessageStreamEvent
 from anthropic.types.beta import (
     BetaMessageParam,
     BetaContentBlockParam,
@@ -27,25 +30,82 @@ from ..logging_config import get_logger
 
 logger = get_logger(__name__)
 
+
+class ToolOutputCoalescer:
+    """
+    Batches live tool output into rate-limited partial updates.
+    
+    Output written within one flush interval is merged into a single update per
+    tool and stream. If more than `max_chars` arrive in one interval, only the
+    most recent output is kept and the number of skipped characters is reported,
+    so a chatty command can't flood subscribers.
+    """
+    
+    def __init__(
+        self,
+        emit: Callable[[str, str, str, int], None],
+        interval: float,
+        max_chars: int,
+    ):
+        self._emit = emit
+        self._interval = interval
+        self._max_chars = max_chars
+        # (tool_id, stream) -> [text, dropped chars]
+        self._pending: Dict[Tuple[str, str], List[Any]] = {}
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._last_flush = 0.0
+    
+    def write(self, tool_id: str, stream: str, text: str) -> None:
+        """Queue output; it is emitted at the next flush."""
+        entry = self._pending.setdefault((tool_id, stream), ["", 0])
+        entry[0] += text
+        if len(entry[0]) > self._max_chars:
+            entry[1] += len(entry[0]) - self._max_chars
+            entry[0] = entry[0][-self._max_chars:]
+        
+        if self._timer is None:
+            loop = asyncio.get_running_loop()
+            delay = max(0.0, self._last_flush + self._interval - loop.time())
+            self._timer = loop.call_later(delay, self.flush)
+    
+    def flush(self) -> None:
+        """Emit everything pending now."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        pending, self._pending = self._pending, {}
+        for (tool_id, stream), (text, dropped) in pending.items():
+            self._emit(tool_id, stream, text, dropped)
+        self._last_flush = asyncio.get_running_loop().time()
+    
+    def close(self) -> None:
+        """Discard pending output and stop the flush timer."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        self._pending = {}
+
+
 class AgentService:
     """
     Service that wraps the original Computer Use Agent and provides
     integration with the new backend architecture.
     """
     
-    def __init__(self, session_id: str):
+    def __init__(self, session_id: str, display_num: Optional[int] = None):
         self.session_id = session_id
         self.settings = get_settings()
-        
-        # Set required environment variables for Computer Use Agent
-        os.environ["WIDTH"] = str(self.settings.width)
-        os.environ["HEIGHT"] = str(self.settings.height)
-        os.environ["DISPLAY_NUM"] = str(self.settings.display_num)
+        # The worker's own display; falls back to the configured one
+        self.display_num = display_num if display_num is not None else self.settings.display_num
         
         # Agent configuration
         self.model = self.settings.default_model
         self.provider = APIProvider.ANTHROPIC
         self.api_key = self.settings.anthropic_api_key
+        self.base_url = self.settings.anthropic_base_url
+        self.stream_responses = self.settings.stream_responses
+        self.tool_output_flush_interval = self.settings.tool_output_flush_interval
+        self.tool_output_max_chars = self.settings.tool_output_max_chars
         self.max_tokens = self.settings.max_tokens
         self.tool_version: ToolVersion = "computer_use_20250124"
         
@@ -54,7 +114,7 @@ class AgentService:
         
         # Tool collection setup
         tool_group = TOOL_GROUPS_BY_VERSION[self.tool_version]
-        self.tool_collection = ToolCollection(*(ToolCls() for ToolCls in tool_group.tools))
+        self.tool_collection = ToolCollection(*(self._make_tool(ToolCls) for ToolCls in tool_group.tools))
         
         logger.info("AgentService initialized", 
                    session_id=session_id, 
@@ -62,6 +122,22 @@ class AgentService:
                    tool_version=self.tool_version,
                    display_size=f"{self.settings.width}x{self.settings.height}")
     
+    def _make_tool(self, tool_cls):
+        # The session's tools get its own display and settings rather than the
+        # process-global environment, which other sessions' workers share
+        if issubclass(tool_cls, BashTool20250124):
+            return tool_cls(env={"DISPLAY": f":{self.display_num}"})
+        if issubclass(tool_cls, BaseComputerTool):
+            return tool_cls(
+                width=self.settings.width,
+                height=self.settings.height,
+                display_num=self.display_num,
+                fbdir=os.path.join(self.settings.xvfb_fbdir, str(self.display_num)),
+                settle_timeout=self.settings.screen_settle_timeout,
+                settle_quiet_window=self.settings.screen_settle_quiet_window,
+            )
+        return tool_cls()
+    
     async def process_message(
         self, 
         message_content: str,
@@ -89,17 +165,43 @@ class AgentService:
                 metadata={"session_id": self.session_id}
             )
             
-            # Create callbacks to capture agent output
-            output_queue: asyncio.Queue = asyncio.Queue()
-            tool_output_queue: asyncio.Queue = asyncio.Queue()
+            # Single merged stream of agent output. The callbacks are invoked
+            # synchronously from the sampling loop running on this event loop,
+            # so they can enqueue directly without scheduling a task per item.
+            updates: asyncio.Queue = asyncio.Queue()
             
             def output_callback(content_block: BetaContentBlockParam) -> None:
                 """Callback for agent output."""
-                asyncio.create_task(output_queue.put(content_block))
+                updates.put_nowait(("content", content_block))
+            
+            def emit_tool_output(tool_id: str, stream: str, text: str, dropped: int) -> None:
+                update = self._tool_output_to_update(tool_id, stream, text, dropped)
+                updates.put_nowait(("update", update))
+            
+            tool_output = ToolOutputCoalescer(
+                emit_tool_output,
+                interval=self.tool_output_flush_interval,
+                max_chars=self.tool_output_max_chars,
+            )
+            
+            def tool_stream_callback(tool_id: str, stream: str, text: str) -> None:
+                """Callback for output produced while a tool is running."""
+                tool_output.write(tool_id, stream, text)
             
             def tool_output_callback(tool_result: ToolResult, tool_id: str) -> None:
                 """Callback for tool execution results."""
-                asyncio.create_task(tool_output_queue.put((tool_result, tool_id)))
+                # Partial output must reach subscribers before the final result
+                tool_output.flush()
+                updates.put_nowait(("tool_result", (tool_result, tool_id)))
+            
+            # Tool name/id per content block index of the message being streamed
+            streaming_tool_blocks: Dict[int, Dict[str, str]] = {}
+            
+            def stream_callback(event: BetaMessageStreamEvent) -> None:
+                """Callback for incremental model output."""
+                update = self._stream_event_to_update(event, streaming_tool_blocks)
+                if update:
+                    updates.put_nowait(("update", update))
             
             def api_response_callback(request, response, error) -> None:
                 """Callback for API responses (for logging)."""
@@ -107,6 +209,8 @@ class AgentService:
                     logger.error("API error", session_id=self.session_id, error=str(error))
             
             # Run the sampling loop in a background task
+            from . import get_shared_http_client
+            
             async def run_agent():
                 try:
                     updated_messages = await sampling_loop(
@@ -123,79 +227,56 @@ class AgentService:
                         tool_version=self.tool_version,
                         thinking_budget=None,
                         token_efficient_tools_beta=False,
+                        http_client=get_shared_http_client(),
+                        base_url=self.base_url,
+                        stream_callback=stream_callback if self.stream_responses else None,
+                        tool_stream_callback=tool_stream_callback,
+                        tool_collection=self.tool_collection,
                     )
                     # Update our message history
                     self.messages = updated_messages
                     # Signal completion
-                    await output_queue.put(None)
+                    updates.put_nowait(("done", None))
                 except Exception as e:
                     logger.error("Agent execution failed", 
                                session_id=self.session_id, 
                                error=str(e))
-                    await output_queue.put({"error": str(e)})
+                    updates.put_nowait(("error", str(e)))
             
             # Start the agent task
             agent_task = asyncio.create_task(run_agent())
             
-            # Stream updates as they come in
-            while True:
-                try:
-                    # Check for output updates
-                    try:
-                        content_block = await asyncio.wait_for(
-                            output_queue.get(), 
-                            timeout=0.1
+            # Stream updates as soon as the callbacks enqueue them
+            try:
+                while True:
+                    kind, payload = await updates.get()
+                    
+                    if kind == "done":
+                        break
+                    
+                    if kind == "error":
+                        yield AgentUpdate(
+                            update_type=UpdateType.ERROR,
+                            content=f"Agent error: {payload}",
+                            timestamp=datetime.utcnow(),
+                            metadata={"session_id": self.session_id}
                         )
-                        
-                        if content_block is None:
-                            # Agent completed
-                            break
-                        
-                        if isinstance(content_block, dict) and "error" in content_block:
-                            # Error occurred
-                            yield AgentUpdate(
-                                update_type=UpdateType.ERROR,
-                                content=f"Agent error: {content_block['error']}",
-                                timestamp=datetime.utcnow(),
-                                metadata={"session_id": self.session_id}
-                            )
-                            break
-                        
-                        # Process the content block
-                        update = self._content_block_to_update(content_block)
+                        break
+                    
+                    if kind == "update":
+                        yield payload
+                    elif kind == "content":
+                        update = self._content_block_to_update(payload)
                         if update:
                             yield update
-                            
-                    except asyncio.TimeoutError:
-                        pass
-                    
-                    # Check for tool output updates
-                    try:
-                        tool_result, tool_id = await asyncio.wait_for(
-                            tool_output_queue.get(),
-                            timeout=0.1
-                        )
-                        
-                        # Yield tool result update
+                    elif kind == "tool_result":
+                        tool_result, tool_id = payload
                         yield self._tool_result_to_update(tool_result, tool_id)
-                        
-                    except asyncio.TimeoutError:
-                        pass
-                    
-                    # Small delay to prevent busy waiting
-                    await asyncio.sleep(0.05)
-                    
-                except Exception as e:
-                    logger.error("Error streaming updates", 
-                               session_id=self.session_id,
-                               error=str(e))
-                    yield AgentUpdate(
-                        update_type=UpdateType.ERROR,
-                        content=f"Streaming error: {str(e)}",
-                        timestamp=datetime.utcnow(),
-                        metadata={"session_id": self.session_id}
-                    )
-                    break
+            finally:
+                # Don't leave the sampling loop running if the consumer goes away
+                if not agent_task.done():
+                    agent_task.cancel()
+                tool_output.close()
             
             # Wait for agent task to complete
             await agent_task
@@ -262,6 +343,46 @@ class AgentService:
             logger.error("Failed to convert content block", error=str(e))
             return None
     
+    def _stream_event_to_update(
+        self,
+        event: BetaMessageStreamEvent,
+        tool_blocks: Dict[int, Dict[str, str]],
+    ) -> Optional[AgentUpdate]:
+        """Convert a raw stream event into an incremental CONTENT_DELTA update."""
+        metadata: Dict[str, Any] = {"session_id": self.session_id}
+        
+        if event.type == "content_block_start":
+            block = event.content_block
+            if block.type != "tool_use":
+                return None
+            # Announce the tool as soon as the model starts writing its input
+            tool_blocks[event.index] = {"tool_name": block.name, "tool_id": block.id}
+            content = ""
+            metadata.update(delta_type="tool_input", **tool_blocks[event.index])
+        elif event.type == "content_block_delta":
+            delta = event.delta
+            if delta.type == "text_delta":
+                content = delta.text
+                metadata["delta_type"] = "text"
+            elif delta.type == "thinking_delta":
+                content = delta.thinking
+                metadata["delta_type"] = "thinking"
+            elif delta.type == "input_json_delta":
+                content = delta.partial_json
+                metadata.update(delta_type="tool_input", **tool_blocks.get(event.index, {}))
+            else:
+                return None
+        else:
+            return None
+        
+        metadata["index"] = event.index
+        return AgentUpdate(
+            update_type=UpdateType.CONTENT_DELTA,
+            content=content,
+            timestamp=datetime.utcnow(),
+            metadata=metadata
+        )
+    
     def _tool_result_to_update(self, tool_result: ToolResult, tool_id: str) -> AgentUpdate:
         """Convert a tool result to an AgentUpdate."""
         content = ""
@@ -281,6 +402,9 @@ class AgentService:
             metadata["has_screenshot"] = True
             content += " (Screenshot captured)"
         
+        if tool_result.settle_time is not None:
+            metadata["settle_time"] = round(tool_result.settle_time, 3)
+        
         return AgentUpdate(
             update_type=UpdateType.TOOL_RESULT,
             content=content,
@@ -288,6 +412,31 @@ class AgentService:
             metadata=metadata
         )
     
+    def _tool_output_to_update(
+        self, tool_id: str, stream: str, text: str, dropped: int
+    ) -> AgentUpdate:
+        """Convert live tool output to a partial TOOL_RESULT update."""
+        metadata: Dict[str, Any] = {
+            "session_id": self.session_id,
+            "tool_id": tool_id,
+            "partial": True,
+            "stream": stream,
+        }
+        if dropped:
+            metadata["dropped_chars"] = dropped
+        
+        return AgentUpdate(
+            update_type=UpdateType.TOOL_RESULT,
+            content=text,
+            timestamp=datetime.utcnow(),
+            metadata=metadata
+        )
+    
+    async def close(self) -> None:
+        """Stop the tools, terminating the session's bash shell."""
+        self.tool_collection.stop()
+        logger.info("Agent tools stopped", session_id=self.session_id)
+    
     def get_conversation_history(self) -> List[Dict[str, Any]]:
         """Get the current conversation history."""
         return [dict(msg) for msg in self.messages]
@@ -296,3 +445,28 @@ class AgentService:
         """Clear the conversation history."""
         self.messages = []
         logger.info("Conversation history cleared", session_id=self.session_id)
+    
+    def load_history(self, turns: List[Dict[str, str]]) -> None:
+        """
+        Seed the conversation with a session's stored messages.
+        
+        Used when the session moves to a new worker. Only the text of each
+        turn is stored, so earlier tool calls and screenshots are not replayed.
+        Turns from the same role are merged and leading assistant turns are
+        dropped, since the API expects the conversation to alternate and to
+        open with the user.
+        """
+        messages: List[BetaMessageParam] = []
+        for turn in turns:
+            role = turn["role"]
+            if role not in (MessageRole.USER.value, MessageRole.ASSISTANT.value):
+                continue
+            if not messages and role != MessageRole.USER.value:
+                continue
+            block = BetaTextBlockParam(type="text", text=turn["content"])
+            if messages and messages[-1]["role"] == role:
+                messages[-1]["content"].append(block)
+            else:
+                messages.append({"role": role, "content": [block]})
+        self.messages = messages
+        logger.info("Conversation history restored", session_id=self.session_id, turns=len(messages))
@@ -0,0 +1,208 @@
+"""
+Broadcast backends that carry stream updates to every server process.
+"""
+
+import asyncio
+from typing import Awaitable, Callable, Optional
+
+from ..config import get_settings
+from ..logging_config import get_logger
+from .redis_client import RedisConnection, RedisSubscription
+
+logger = get_logger(__name__)
+
+# Called with (session_id, seq, payload, droppable) for every update, in order
+Deliver = Callable[[str, int, str, bool], Awaitable[None]]
+
+# Reconnect backoff for a lost broker connection
+_RECONNECT_INITIAL = 0.1
+_RECONNECT_MAX = 5.0
+
+
+class BroadcastBackend:
+    """
+    Moves encoded updates from the process that produced them to every
+    process with a StreamHandler, including itself.
+    
+    The StreamHandler sets `deliver`; the backend calls it with each update
+    it receives, in publish order per session.
+    """
+    
+    # True if other processes receive what this one publishes
+    shared = False
+    
+    def __init__(self):
+        self.deliver: Optional[Deliver] = None
+    
+    async def start(self, timeout: Optional[float] = None) -> None:
+        pass
+    
+    async def publish(self, session_id: str, seq: int, payload: str, droppable: bool) -> None:
+        raise NotImplementedError
+    
+    async def close(self) -> None:
+        pass
+    
+    def stats(self) -> dict:
+        return {"backend": "memory"}
+
+
+class InMemoryBroadcastBackend(BroadcastBackend):
+    """Delivers straight back to this process. The default for a single process."""
+    
+    async def publish(self, session_id: str, seq: int, payload: str, droppable: bool) -> None:
+        await self.deliver(session_id, seq, payload, droppable)
+
+
+class RedisBroadcastBackend(BroadcastBackend):
+    """
+    Redis pub/sub between processes.
+    
+    Each session publishes to `<prefix>:<session_id>` and every process holds
+    one pattern subscription to `<prefix>:*`, so nothing has to be subscribed
+    or unsubscribed as clients come and go. A message is
+    "<seq> <droppable> <payload>", with seq 0 meaning the session has ended
+    and -1 that its replay ring can be freed.
+    
+    Publishes are pipelined on one connection, which keeps them in order;
+    replies are checked as they arrive, and a failed publish is logged and
+    counted. If the broker goes away, updates published meanwhile still reach
+    this process's clients but are lost to the others; the sequence gap makes
+    their clients resync rather than miss them silently.
+    """
+    
+    shared = True
+    
+    def __init__(self, url: str, channel_prefix: str = "stream"):
+        super().__init__()
+        self.url = url
+        self.channel_prefix = channel_prefix
+        self._conn: Optional[RedisConnection] = None
+        self._connect_lock = asyncio.Lock()
+        self._listener: Optional[asyncio.Task] = None
+        self._subscribed = asyncio.Event()
+        self.published = 0
+        self.received = 0
+        self.publish_errors = 0
+        self.delivered_locally = 0
+        self.reconnects = 0
+    
+    async def start(self, timeout: Optional[float] = 10.0) -> None:
+        """
+        Subscribe, returning once updates from other processes are flowing.
+        
+        If the broker isn't reachable within `timeout`, startup carries on and
+        the subscription keeps retrying in the background.
+        """
+        if self._listener is None:
+            self._listener = asyncio.create_task(self._listen())
+        try:
+            await asyncio.wait_for(self._subscribed.wait(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Broadcast broker not reachable yet", url=self.url)
+    
+    async def publish(self, session_id: str, seq: int, payload: str, droppable: bool) -> None:
+        message = f"{seq} {int(droppable)} {payload}"
+        sent = False
+        try:
+            conn = await self._connection()
+            reply = conn.send("PUBLISH", f"{self.channel_prefix}:{session_id}", message)
+            sent = True
+            # Not awaited, so publishes stay pipelined; the reply is only checked
+            reply.add_done_callback(lambda future: self._publish_done(future, session_id, seq))
+            await conn.drain()
+        except (OSError, ConnectionError) as e:
+            self._publish_failed(session_id, seq, e)
+            if not sent:
+                # The broker never saw it, so it can't come back through the
+                # subscription; this process's clients still get it
+                self.delivered_locally += 1
+                await self.deliver(session_id, seq, payload, droppable)
+    
+    def _publish_done(self, future: asyncio.Future, session_id: str, seq: int) -> None:
+        if future.cancelled():
+            return
+        error = future.exception()
+        if error is None:
+            self.published += 1
+        else:
+            self._publish_failed(session_id, seq, error)
+    
+    def _publish_failed(self, session_id: str, seq: int, error: BaseException) -> None:
+        self.publish_errors += 1
+        logger.warning("Failed to publish update",
+                     session_id=session_id,
+                     seq=seq,
+                     error=str(error))
+    
+    async def _connection(self) -> RedisConnection:
+        if self._conn is None or self._conn.closed:
+            async with self._connect_lock:
+                if self._conn is None or self._conn.closed:
+                    self._conn = await RedisConnection.open(self.url)
+        return self._conn
+    
+    async def _listen(self) -> None:
+        prefix = self.channel_prefix + ":"
+        delay = _RECONNECT_INITIAL
+        while True:
+            try:
+                subscription = await RedisSubscription.open(self.url, [prefix + "*"])
+            except (OSError, ConnectionError) as e:
+                logger.warning("Cannot subscribe to broadcast channel",
+                             url=self.url,
+                             error=str(e),
+                             retry_in=delay)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, _RECONNECT_MAX)
+                continue
+            
+            delay = _RECONNECT_INITIAL
+            self._subscribed.set()
+            logger.info("Subscribed to broadcast channel", pattern=prefix + "*")
+            try:
+                async for channel, data in subscription.messages():
+                    self.received += 1
+                    try:
+                        seq, droppable, payload = data.decode().split(" ", 2)
+                        await self.deliver(
+                            channel[len(prefix):], int(seq), payload, droppable == "1"
+                        )
+                    except Exception as e:
+                        logger.error("Failed to deliver broadcast update",
+                                   channel=channel,
+                                   error=str(e))
+            except (OSError, ConnectionError, asyncio.IncompleteReadError) as e:
+                logger.warning("Broadcast subscription lost", error=str(e))
+            finally:
+                self._subscribed.clear()
+                subscription.close()
+            self.reconnects += 1
+    
+    async def close(self) -> None:
+        if self._listener is not None:
+            self._listener.cancel()
+            await asyncio.gather(self._listener, return_exceptions=True)
+            self._listener = None
+        if self._conn is not None:
+            await self._conn.close()
+            self._conn = None
+    
+    def stats(self) -> dict:
+        return {
+            "backend": "redis",
+            "subscribed": self._subscribed.is_set(),
+            "published": self.published,
+            "received": self.received,
+            "publish_errors": self.publish_errors,
+            "delivered_locally": self.delivered_locally,
+            "reconnects": self.reconnects,
+        }
+
+
+def create_broadcast_backend() -> BroadcastBackend:
+    """Build the backend selected by the broadcast_backend setting."""
+    settings = get_settings()
+    if settings.broadcast_backend == "redis":
+        return RedisBroadcastBackend(settings.redis_url, settings.broadcast_channel_prefix)
+    return InMemoryBroadcastBackend()
@@ -0,0 +1,149 @@
+"""
+Allocation of X display numbers and VNC ports for workers.
+"""
+
+import os
+import socket
+from collections import deque
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Deque, Optional
+
+from ..logging_config import get_logger
+
+logger = get_logger(__name__)
+
+
+class DisplaysExhausted(RuntimeError):
+    """Every display slot is in use."""
+
+
+@dataclass(frozen=True)
+class DisplaySlot:
+    """An X display and the VNC port that serves it."""
+    index: int
+    display_num: int
+    vnc_port: int
+
+
+class DisplayAllocator:
+    """
+    Hands out display/port pairs from a fixed range so workers never collide.
+    
+    Slot i maps to display `display_base + i` and port `port_base + display`.
+    A bitmap records which slots are taken and a free list gives O(1) acquire
+    and release. Recently released slots are reused first. Before a slot is
+    handed out, its X lock file is checked: a lock left behind by a dead server
+    is removed, while a display or port held by some other live process is
+    skipped.
+    """
+    
+    def __init__(
+        self,
+        display_base: int,
+        port_base: int,
+        size: int,
+        lock_dir: str = "/tmp",
+    ):
+        self.display_base = display_base
+        self.port_base = port_base
+        self.size = size
+        self.lock_dir = Path(lock_dir)
+        self._in_use = bytearray(size)
+        self._free: Deque[int] = deque(range(size))
+        self.stale_locks_removed = 0
+    
+    def acquire(self) -> DisplaySlot:
+        """Take a free slot, or raise DisplaysExhausted."""
+        # Each free slot is inspected at most once; busy ones go to the back
+        for _ in range(len(self._free)):
+            index = self._free.popleft()
+            slot = self._slot(index)
+            if self._held_elsewhere(slot):
+                self._free.append(index)
+                continue
+            self._in_use[index] = 1
+            return slot
+        raise DisplaysExhausted(
+            f"No free display in :{self.display_base}-:{self.display_base + self.size - 1}"
+        )
+    
+    def release(self, slot: DisplaySlot) -> None:
+        if not self._in_use[slot.index]:
+            return
+        self._in_use[slot.index] = 0
+        self._free.appendleft(slot.index)
+    
+    @property
+    def in_use(self) -> int:
+        return self.size - len(self._free)
+    
+    def stats(self) -> dict:
+        return {
+            "size": self.size,
+            "in_use": self.in_use,
+            "free": len(self._free),
+            "stale_locks_removed": self.stale_locks_removed,
+        }
+    
+    def _slot(self, index: int) -> DisplaySlot:
+        display_num = self.display_base + index
+        return DisplaySlot(index, display_num, self.port_base + display_num)
+    
+    def _held_elsewhere(self, slot: DisplaySlot) -> bool:
+        lock = self.lock_dir / f".X{slot.display_num}-lock"
+        pid = _lock_owner(lock)
+        if pid is not None and _pid_alive(pid):
+            logger.warning("Display held by another process",
+                         display=f":{slot.display_num}",
+                         pid=pid)
+            return True
+        
+        if pid is not None or lock.exists():
+            # The X server that wrote this lock is gone; clear it so Xvfb can start
+            for path in (lock, self.lock_dir / ".X11-unix" / f"X{slot.display_num}"):
+                try:
+                    path.unlink()
+                except FileNotFoundError:
+                    pass
+                except OSError as e:
+                    logger.warning("Failed to remove stale X lock",
+                                 path=str(path),
+                                 error=str(e))
+                    return True
+            self.stale_locks_removed += 1
+            logger.info("Removed stale X lock", display=f":{slot.display_num}")
+        
+        if _port_in_use(slot.vnc_port):
+            logger.warning("VNC port held by another process", vnc_port=slot.vnc_port)
+            return True
+        return False
+
+
+def _lock_owner(lock: Path) -> Optional[int]:
+    """PID recorded in an X lock file, or None if there is no usable lock."""
+    try:
+        return int(lock.read_text().strip())
+    except (OSError, ValueError):
+        return None
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # Exists but belongs to another user
+        return True
+    return True
+
+
+def _port_in_use(port: int) -> bool:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        try:
+            sock.bind(("0.0.0.0", port))
+        except OSError:
+            return True
+    return False
@@ -0,0 +1,338 @@
+"""
+Write-behind buffer that batches message inserts from every session.
+"""
+
+import asyncio
+import uuid
+from collections import deque
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Any, Callable, Deque, Dict, List, Optional, Set, Tuple
+
+from sqlalchemy import insert, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..logging_config import get_logger
+from ..models.database import Message, Session
+from ..models.schemas import MessageCreate
+
+logger = get_logger(__name__)
+
+_RETRY_INITIAL = 0.1
+_RETRY_MAX = 5.0
+
+
+@dataclass
+class _PendingWrite:
+    message: Message
+    # Resolved once the row is committed, for callers that wait on it
+    done: Optional[asyncio.Future]
+
+
+class MessageWriter:
+    """
+    Groups message inserts into multi-row INSERTs, one transaction per batch.
+    
+    A batch is written as soon as `batch_size` messages are waiting, or
+    `flush_interval` seconds after the first of them arrived. write() returns
+    once the message is committed, so it costs the caller at most one flush
+    interval while sharing the transaction with every other session's
+    messages; submit() returns as soon as the message is buffered. Messages
+    not yet committed are visible through pending(), and close() writes out
+    everything still buffered. If the database can't be reached, write()
+    raises and submitted messages are retried with backoff; a batch the
+    database rejects is retried row by row so one bad row only fails itself.
+    Messages for a session that doesn't exist are dropped, and write()
+    raises ValueError for them, as create_message does.
+    """
+    
+    def __init__(
+        self,
+        session_factory: Callable[[], AsyncSession],
+        batch_size: int = 100,
+        flush_interval: float = 0.05,
+        max_pending: int = 10000,
+    ):
+        self.session_factory = session_factory
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self._buffer: Deque[_PendingWrite] = deque()
+        # Taken off the buffer but not yet committed
+        self._in_flight: List[_PendingWrite] = []
+        # How many of the in-flight rows are in a COMMIT that may have gone through
+        self._committing = 0
+        self._wakeup = asyncio.Event()
+        self._full = asyncio.Event()
+        self._space = asyncio.Event()
+        self._space.set()
+        self._flush_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._closed = False
+        self._retry_delay = _RETRY_INITIAL
+        self._counters: Dict[str, int] = {
+            "batches": 0,
+            "rows": 0,
+            "failed_rows": 0,
+            "retries": 0,
+        }
+    
+    def start(self) -> None:
+        """Start the background flusher; also done by the first write."""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+    
+    async def submit(self, session_id: str, message_data: MessageCreate) -> Message:
+        """
+        Buffer a message for the next batch and return it as it will be stored.
+        
+        Waits only if max_pending messages are already buffered. Raises
+        ValueError for a malformed session ID.
+        """
+        pending = await self._enqueue(session_id, message_data, wait=False)
+        return pending.message
+    
+    async def write(self, session_id: str, message_data: MessageCreate) -> Message:
+        """Buffer a message and return once its batch is committed."""
+        pending = await self._enqueue(session_id, message_data, wait=True)
+        await asyncio.shield(pending.done)
+        return pending.message
+    
+    def pending(self, session_id: str) -> List[Message]:
+        """Messages for the session that are buffered or being written."""
+        session_uuid = uuid.UUID(session_id)
+        return [
+            p.message
+            for p in (*self._in_flight, *self._buffer)
+            if p.message.session_id == session_uuid
+        ]
+    
+    async def flush(self) -> None:
+        """Write out everything buffered so far."""
+        while self._buffer:
+            if not await self._flush_batch():
+                raise RuntimeError("Message flush failed; rows kept for retry")
+    
+    async def close(self) -> None:
+        """Stop the background flusher and write out what is left."""
+        self._closed = True
+        if self._task is not None:
+            # Let a batch that is being written finish before stopping the flusher
+            async with self._flush_lock:
+                self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        # Give a database that is briefly unavailable a few chances
+        for attempt in range(5):
+            if not self._buffer:
+                break
+            if not await self._flush_batch():
+                await asyncio.sleep(_RETRY_INITIAL * 2 ** attempt)
+        if self._buffer:
+            logger.error("Messages lost on shutdown", count=len(self._buffer))
+            for pending in self._buffer:
+                if pending.done is not None and not pending.done.done():
+                    pending.done.set_exception(RuntimeError("Message writer closed"))
+            self._buffer.clear()
+    
+    def stats(self) -> Dict[str, Any]:
+        counters = self._counters
+        return {
+            "pending": len(self._buffer) + len(self._in_flight),
+            **counters,
+            "avg_batch_size": (
+                round(counters["rows"] / counters["batches"], 1) if counters["batches"] else None
+            ),
+        }
+    
+    async def _enqueue(self, session_id: str, message_data: MessageCreate, wait: bool) -> _PendingWrite:
+        if self._closed:
+            raise RuntimeError("Message writer closed")
+        self.start()
+        message = Message(
+            message_id=uuid.uuid4(),
+            session_id=uuid.UUID(session_id),
+            role=message_data.role.value,
+            content=message_data.content,
+            message_metadata=message_data.message_metadata or {},
+        )
+        while len(self._buffer) >= self.max_pending:
+            self._space.clear()
+            await self._space.wait()
+        # Stamped once it has a place in the buffer, so batches stay in time order
+        message.timestamp = datetime.now(timezone.utc)
+        done = asyncio.get_running_loop().create_future() if wait else None
+        pending = _PendingWrite(message, done)
+        self._buffer.append(pending)
+        self._wakeup.set()
+        if len(self._buffer) >= self.batch_size:
+            self._full.set()
+        return pending
+    
+    async def _run(self) -> None:
+        while True:
+            await self._wakeup.wait()
+            if len(self._buffer) < self.batch_size:
+                try:
+                    await asyncio.wait_for(self._full.wait(), self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+            if not await self._flush_batch():
+                await asyncio.sleep(self._retry_delay)
+                self._retry_delay = min(self._retry_delay * 2, _RETRY_MAX)
+            if not self._buffer:
+                self._wakeup.clear()
+            if len(self._buffer) < self.batch_size:
+                self._full.clear()
+    
+    async def _flush_batch(self) -> bool:
+        """Write one batch. False if some of it was put back for a retry."""
+        async with self._flush_lock:
+            if not self._buffer:
+                return True
+            batch = [self._buffer.popleft() for _ in range(min(self.batch_size, len(self._buffer)))]
+            self._in_flight = batch
+            try:
+                missing = await self._insert([p.message for p in batch])
+                written, ok = self._drop_missing(batch, missing), True
+            except IntegrityError as e:
+                logger.warning("Batch insert rejected, retrying rows one at a time",
+                              rows=len(batch),
+                              error=str(e))
+                written, ok = await self._insert_each(batch)
+            except asyncio.CancelledError:
+                unresolved = self._in_flight
+                in_doubt = unresolved[:self._committing]
+                if in_doubt:
+                    # Their commit may have gone through; writing them again could
+                    # duplicate them, so report them as lost instead
+                    logger.error("Message insert interrupted during commit, rows may be lost",
+                                rows=len(in_doubt))
+                    self._fail(in_doubt, RuntimeError("Message write interrupted"))
+                # Definitely not written; keep them for whoever flushes next
+                self._buffer.extendleft(reversed(unresolved[len(in_doubt):]))
+                raise
+            except Exception as e:
+                # Database unreachable; keep submitted rows, in order, for the next attempt
+                logger.error("Message batch insert failed, will retry",
+                            rows=len(batch),
+                            error=str(e))
+                self._requeue(batch, e)
+                written, ok = [], False
+            finally:
+                self._in_flight = []
+            
+            if written:
+                self._counters["batches"] += 1
+                self._counters["rows"] += len(written)
+            for pending in written:
+                if pending.done is not None and not pending.done.done():
+                    pending.done.set_result(None)
+            if ok:
+                self._retry_delay = _RETRY_INITIAL
+                self._space.set()
+            return ok
+    
+    def _requeue(self, rows: List[_PendingWrite], error: Exception) -> None:
+        """
+        Put rows back at the front of the buffer after a failed insert.
+        
+        A caller waiting in write() gets the error instead, as it would from
+        a direct insert, so a request never hangs on a database that is down.
+        """
+        self._counters["retries"] += 1
+        kept = []
+        for pending in rows:
+            if pending.done is None:
+                kept.append(pending)
+            elif not pending.done.done():
+                pending.done.set_exception(RuntimeError(f"Message insert failed: {error}"))
+        self._buffer.extendleft(reversed(kept))
+    
+    def _fail(self, rows: List[_PendingWrite], error: Exception) -> None:
+        for pending in rows:
+            if pending.done is not None and not pending.done.done():
+                pending.done.set_exception(error)
+    
+    def _drop_missing(self, batch: List[_PendingWrite], missing: Set[uuid.UUID]) -> List[_PendingWrite]:
+        """The rows of `batch` that were written; the rest belonged to unknown sessions."""
+        if not missing:
+            return batch
+        written = []
+        for pending in batch:
+            if pending.message.session_id in missing:
+                self._counters["failed_rows"] += 1
+                logger.warning("Dropping message for unknown session",
+                              session_id=str(pending.message.session_id),
+                              message_id=str(pending.message.message_id))
+                self._fail([pending], ValueError(f"Session {pending.message.session_id} not found"))
+            else:
+                written.append(pending)
+        return written
+    
+    async def _insert(self, messages: List[Message]) -> Set[uuid.UUID]:
+        """
+        Insert messages in one transaction, skipping those whose session doesn't exist.
+        
+        Returns the skipped session IDs. The existence check stands in for the
+        foreign key, which SQLite doesn't enforce by default.
+        """
+        self._committing = 0
+        session_ids = {m.session_id for m in messages}
+        async with self.session_factory() as db:
+            try:
+                result = await db.execute(
+                    select(Session.session_id).where(Session.session_id.in_(session_ids))
+                )
+                missing = session_ids - set(result.scalars())
+                rows = [
+                    {
+                        "message_id": m.message_id,
+                        "session_id": m.session_id,
+                        "role": m.role,
+                        "content": m.content,
+                        "timestamp": m.timestamp,
+                        "message_metadata": m.message_metadata,
+                    }
+                    for m in messages
+                    if m.session_id not in missing
+                ]
+                if rows:
+                    # Sent as multi-row VALUES statements by the driver
+                    await db.execute(insert(Message), rows)
+                    self._committing = len(messages)
+                    await db.commit()
+            except Exception:
+                await db.rollback()
+                raise
+        return missing
+    
+    async def _insert_each(self, batch: List[_PendingWrite]) -> Tuple[List[_PendingWrite], bool]:
+        written = []
+        for index, pending in enumerate(batch):
+            # Rows before this one are settled and must not be retried
+            self._in_flight = batch[index:]
+            try:
+                missing = await self._insert([pending.message])
+            except IntegrityError as e:
+                self._counters["failed_rows"] += 1
+                logger.error("Dropping message the database rejected",
+                            session_id=str(pending.message.session_id),
+                            message_id=str(pending.message.message_id),
+                            error=str(e))
+                if pending.done is not None and not pending.done.done():
+                    pending.done.set_exception(ValueError(f"Message rejected: {e}"))
+                continue
+            except Exception as e:
+                logger.error("Message insert failed, will retry",
+                            rows=len(batch) - index,
+                            error=str(e))
+                self._requeue(batch[index:], e)
+                return written, False
+            for row in self._drop_missing([pending], missing):
+                # Settled now, in case the rest of the batch is interrupted
+                if row.done is not None and not row.done.done():
+                    row.done.set_result(None)
+                written.append(row)
+        return written, True
@@ -188,6 +188,9 @@ class MockAgentService:
         # Default response
         return f"I've processed your request about '{message}'. The task has been completed successfully."
     
+    async def close(self):
+        """Nothing to release; the mock runs no tools."""
+    
     def get_conversation_history(self):
         """Get the conversation history."""
         return self.messages
@@ -195,3 +198,7 @@ class MockAgentService:
         """Clear the conversation history."""
         self.messages = []
         logger.info("Conversation history cleared", session_id=self.session_id)
+    
+    def load_history(self, turns):
+        """Seed the conversation with a session's stored messages."""
+        self.messages = [{"role": t["role"], "content": t["content"]} for t in turns]
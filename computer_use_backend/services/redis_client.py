@@ -0,0 +1,201 @@
+"""
+Minimal asyncio client for the Redis protocol (RESP2).
+
+Only what the backend needs: plain commands with pipelined replies, and
+pattern subscriptions for pub/sub. Works against Redis, Valkey, KeyDB or
+anything else that speaks RESP.
+"""
+
+import asyncio
+from collections import deque
+from typing import Any, AsyncIterator, Deque, List, Optional, Tuple, Union
+from urllib.parse import unquote, urlsplit
+
+from ..logging_config import get_logger
+
+logger = get_logger(__name__)
+
+Arg = Union[str, bytes, int, float]
+
+
+class RedisError(Exception):
+    """The server answered a command with an error reply."""
+
+
+def parse_redis_url(url: str) -> Tuple[str, int, Optional[str], Optional[str], int]:
+    """Split redis://[[user]:password@]host[:port][/db] into its parts."""
+    parts = urlsplit(url)
+    if parts.scheme not in ("redis", ""):
+        raise ValueError(f"Unsupported Redis URL scheme: {parts.scheme}")
+    path = parts.path.lstrip("/")
+    return (
+        parts.hostname or "localhost",
+        parts.port or 6379,
+        unquote(parts.username) if parts.username else None,
+        unquote(parts.password) if parts.password else None,
+        int(path) if path else 0,
+    )
+
+
+def encode_command(*args: Arg) -> bytes:
+    """Encode a command as a RESP array of bulk strings."""
+    out = [b"*%d\r\n" % len(args)]
+    for arg in args:
+        if isinstance(arg, str):
+            arg = arg.encode()
+        elif not isinstance(arg, bytes):
+            arg = str(arg).encode()
+        out.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+    return b"".join(out)
+
+
+async def read_reply(reader: asyncio.StreamReader) -> Any:
+    """
+    Read one reply. Bulk strings come back as bytes, error replies as a
+    RedisError instance (returned, not raised, so pipelines stay in step).
+    """
+    line = await reader.readuntil(b"\r\n")
+    kind, rest = line[:1], line[1:-2]
+    if kind == b"+":
+        return rest.decode()
+    if kind == b"-":
+        return RedisError(rest.decode())
+    if kind == b":":
+        return int(rest)
+    if kind == b"$":
+        length = int(rest)
+        if length < 0:
+            return None
+        data = await reader.readexactly(length + 2)
+        return data[:-2]
+    if kind == b"*":
+        length = int(rest)
+        if length < 0:
+            return None
+        return [await read_reply(reader) for _ in range(length)]
+    raise ConnectionError(f"Malformed reply from Redis: {line!r}")
+
+
+async def _open(url: str) -> Tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+    host, port, username, password, db = parse_redis_url(url)
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        if password:
+            auth = ("AUTH", username, password) if username else ("AUTH", password)
+            writer.write(encode_command(*auth))
+            reply = await read_reply(reader)
+            if isinstance(reply, RedisError):
+                raise reply
+        if db:
+            writer.write(encode_command("SELECT", db))
+            reply = await read_reply(reader)
+            if isinstance(reply, RedisError):
+                raise reply
+    except BaseException:
+        writer.close()
+        raise
+    return reader, writer
+
+
+class RedisConnection:
+    """
+    One connection for request/reply commands.
+    
+    Commands are written straight away and their replies are matched up in
+    order by a reader task, so concurrent callers share the connection
+    without waiting for each other's round trips.
+    """
+    
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._reader = reader
+        self._writer = writer
+        self._pending: Deque[asyncio.Future] = deque()
+        self._reader_task = asyncio.create_task(self._read_replies())
+    
+    @classmethod
+    async def open(cls, url: str) -> "RedisConnection":
+        reader, writer = await _open(url)
+        return cls(reader, writer)
+    
+    @property
+    def closed(self) -> bool:
+        return self._reader_task.done()
+    
+    async def execute(self, *args: Arg) -> Any:
+        """Send a command and wait for its reply."""
+        return await self.send(*args)
+    
+    def send(self, *args: Arg) -> "asyncio.Future[Any]":
+        """Queue a command without waiting; the returned future gets the reply."""
+        if self.closed:
+            raise ConnectionError("Redis connection is closed")
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append(future)
+        self._writer.write(encode_command(*args))
+        return future
+    
+    async def drain(self) -> None:
+        """Wait for the socket buffer to empty, for backpressure."""
+        await self._writer.drain()
+    
+    async def close(self) -> None:
+        self._reader_task.cancel()
+        self._writer.close()
+        await asyncio.gather(self._reader_task, return_exceptions=True)
+    
+    async def _read_replies(self) -> None:
+        error: BaseException = ConnectionError("Redis connection closed")
+        try:
+            while True:
+                reply = await read_reply(self._reader)
+                future = self._pending.popleft()
+                if future.done():
+                    continue
+                if isinstance(reply, RedisError):
+                    future.set_exception(reply)
+                else:
+                    future.set_result(reply)
+        except (OSError, asyncio.IncompleteReadError, ConnectionError) as e:
+            error = ConnectionError(f"Redis connection lost: {e}")
+            logger.warning("Redis connection lost", error=str(e))
+        except asyncio.CancelledError:
+            raise
+        finally:
+            while self._pending:
+                future = self._pending.popleft()
+                if not future.done():
+                    future.set_exception(error)
+            self._writer.close()
+
+
+class RedisSubscription:
+    """A dedicated connection subscribed to channel patterns."""
+    
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._reader = reader
+        self._writer = writer
+    
+    @classmethod
+    async def open(cls, url: str, patterns: List[str]) -> "RedisSubscription":
+        """Connect and wait until the server has confirmed every pattern."""
+        reader, writer = await _open(url)
+        writer.write(encode_command("PSUBSCRIBE", *patterns))
+        try:
+            for _ in patterns:
+                reply = await read_reply(reader)
+                if isinstance(reply, RedisError):
+                    raise reply
+        except BaseException:
+            writer.close()
+            raise
+        return cls(reader, writer)
+    
+    async def messages(self) -> AsyncIterator[Tuple[str, bytes]]:
+        """Yield (channel, data) until the connection drops."""
+        while True:
+            reply = await read_reply(self._reader)
+            if isinstance(reply, list) and reply and reply[0] == b"pmessage":
+                yield reply[2].decode(), reply[3]
+    
+    def close(self) -> None:
+        self._writer.close()
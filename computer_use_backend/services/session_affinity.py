@@ -0,0 +1,296 @@
+"""
+Session affinity: keep every request for a session on the process that owns its worker.
+"""
+
+import asyncio
+import hmac
+import os
+import socket
+import time
+from typing import Optional
+
+import httpx
+from fastapi import Request, WebSocket
+from fastapi.responses import JSONResponse, Response
+from starlette.requests import HTTPConnection
+
+from ..config import get_settings
+from ..logging_config import get_logger
+from .worker import WorkerPool
+from .worker_registry import NodeInfo, WorkerRegistry
+
+logger = get_logger(__name__)
+
+# Set on forwarded requests so the owner never forwards them again. Only
+# trusted alongside FORWARD_SECRET_HEADER carrying the shared forward_secret,
+# since any client could send it to skip routing
+FORWARDED_HEADER = "x-forwarded-owner"
+FORWARD_SECRET_HEADER = "x-forward-secret"
+
+# Not passed through when forwarding
+_HOP_HEADERS = {
+    "connection", "keep-alive", "proxy-connection", "te", "trailer",
+    "transfer-encoding", "upgrade", "host", "content-length",
+}
+
+
+class SessionAffinity:
+    """
+    Places new sessions and routes session requests to their owning process.
+    
+    Each process advertises its capacity and load through the registry on a
+    heartbeat. New sessions go to the least-loaded live process. A request
+    for a session owned elsewhere is forwarded to the owner's address, or,
+    if the owner has none or forwarding is off, answered with a hint: a 307
+    redirect when the address is known, a 421 with the owner's id otherwise.
+    Sessions whose owner has stopped heartbeating are taken over by the
+    process that sees the next request.
+    """
+    
+    def __init__(
+        self,
+        registry: WorkerRegistry,
+        worker_pool: WorkerPool,
+        client: Optional[httpx.AsyncClient] = None,
+    ):
+        settings = get_settings()
+        self.registry = registry
+        self.worker_pool = worker_pool
+        self.owner_id = f"{settings.node_id or socket.gethostname()}:{os.getpid()}"
+        self.address = settings.node_url
+        self.forwarding = settings.session_forwarding
+        self.heartbeat_interval = settings.node_heartbeat_interval
+        self.forward_timeout = settings.forward_timeout
+        self.forward_secret = settings.forward_secret
+        self._client = client
+        self._heartbeat_task: Optional[asyncio.Task] = None
+        self.forwarded = 0
+        self.taken_over = 0
+    
+    def node_info(self) -> NodeInfo:
+        pool = self.worker_pool
+        return NodeInfo(
+            owner=self.owner_id,
+            address=self.address,
+            capacity=pool.max_workers,
+            workers=pool.active_slots,
+            queued=pool.queued,
+            updated_at=time.time(),
+        )
+    
+    async def start(self) -> None:
+        """Advertise this process and keep its heartbeat fresh."""
+        await self.registry.heartbeat(self.node_info())
+        if self._heartbeat_task is None:
+            self._heartbeat_task = asyncio.create_task(self._heartbeat_loop())
+        logger.info("Session affinity started", owner=self.owner_id, address=self.address)
+    
+    async def _heartbeat_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            try:
+                await self.registry.heartbeat(self.node_info())
+            except Exception as e:
+                logger.warning("Heartbeat failed", owner=self.owner_id, error=str(e))
+    
+    async def place_session(self, session_id: str) -> str:
+        """Assign a new session to the least-loaded live process and return its owner id."""
+        nodes = await self.registry.nodes()
+        if nodes:
+            # Fewest sessions breaks ties, so a burst of new sessions spreads
+            # out before any of them has started a worker
+            node = min(nodes, key=lambda n: (n.load, n.sessions, n.owner != self.owner_id))
+            owner = node.owner
+        else:
+            owner = self.owner_id
+        return await self.registry.claim(session_id, owner)
+    
+    async def resolve(self, session_id: str, claim: bool = False) -> Optional[NodeInfo]:
+        """
+        The live process that owns the session, or None if this one should
+        serve it. Sessions of dead processes are taken over, and with `claim`
+        unowned sessions are claimed for this process.
+        """
+        owner = await self.registry.owner_of(session_id)
+        if owner is None:
+            if not claim:
+                return None
+            owner = await self.registry.claim(session_id, self.owner_id)
+        if owner == self.owner_id:
+            return None
+        
+        node = next((n for n in await self.registry.nodes() if n.owner == owner), None)
+        if node is not None:
+            return node
+        
+        if await self.registry.take_over(session_id, self.owner_id, owner):
+            self.taken_over += 1
+            logger.warning("Took over session from dead process",
+                         session_id=session_id,
+                         previous_owner=owner,
+                         owner=self.owner_id)
+            return None
+        # Someone else got there first
+        owner = await self.registry.owner_of(session_id)
+        if owner is None or owner == self.owner_id:
+            return None
+        return next((n for n in await self.registry.nodes() if n.owner == owner), None)
+    
+    async def route(
+        self,
+        request: Request,
+        session_id: str,
+        claim: bool = False,
+    ) -> Optional[Response]:
+        """
+        Response from the owning process, or None to handle the request here.
+        
+        Pass `claim` for requests that start a worker, so an unowned session
+        becomes this process's.
+        """
+        if self._is_forwarded(request):
+            return None
+        node = await self.resolve(session_id, claim)
+        if node is None:
+            return None
+        if self.forwarding and node.address:
+            return await self._forward(request, node)
+        return self._redirect_hint(request, node)
+    
+    async def route_websocket(self, websocket: WebSocket, session_id: str) -> bool:
+        """
+        Turn away a WebSocket for a session another process owns; call before accepting.
+        
+        WebSockets aren't forwarded. The client gets the same 307/421 owner
+        hint as HTTP requests where the server supports denial responses, and
+        otherwise a 1008 close naming the owner. True if it was turned away.
+        """
+        if self._is_forwarded(websocket):
+            return False
+        node = await self.resolve(session_id)
+        if node is None:
+            return False
+        if "websocket.http.response" in websocket.scope.get("extensions", {}):
+            await websocket.send_denial_response(self._redirect_hint(websocket, node))
+        else:
+            await websocket.accept()
+            await websocket.close(code=1008, reason=f"Session is served by {node.owner}")
+        logger.info("Turned away WebSocket for session owned elsewhere",
+                   session_id=session_id,
+                   owner=node.owner)
+        return True
+    
+    async def release(self, session_id: str) -> None:
+        """Forget a terminated session's owner."""
+        await self.registry.release(session_id)
+    
+    def _is_forwarded(self, connection: HTTPConnection) -> bool:
+        """True for a request another process forwarded here, proven by the shared secret."""
+        if not connection.headers.get(FORWARDED_HEADER) or not self.forward_secret:
+            return False
+        return hmac.compare_digest(
+            connection.headers.get(FORWARD_SECRET_HEADER, "").encode(),
+            self.forward_secret.encode(),
+        )
+    
+    async def _forward(self, request: Request, node: NodeInfo) -> Response:
+        headers = {
+            k: v for k, v in request.headers.items()
+            if k not in _HOP_HEADERS and k != FORWARD_SECRET_HEADER
+        }
+        headers[FORWARDED_HEADER] = self.owner_id
+        if self.forward_secret:
+            headers[FORWARD_SECRET_HEADER] = self.forward_secret
+        try:
+            upstream = await self._http_client().request(
+                request.method,
+                node.address.rstrip("/") + request.url.path,
+                params=request.query_params,
+                content=await request.body(),
+                headers=headers,
+            )
+        except httpx.HTTPError as e:
+            logger.error("Failed to forward request to session owner",
+                        path=request.url.path,
+                        owner=node.owner,
+                        error=str(e))
+            return JSONResponse(
+                status_code=503,
+                content={"detail": "Session owner unreachable", "owner": node.owner},
+                headers={"Retry-After": str(int(self.heartbeat_interval) or 1),
+                         "X-Session-Owner": node.owner},
+            )
+        
+        self.forwarded += 1
+        logger.info("Forwarded request to session owner",
+                   method=request.method,
+                   path=request.url.path,
+                   owner=node.owner,
+                   status_code=upstream.status_code)
+        response = Response(content=upstream.content, status_code=upstream.status_code)
+        for name, value in upstream.headers.multi_items():
+            # httpx has already decoded the body
+            if name not in _HOP_HEADERS and name != "content-encoding":
+                response.headers.append(name, value)
+        response.headers["X-Session-Owner"] = node.owner
+        return response
+    
+    def _redirect_hint(self, request: HTTPConnection, node: NodeInfo) -> Response:
+        headers = {"X-Session-Owner": node.owner}
+        if node.address:
+            location = node.address.rstrip("/") + request.url.path
+            if request.scope["type"] == "websocket" and location.startswith("http"):
+                location = "ws" + location[len("http"):]
+            if request.url.query:
+                location += "?" + request.url.query
+            headers["Location"] = location
+            return JSONResponse(
+                status_code=307,
+                content={"detail": "Session is served by another node", "owner": node.owner},
+                headers=headers,
+            )
+        return JSONResponse(
+            status_code=421,
+            content={"detail": "Session is served by another node", "owner": node.owner},
+            headers=headers,
+        )
+    
+    def _http_client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(timeout=self.forward_timeout)
+        return self._client
+    
+    async def close(self) -> None:
+        """Stop heartbeating and withdraw this process from placement."""
+        if self._heartbeat_task is not None:
+            self._heartbeat_task.cancel()
+            await asyncio.gather(self._heartbeat_task, return_exceptions=True)
+            self._heartbeat_task = None
+        try:
+            await self.registry.remove_node(self.owner_id)
+        except Exception as e:
+            logger.warning("Failed to deregister node", owner=self.owner_id, error=str(e))
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+        await self.registry.close()
+    
+    async def stats(self) -> dict:
+        return {
+            "owner": self.owner_id,
+            "address": self.address,
+            "forwarded": self.forwarded,
+            "taken_over": self.taken_over,
+            "nodes": [
+                {
+                    "owner": node.owner,
+                    "address": node.address,
+                    "capacity": node.capacity,
+                    "workers": node.workers,
+                    "queued": node.queued,
+                    "sessions": node.sessions,
+                    "load": round(node.load, 3),
+                }
+                for node in await self.registry.nodes()
+            ],
+        }
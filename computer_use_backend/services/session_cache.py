@@ -0,0 +1,62 @@
+"""
+Short-lived cache of sessions known to exist and not be terminated.
+"""
+
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional
+
+from ..logging_config import get_logger
+
+logger = get_logger(__name__)
+
+
+@dataclass
+class CachedSession:
+    # Session.worker_id as last read or written by this process
+    owner: Optional[str]
+    expires_at: float
+
+
+class LiveSessionCache:
+    """
+    Session IDs this process has recently seen live, with their recorded owner.
+    
+    Lets the message write path skip the session lookup. Entries expire after
+    `ttl` seconds so terminations by other processes are noticed; terminations
+    here discard the entry straight away. The least recently used entries are
+    dropped beyond `max_size`.
+    """
+    
+    def __init__(self, ttl: float, max_size: int):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries: "OrderedDict[str, CachedSession]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+    
+    def get(self, session_id: str) -> Optional[CachedSession]:
+        entry = self._entries.get(session_id)
+        if entry is None or entry.expires_at <= time.monotonic():
+            if entry is not None:
+                del self._entries[session_id]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(session_id)
+        self.hits += 1
+        return entry
+    
+    def put(self, session_id: str, owner: Optional[str]) -> None:
+        if self.ttl <= 0:
+            return
+        self._entries[session_id] = CachedSession(owner, time.monotonic() + self.ttl)
+        self._entries.move_to_end(session_id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+    
+    def discard(self, session_id: str) -> None:
+        self._entries.pop(session_id, None)
+    
+    def stats(self) -> dict:
+        return {"size": len(self._entries), "hits": self.hits, "misses": self.misses}
@@ -2,33 +2,96 @@
 Session management service.
 """
 
+import base64
 import uuid
-from typing import List, Optional
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, desc
-from sqlalchemy.orm import selectinload
+from sqlalchemy import exists, insert, select, desc, func, literal, tuple_, update
 
 from ..models.database import Session, Message
 from ..models.schemas import SessionCreate, MessageCreate
+from ..config import get_settings
 from ..logging_config import get_logger
+from .session_cache import CachedSession, LiveSessionCache
 from .worker import WorkerPool
 
 logger = get_logger(__name__)
 
+
+# Statuses listed when the caller doesn't filter
+LISTED_STATUSES = ("active", "processing", "idle")
+
+
+def _encode_cursor(timestamp: datetime, row_id: uuid.UUID) -> str:
+    raw = f"{timestamp.isoformat()}|{row_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def encode_message_cursor(message: Message) -> str:
+    """Opaque cursor for a message's position in its session's history."""
+    return _encode_cursor(message.timestamp, message.message_id)
+
+
+def encode_session_cursor(session: Session) -> str:
+    """Opaque cursor for a session's position in the session listing."""
+    return _encode_cursor(session.created_at, session.session_id)
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, uuid.UUID]:
+    """Inverse of the encode_*_cursor functions; raises ValueError for malformed cursors."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        timestamp, row_id = raw.split("|")
+        return datetime.fromisoformat(timestamp), uuid.UUID(row_id)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise ValueError(f"Invalid cursor: {cursor!r}") from e
+
+
+def _as_utc(timestamp: datetime) -> datetime:
+    # SQLite hands timestamps back naive; they are stored as UTC
+    return timestamp if timestamp.tzinfo else timestamp.replace(tzinfo=timezone.utc)
+
+
+def _message_key(message: Message) -> Tuple[datetime, uuid.UUID]:
+    return _as_utc(message.timestamp), message.message_id
+
+
+def _cursor_key(cursor: str, timestamp_column, id_column):
+    timestamp, row_id = decode_cursor(cursor)
+    # Typed like the columns so the UUID binds the same way on every backend
+    return tuple_(
+        literal(timestamp, timestamp_column.type),
+        literal(row_id, id_column.type),
+    )
+
+
 class SessionManager:
     """Manages session lifecycle and operations with worker integration."""
     
-    def __init__(self, worker_pool: Optional[WorkerPool] = None):
+    def __init__(
+        self,
+        worker_pool: Optional[WorkerPool] = None,
+        session_cache: Optional[LiveSessionCache] = None,
+    ):
         self.worker_pool = worker_pool or WorkerPool()
+        if session_cache is None:
+            settings = get_settings()
+            session_cache = LiveSessionCache(settings.session_cache_ttl, settings.session_cache_size)
+        self.session_cache = session_cache
     
     async def create_session(
         self,
         db: AsyncSession,
-        session_data: SessionCreate
+        session_data: SessionCreate,
+        session_id: Optional[uuid.UUID] = None,
+        worker_id: Optional[str] = None,
     ) -> Session:
-        """Create a new session."""
+        """Create a new session, optionally with its ID and owning process chosen up front."""
         try:
             session = Session(
+                session_id=session_id or uuid.uuid4(),
+                worker_id=worker_id,
                 session_metadata=session_data.session_metadata or {}
             )
             db.add(session)
@@ -68,6 +131,25 @@ class SessionManager:
             logger.error("Failed to get session", session_id=session_id, error=str(e))
             raise
     
+    async def check_session(
+        self,
+        db: AsyncSession,
+        session_id: str
+    ) -> Optional[CachedSession]:
+        """
+        The session's owner if it exists, from the live-session cache when
+        possible. Returns None for unknown or malformed IDs.
+        """
+        cached = self.session_cache.get(session_id)
+        if cached is not None:
+            return cached
+        session = await self.get_session(db, session_id)
+        if session is None:
+            return None
+        if session.status != "terminated":
+            self.session_cache.put(session_id, session.worker_id)
+        return CachedSession(session.worker_id, expires_at=0.0)
+    
     async def list_sessions(self, db: AsyncSession) -> List[Session]:
         """List all active sessions."""
         try:
@@ -84,6 +166,78 @@ class SessionManager:
             logger.error("Failed to list sessions", error=str(e))
             raise
     
+    def _filter_sessions(
+        self,
+        query,
+        statuses: Optional[Iterable[str]],
+        created_after: Optional[datetime],
+        created_before: Optional[datetime],
+    ):
+        # An IN list rather than != "terminated", so the (status, created_at)
+        # index can serve it as one range per status
+        query = query.where(Session.status.in_(list(statuses or LISTED_STATUSES)))
+        if created_after is not None:
+            query = query.where(Session.created_at >= created_after)
+        if created_before is not None:
+            query = query.where(Session.created_at < created_before)
+        return query
+    
+    async def get_session_page(
+        self,
+        db: AsyncSession,
+        limit: int,
+        before: Optional[str] = None,
+        statuses: Optional[Iterable[str]] = None,
+        created_after: Optional[datetime] = None,
+        created_before: Optional[datetime] = None,
+    ) -> Tuple[List[Session], bool]:
+        """
+        One page of sessions, newest first.
+        
+        `before` is a cursor from encode_session_cursor for the last session
+        of the previous page. Without `statuses`, terminated sessions are
+        left out. Returns the sessions and whether older ones remain. Raises
+        ValueError for a malformed cursor.
+        """
+        query = self._filter_sessions(select(Session), statuses, created_after, created_before)
+        if before is not None:
+            query = query.where(
+                tuple_(Session.created_at, Session.session_id)
+                < _cursor_key(before, Session.created_at, Session.session_id)
+            )
+        query = query.order_by(desc(Session.created_at), desc(Session.session_id))
+        
+        try:
+            # One extra row tells whether there is another page
+            result = await db.execute(query.limit(limit + 1))
+            sessions = list(result.scalars().all())
+        except Exception as e:
+            logger.error("Failed to list sessions", error=str(e))
+            raise
+        
+        has_more = len(sessions) > limit
+        sessions = sessions[:limit]
+        logger.info("Session page listed", count=len(sessions), has_more=has_more)
+        return sessions, has_more
+    
+    async def summarize_sessions(
+        self,
+        db: AsyncSession,
+        statuses: Optional[Iterable[str]] = None,
+        created_after: Optional[datetime] = None,
+        created_before: Optional[datetime] = None,
+    ) -> Dict[str, int]:
+        """Number of sessions per status, answered from the (status, created_at) index."""
+        query = self._filter_sessions(
+            select(Session.status, func.count()), statuses, created_after, created_before
+        ).group_by(Session.status)
+        try:
+            result = await db.execute(query)
+        except Exception as e:
+            logger.error("Failed to summarize sessions", error=str(e))
+            raise
+        return {status: count for status, count in result.all()}
+    
     async def get_session_messages(
         self,
         db: AsyncSession,
@@ -108,44 +262,184 @@ class SessionManager:
             logger.error("Failed to get session messages", session_id=session_id, error=str(e))
             raise
     
+    async def get_message_page(
+        self,
+        db: AsyncSession,
+        session_id: str,
+        limit: int,
+        before: Optional[str] = None,
+        after: Optional[str] = None,
+        since: Optional[datetime] = None,
+        pending: Iterable[Message] = (),
+    ) -> Tuple[List[Message], bool]:
+        """
+        One page of a session's messages in (timestamp, message_id) order.
+        
+        `before` and `after` are cursors from encode_message_cursor and are
+        exclusive; `since` keeps messages at or after a timestamp. With a
+        lower bound (`after` or `since`) the page is the oldest `limit`
+        messages past it, otherwise the newest `limit` messages, so the
+        latest page is a single index range scan however long the session.
+        Returns the messages oldest first and whether more exist beyond the
+        page in the direction it was read. Raises ValueError for a malformed
+        session ID or cursor.
+        
+        `pending` are messages accepted but not yet committed, from
+        MessageWriter.pending(); they are merged in so a client reads its own
+        writes. Take them before calling, so a row committed meanwhile is
+        found in one place or the other.
+        """
+        session_uuid = uuid.UUID(session_id)
+        pending = [m for m in pending if m.session_id == session_uuid]
+        if pending:
+            pending = self._filter_pending(pending, before, after, since)
+        key = tuple_(Message.timestamp, Message.message_id)
+        query = select(Message).where(Message.session_id == session_uuid)
+        if before is not None:
+            query = query.where(key < _cursor_key(before, Message.timestamp, Message.message_id))
+        if after is not None:
+            query = query.where(key > _cursor_key(after, Message.timestamp, Message.message_id))
+        if since is not None:
+            query = query.where(Message.timestamp >= since)
+        
+        forward = after is not None or since is not None
+        if forward:
+            query = query.order_by(Message.timestamp, Message.message_id)
+        else:
+            query = query.order_by(desc(Message.timestamp), desc(Message.message_id))
+        
+        try:
+            # One extra row tells whether there is another page
+            result = await db.execute(query.limit(limit + 1))
+            messages = list(result.scalars().all())
+        except Exception as e:
+            logger.error("Failed to get message page", session_id=session_id, error=str(e))
+            raise
+        
+        if pending:
+            seen = {m.message_id for m in messages}
+            messages += [m for m in pending if m.message_id not in seen]
+            messages.sort(key=_message_key, reverse=not forward)
+        
+        has_more = len(messages) > limit
+        messages = messages[:limit]
+        if not forward:
+            messages.reverse()
+        logger.info("Message page retrieved",
+                   session_id=session_id,
+                   count=len(messages),
+                   has_more=has_more)
+        return messages, has_more
+    
+    @staticmethod
+    def _filter_pending(
+        pending: List[Message],
+        before: Optional[str],
+        after: Optional[str],
+        since: Optional[datetime],
+    ) -> List[Message]:
+        """The same bounds as get_message_page's query, applied in memory."""
+        if before is not None:
+            timestamp, row_id = decode_cursor(before)
+            bound = (_as_utc(timestamp), row_id)
+            pending = [m for m in pending if _message_key(m) < bound]
+        if after is not None:
+            timestamp, row_id = decode_cursor(after)
+            bound = (_as_utc(timestamp), row_id)
+            pending = [m for m in pending if _message_key(m) > bound]
+        if since is not None:
+            pending = [m for m in pending if _as_utc(m.timestamp) >= _as_utc(since)]
+        return pending
+    
     async def create_message(
         self,
         db: AsyncSession,
         session_id: str,
         message_data: MessageCreate
     ) -> Message:
-        """Create a new message in a session."""
+        """
+        Create a new message in a session.
+        
+        A single INSERT ... SELECT guarded by the session's existence, with
+        RETURNING, so there is no separate lookup or refresh. Raises
+        ValueError if the session ID is malformed or the session doesn't exist.
+        """
         try:
             session_uuid = uuid.UUID(session_id)
-            
-            # Verify session exists
-            session = await self.get_session(db, session_id)
-            if not session:
-                raise ValueError(f"Session {session_id} not found")
-            
-            message = Message(
-                session_id=session_uuid,
-                role=message_data.role.value,
-                content=message_data.content,
-                message_metadata=message_data.message_metadata or {}
+        except ValueError:
+            logger.warning("Invalid session ID format", session_id=session_id)
+            raise
+        try:
+            values = select(
+                literal(uuid.uuid4(), Message.message_id.type),
+                literal(session_uuid, Message.session_id.type),
+                literal(message_data.role.value, Message.role.type),
+                literal(message_data.content, Message.content.type),
+                literal(datetime.now(timezone.utc), Message.timestamp.type),
+                literal(message_data.message_metadata or {}, Message.message_metadata.type),
+            ).where(exists().where(Session.session_id == session_uuid))
+            stmt = (
+                insert(Message)
+                .from_select(
+                    ["message_id", "session_id", "role", "content", "timestamp", "message_metadata"],
+                    values,
+                )
+                .returning(Message)
             )
-            
-            db.add(message)
+            result = await db.execute(select(Message).from_statement(stmt))
+            message = result.scalar_one_or_none()
+            if message is None:
+                self.session_cache.discard(session_id)
+                logger.warning("Message not created: session not found", session_id=session_id)
+                raise ValueError(f"Session {session_id} not found")
             await db.commit()
-            await db.refresh(message)
             
             logger.info("Message created", session_id=session_id, message_id=str(message.message_id))
             return message
         except ValueError:
-            logger.warning("Invalid session ID format", session_id=session_id)
             raise
         except Exception as e:
             await db.rollback()
             logger.error("Failed to create message", session_id=session_id, error=str(e))
             raise
     
-    async def get_or_create_worker(self, session_id: str):
+    async def record_owner(
+        self,
+        db: AsyncSession,
+        session_id: str,
+        owner: str
+    ) -> None:
+        """Store the process that owns the session's worker in Session.worker_id."""
+        try:
+            await db.execute(
+                update(Session)
+                .where(Session.session_id == uuid.UUID(session_id))
+                .values(worker_id=owner)
+            )
+            await db.commit()
+            if self.session_cache.get(session_id) is not None:
+                self.session_cache.put(session_id, owner)
+            logger.info("Session owner recorded", session_id=session_id, owner=owner)
+        except Exception as e:
+            await db.rollback()
+            logger.error("Failed to record session owner", session_id=session_id, error=str(e))
+            raise
+    
+    async def get_or_create_worker(
+        self,
+        session_id: str,
+        on_queue_position: Optional[Callable[[int], Awaitable[None]]] = None,
+        db: Optional[AsyncSession] = None,
+        pending: Iterable[Message] = (),
+    ):
+        """
+        Get the session's worker, waiting in the admission queue if the pool is full.
         
+        With `db`, a session whose worker was evicted, reaped or died gets a
+        new worker seeded with its latest stored messages (plus `pending`
+        ones from MessageWriter.pending()), so it keeps its conversation. A
+        session that never had a worker skips the lookup.
+        """
         try:
             # Try to get existing worker
             worker = await self.worker_pool.get_worker(session_id)
@@ -153,8 +447,17 @@ class SessionManager:
                 logger.info("Using existing worker", session_id=session_id, worker_id=worker.worker_id)
                 return worker
             
+            history = None
+            if db is not None and self.worker_pool.had_worker(session_id):
+                messages, _ = await self.get_message_page(
+                    db, session_id, get_settings().history_restore_messages, pending=pending
+                )
+                history = [{"role": m.role, "content": m.content} for m in messages]
+                if history:
+                    logger.info("Restoring conversation history", session_id=session_id, messages=len(history))
+            
             # Create new worker if none exists
-            worker = await self.worker_pool.spawn_worker(session_id)
+            worker = await self.worker_pool.spawn_worker(session_id, on_queue_position, history)
             logger.info("Created new worker", session_id=session_id, worker_id=worker.worker_id)
             return worker
             
@@ -173,6 +476,7 @@ class SessionManager:
             if not session:
                 return False
             
+            self.session_cache.discard(session_id)
             # Terminate the worker if it exists
             await self.worker_pool.terminate_worker(session_id)
             # Update session status
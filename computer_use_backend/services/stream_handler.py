@@ -3,86 +3,361 @@ Stream handler for managing WebSocket connections and broadcasting updates.
 """
 
 import asyncio
-from typing import Dict, Set
+import json
+from collections import deque
+from itertools import islice
+from typing import Any, Deque, Dict, FrozenSet, List, Optional, Set, Tuple
 from datetime import datetime
 from fastapi import WebSocket
 
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson is optional
+    orjson = None
+
+from ..config import get_settings
 from ..models.schemas import AgentUpdate, UpdateType
 from ..logging_config import get_logger
+from .broadcast import BroadcastBackend, InMemoryBroadcastBackend
 
 logger = get_logger(__name__)
 
+# Progress updates a slow client can miss without losing the outcome
+_DROPPABLE_STATUSES = {"processing", "queued"}
+
+# Control messages sent through the backend in place of an update's seq
+_DISCARD_SEQ = 0
+_TRIM_SEQ = -1
+
+
+def encode_update(update_data: Dict[str, Any]) -> str:
+    """Serialize an update to the JSON text sent to every client."""
+    if orjson is not None:
+        return orjson.dumps(update_data, default=str).decode()
+    return json.dumps(update_data, default=str, separators=(",", ":"))
+
+
+def is_droppable(update: AgentUpdate) -> bool:
+    """True for intermediate progress; results, errors and completion are never dropped."""
+    metadata = update.metadata or {}
+    if update.update_type in (UpdateType.CONTENT_DELTA, UpdateType.SCREENSHOT):
+        return True
+    if update.update_type == UpdateType.TOOL_RESULT:
+        return bool(metadata.get("partial"))
+    if update.update_type == UpdateType.THINKING:
+        return metadata.get("status") in _DROPPABLE_STATUSES
+    return False
+
+
+class ClientChannel:
+    """
+    Outbound queue and writer task for one WebSocket client.
+    
+    Broadcasts only enqueue, so a client that stops reading can never stall
+    the agent. When the queue is full the slow-client policy decides:
+    drop_oldest discards the oldest droppable update, coalesce folds every
+    queued droppable update into one "updates_skipped" notice, and
+    disconnect closes the client.
+    """
+    
+    def __init__(self, handler: "StreamHandler", session_id: str, websocket: WebSocket,
+                 max_queue: int, policy: str):
+        self.handler = handler
+        self.session_id = session_id
+        self.websocket = websocket
+        self.max_queue = max_queue
+        self.policy = policy
+        # (payload, droppable, updates folded into it by coalescing)
+        self.queue: Deque[Tuple[str, bool, int]] = deque()
+        self.dropped = 0
+        self._ready = asyncio.Event()
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self.task = asyncio.create_task(self._writer())
+    
+    def offer(self, payload: str, droppable: bool) -> bool:
+        """Queue a frame. Returns False if the client has to be disconnected."""
+        if len(self.queue) >= self.max_queue and not self._make_room():
+            return False
+        self.queue.append((payload, droppable, 0))
+        self._idle.clear()
+        self._ready.set()
+        return True
+    
+    def _make_room(self) -> bool:
+        # A queue holding nothing but results and errors can't be thinned out
+        if self.policy == "drop_oldest":
+            for i, (_, droppable, skipped) in enumerate(self.queue):
+                if droppable:
+                    del self.queue[i]
+                    self.dropped += max(skipped, 1)
+                    return True
+        elif self.policy == "coalesce":
+            kept = deque(entry for entry in self.queue if not entry[1])
+            # An earlier notice is folded into the new one
+            skipped = sum(max(entry[2], 1) for entry in self.queue if entry[1])
+            if skipped and len(kept) < self.max_queue - 1:
+                # Updates folded into an earlier notice were already counted
+                self.dropped += sum(1 for entry in self.queue if entry[1] and not entry[2])
+                notice = encode_update({"type": "updates_skipped", "count": skipped})
+                kept.append((notice, True, skipped))
+                self.queue = kept
+                return True
+        return False
+    
+    async def wait_idle(self) -> None:
+        """Wait until everything queued so far has been written."""
+        await self._idle.wait()
+    
+    async def _writer(self) -> None:
+        while True:
+            await self._ready.wait()
+            while self.queue:
+                payload = self.queue.popleft()[0]
+                try:
+                    await self.websocket.send_text(payload)
+                except Exception as e:
+                    logger.warning("Failed to send update to client", 
+                                 session_id=self.session_id,
+                                 error=str(e))
+                    await self.handler.unregister_client(self.session_id, self.websocket)
+                    return
+            self._ready.clear()
+            self._idle.set()
+
+
+class SessionLog:
+    """Sequence counter and bounded replay ring of one session's updates."""
+    
+    def __init__(self, size: int):
+        self.last_seq = 0
+        # Highest seq handed out here, possibly not yet delivered back
+        self.published_seq = 0
+        # (seq, payload, droppable)
+        self.entries: Deque[Tuple[int, str, bool]] = deque(maxlen=size)
+    
+    def next_seq(self) -> int:
+        self.published_seq = max(self.published_seq, self.last_seq) + 1
+        return self.published_seq
+    
+    def record(self, seq: int, payload: str, droppable: bool) -> None:
+        if seq != self.last_seq + 1:
+            # Updates were lost on the way; anyone older than this must resync
+            self.entries.clear()
+        self.last_seq = seq
+        self.entries.append((seq, payload, droppable))
+    
+    def trim(self) -> None:
+        """Free the replay ring but keep counting; older resumes get a resync."""
+        self.entries.clear()
+    
+    def since(self, seq: int) -> Optional[List[Tuple[str, bool]]]:
+        """(payload, droppable) after `seq`, or None if some have left the ring."""
+        if seq == self.last_seq:
+            return []
+        # Ahead of us, e.g. the client saw a previous server process
+        if seq > self.last_seq:
+            return None
+        if not self.entries or self.entries[0][0] > seq + 1:
+            return None
+        # Sequence numbers are contiguous, so the start index is computed directly
+        start = max(seq + 1 - self.entries[0][0], 0)
+        return [(payload, droppable) for _, payload, droppable in islice(self.entries, start, None)]
+
+
 class StreamHandler:
     """
     Manages WebSocket connections and broadcasts agent updates to connected clients.
+    
+    Every update gets a per-session sequence number and is kept in a bounded
+    replay ring, so a client that reconnects can ask for just what it missed.
+    
+    Updates travel through a broadcast backend before reaching clients. The
+    in-memory backend hands them straight back; a shared one (Redis) carries
+    them to every server process, each of which keeps its own replay ring
+    and serves its own clients.
     """
     
-    def __init__(self):
-        # Map of session_id -> set of WebSocket connections
-        self.connections: Dict[str, Set[WebSocket]] = {}
-        self._lock = asyncio.Lock()
-        logger.info("StreamHandler initialized")
+    def __init__(self, backend: Optional[BroadcastBackend] = None):
+        settings = get_settings()
+        self.backend = backend or InMemoryBroadcastBackend()
+        self.backend.deliver = self._deliver
+        # Map of session_id -> WebSocket connections. Each set is replaced rather
+        # than mutated, so a broadcast can iterate its snapshot without a lock.
+        self.connections: Dict[str, FrozenSet[WebSocket]] = {}
+        self._channels: Dict[WebSocket, ClientChannel] = {}
+        self._logs: Dict[str, SessionLog] = {}
+        # Fire-and-forget tasks, referenced until done so they aren't collected
+        self._tasks: Set[asyncio.Task] = set()
+        self.replay_size = settings.stream_replay_size
+        self.client_queue_size = settings.stream_client_queue_size
+        self.slow_client_policy = settings.stream_slow_client_policy
+        logger.info("StreamHandler initialized",
+                   slow_client_policy=self.slow_client_policy,
+                   backend=type(self.backend).__name__)
+    
+    async def start(self) -> None:
+        """Connect the broadcast backend."""
+        await self.backend.start()
+    
+    async def register_client(
+        self,
+        session_id: str,
+        websocket: WebSocket,
+        since: Optional[int] = None,
+    ) -> None:
+        """
+        Start streaming a session's updates to a client.
+        
+        With `since`, updates after that sequence number are replayed first.
+        If they are no longer all in the replay ring, or are more than the
+        client's queue holds, a "resync_required" frame is sent instead and
+        the client should refetch the messages.
+        """
+        channel = ClientChannel(
+            self, session_id, websocket, self.client_queue_size, self.slow_client_policy
+        )
+        replayed = 0
+        if since is not None:
+            log = self._logs.get(session_id) or SessionLog(0)
+            missed = log.since(since)
+            if missed is None or len(missed) >= self.client_queue_size:
+                channel.offer(encode_update({
+                    "type": "resync_required",
+                    "session_id": session_id,
+                    "last_seq": log.last_seq,
+                }), False)
+            else:
+                for payload, droppable in missed:
+                    channel.offer(payload, droppable)
+                replayed = len(missed)
+        
+        # No await since the replay, so nothing broadcast in between is missed or repeated
+        self._channels[websocket] = channel
+        self.connections[session_id] = self.connections.get(session_id, frozenset()) | {websocket}
+        logger.info("Client registered", 
+                   session_id=session_id, 
+                   total_clients=len(self.connections[session_id]),
+                   since=since,
+                   replayed=replayed)
+    
+    def last_seq(self, session_id: str) -> int:
+        log = self._logs.get(session_id)
+        return log.last_seq if log else 0
+    
+    def discard_session(self, session_id: str) -> None:
+        """Forget a finished session's replay log, in every process."""
+        self._logs.pop(session_id, None)
+        if self.backend.shared:
+            self._spawn(self.backend.publish(session_id, _DISCARD_SEQ, "", False))
     
-    async def register_client(self, session_id: str, websocket: WebSocket) -> None:
+    def trim_session(self, session_id: str) -> None:
+        """
+        Free a session's replay ring, in every process, while it has no worker.
         
-        async with self._lock:
-            if session_id not in self.connections:
-                self.connections[session_id] = set()
-            
-            self.connections[session_id].add(websocket)
-            logger.info("Client registered", 
-                       session_id=session_id, 
-                       total_clients=len(self.connections[session_id]))
+        Its sequence numbers carry on, so a client resuming from before the
+        trim gets a resync.
+        """
+        log = self._logs.get(session_id)
+        if log:
+            log.trim()
+        if self.backend.shared:
+            self._spawn(self.backend.publish(session_id, _TRIM_SEQ, "", False))
+    
+    def _spawn(self, coro) -> None:
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
     
     async def unregister_client(self, session_id: str, websocket: WebSocket) -> None:
         
-        async with self._lock:
-            if session_id in self.connections:
-                self.connections[session_id].discard(websocket)
-                
-                # Clean up empty session entries
-                if not self.connections[session_id]:
-                    del self.connections[session_id]
-                
-                logger.info("Client unregistered", 
-                           session_id=session_id,
-                           remaining_clients=len(self.connections.get(session_id, [])))
-    
-    async def broadcast_update(self, session_id: str, update: AgentUpdate) -> None:
-        if session_id not in self.connections:
-            # No clients connected, skip broadcasting
+        channel = self._channels.pop(websocket, None)
+        if channel and channel.task is not asyncio.current_task():
+            channel.task.cancel()
+        
+        clients = self.connections.get(session_id)
+        if clients is None or websocket not in clients:
             return
         
-        # Convert update to JSON-serializable dict
-        update_data = {
+        remaining = clients - {websocket}
+        if remaining:
+            self.connections[session_id] = remaining
+        else:
+            # Clean up empty session entries
+            del self.connections[session_id]
+        
+        logger.info("Client unregistered", 
+                   session_id=session_id,
+                   remaining_clients=len(remaining),
+                   dropped_updates=channel.dropped if channel else 0)
+    
+    async def broadcast_update(self, session_id: str, update: AgentUpdate) -> None:
+        """Publish an update to every client of the session; never waits on a client."""
+        # Serialize once and queue the same text frame for everyone. Updates are
+        # logged even with no clients connected so a reconnect can catch up.
+        update.seq = self._log(session_id).next_seq()
+        payload = encode_update({
             "type": "agent_update",
+            "seq": update.seq,
             "update_type": update.update_type.value,
             "content": update.content,
             "timestamp": update.timestamp.isoformat(),
             "metadata": update.metadata
-        }
+        })
+        await self.backend.publish(session_id, update.seq, payload, is_droppable(update))
+    
+    def _log(self, session_id: str) -> SessionLog:
+        log = self._logs.get(session_id)
+        if log is None:
+            log = self._logs[session_id] = SessionLog(self.replay_size)
+        return log
+    
+    async def _deliver(self, session_id: str, seq: int, payload: str, droppable: bool) -> None:
+        """Record an update from the backend and queue it for this process's clients."""
+        if seq == _DISCARD_SEQ:
+            self._logs.pop(session_id, None)
+            return
+        if seq == _TRIM_SEQ:
+            log = self._logs.get(session_id)
+            if log:
+                log.trim()
+            return
+        self._log(session_id).record(seq, payload, droppable)
         
-        # Get a copy of connections to avoid modification during iteration
-        async with self._lock:
-            clients = list(self.connections.get(session_id, []))
+        clients = self.connections.get(session_id)
+        if not clients:
+            return
         
-        # Broadcast to all clients
-        disconnected_clients = []
         for websocket in clients:
-            try:
-                await websocket.send_json(update_data)
-            except Exception as e:
-                logger.warning("Failed to send update to client", 
+            channel = self._channels.get(websocket)
+            if channel and not channel.offer(payload, droppable):
+                logger.warning("Disconnecting slow client", 
                              session_id=session_id,
-                             error=str(e))
-                disconnected_clients.append(websocket)
-        
-        # Clean up disconnected clients
-        if disconnected_clients:
-            async with self._lock:
-                for websocket in disconnected_clients:
-                    if session_id in self.connections:
-                        self.connections[session_id].discard(websocket)
+                             queued=len(channel.queue))
+                await self.unregister_client(session_id, websocket)
+                self._spawn(self._close(websocket))
+    
+    async def _close(self, websocket: WebSocket) -> None:
+        try:
+            # 1013: try again later
+            await websocket.close(code=1013, reason="Client too slow")
+        except Exception:
+            pass
+    
+    async def wait_idle(self, session_id: Optional[str] = None) -> None:
+        """Wait until queued updates have been written (all sessions by default)."""
+        channels = [
+            c for c in list(self._channels.values())
+            if session_id is None or c.session_id == session_id
+        ]
+        await asyncio.gather(*(c.wait_idle() for c in channels))
+    
+    async def close(self) -> None:
+        """Stop every writer task and disconnect the backend."""
+        for channel in list(self._channels.values()):
+            await self.unregister_client(channel.session_id, channel.websocket)
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        await self.backend.close()
     
     async def send_status(self, session_id: str, status: str, message: str) -> None:
         
@@ -94,6 +369,16 @@ class StreamHandler:
         )
         await self.broadcast_update(session_id, update)
     
+    async def send_queue_position(self, session_id: str, position: int) -> None:
+        """Tell clients the session is waiting for a worker and where it is in line."""
+        update = AgentUpdate(
+            update_type=UpdateType.THINKING,
+            content=f"Waiting for an available worker (position {position} in queue)...",
+            timestamp=datetime.utcnow(),
+            metadata={"status": "queued", "queue_position": position}
+        )
+        await self.broadcast_update(session_id, update)
+    
     async def send_error(self, session_id: str, error_message: str) -> None:
         
         update = AgentUpdate(
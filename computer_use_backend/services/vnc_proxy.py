@@ -0,0 +1,149 @@
+"""
+WebSocket to RFB proxy so browser VNC clients (noVNC) can reach a worker's x11vnc.
+"""
+
+import asyncio
+import socket
+import time
+from dataclasses import dataclass, field
+from typing import ClassVar, Dict, List, Set
+
+from fastapi import WebSocket, WebSocketDisconnect
+
+from ..logging_config import get_logger
+
+logger = get_logger(__name__)
+
+
+@dataclass
+class ProxyStats:
+    """Per-connection traffic counters."""
+    started_at: float = field(default_factory=time.monotonic)
+    bytes_to_client: int = 0
+    frames_to_client: int = 0
+    bytes_to_server: int = 0
+    frames_to_server: int = 0
+    
+    def as_dict(self) -> Dict[str, float]:
+        return {
+            "duration_seconds": round(time.monotonic() - self.started_at, 3),
+            "bytes_to_client": self.bytes_to_client,
+            "frames_to_client": self.frames_to_client,
+            "bytes_to_server": self.bytes_to_server,
+            "frames_to_server": self.frames_to_server,
+        }
+
+
+class VNCProxy:
+    """
+    Relays binary RFB traffic between one WebSocket and the VNC server's TCP port.
+    
+    Two pumps run concurrently, one per direction, and the connection closes
+    when either side does. Server-to-client data is read into a single
+    preallocated buffer and sent from a view of it, so no per-frame copy is
+    made. The next read only happens once the previous frame has been handed
+    to the transport, so a slow browser stalls x11vnc through TCP flow control
+    instead of piling frames up in memory.
+    """
+    
+    # Open proxies by session, for health reporting
+    active: ClassVar[Dict[str, Set["VNCProxy"]]] = {}
+    
+    def __init__(
+        self,
+        websocket: WebSocket,
+        session_id: str,
+        port: int,
+        host: str = "127.0.0.1",
+        buffer_size: int = 64 * 1024,
+    ):
+        self.websocket = websocket
+        self.session_id = session_id
+        self.host = host
+        self.port = port
+        self.stats = ProxyStats()
+        self._buffer = bytearray(buffer_size)
+        self._sock: socket.socket | None = None
+    
+    async def connect(self) -> None:
+        """Open the TCP connection to the VNC server."""
+        loop = asyncio.get_running_loop()
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setblocking(False)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        try:
+            await loop.sock_connect(sock, (self.host, self.port))
+        except OSError:
+            sock.close()
+            raise
+        self._sock = sock
+    
+    async def run(self) -> None:
+        """Pump both directions until either side disconnects."""
+        if self._sock is None:
+            await self.connect()
+        self.active.setdefault(self.session_id, set()).add(self)
+        pumps = [
+            asyncio.create_task(self._server_to_client()),
+            asyncio.create_task(self._client_to_server()),
+        ]
+        try:
+            done, pending = await asyncio.wait(pumps, return_when=asyncio.FIRST_COMPLETED)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+            for task in done:
+                # Surface unexpected errors; disconnects end the pump quietly
+                task.result()
+        finally:
+            for task in pumps:
+                task.cancel()
+            self._sock.close()
+            sessions = self.active.get(self.session_id)
+            if sessions is not None:
+                sessions.discard(self)
+                if not sessions:
+                    del self.active[self.session_id]
+            logger.info("VNC proxy closed", session_id=self.session_id, **self.stats.as_dict())
+    
+    async def _server_to_client(self) -> None:
+        loop = asyncio.get_running_loop()
+        view = memoryview(self._buffer)
+        stats = self.stats
+        while True:
+            try:
+                n = await loop.sock_recv_into(self._sock, self._buffer)
+            except OSError:
+                return
+            if not n:
+                return
+            try:
+                # The ASGI server frames the data before send returns, so the
+                # buffer is free to be reused afterwards
+                await self.websocket.send_bytes(view[:n])
+            except (WebSocketDisconnect, RuntimeError, OSError):
+                return
+            stats.bytes_to_client += n
+            stats.frames_to_client += 1
+    
+    async def _client_to_server(self) -> None:
+        loop = asyncio.get_running_loop()
+        stats = self.stats
+        while True:
+            message = await self.websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                return
+            data = message.get("bytes")
+            if data is None:
+                # RFB is binary-only; ignore keepalive text frames
+                continue
+            try:
+                await loop.sock_sendall(self._sock, data)
+            except OSError:
+                return
+            stats.bytes_to_server += len(data)
+            stats.frames_to_server += 1
+    
+    @classmethod
+    def session_stats(cls, session_id: str) -> List[Dict[str, float]]:
+        return [proxy.stats.as_dict() for proxy in cls.active.get(session_id, ())]
@@ -3,8 +3,12 @@ VNC server management for desktop access.
 """
 
 import asyncio
+import os
+import signal
 import subprocess
-from typing import Optional
+import time
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, List, Optional, Sequence
 from pathlib import Path
 
 from ..config import get_settings
@@ -12,26 +16,204 @@ from ..logging_config import get_logger
 
 logger = get_logger(__name__)
 
+# Readiness polling starts fast and backs off up to this interval
+_READY_POLL_INITIAL = 0.01
+_READY_POLL_MAX = 0.25
+
+
+class ManagedProcess:
+    """
+    A child process run without blocking the event loop.
+    
+    stderr is drained continuously into a bounded ring of recent lines so a
+    chatty process can never fill its pipe. A watcher task notices the moment
+    the process exits and reports it through `on_exit`, unless the exit was
+    requested with stop().
+    """
+    
+    def __init__(
+        self,
+        name: str,
+        on_exit: Optional[Callable[[str, int], None]] = None,
+        stderr_lines: int = 100,
+    ):
+        self.name = name
+        self.on_exit = on_exit
+        self.process: Optional[asyncio.subprocess.Process] = None
+        self.stderr: Deque[str] = deque(maxlen=stderr_lines)
+        self._drain_task: Optional[asyncio.Task] = None
+        self._watch_task: Optional[asyncio.Task] = None
+        self._stopping = False
+    
+    async def start(
+        self,
+        cmd: List[str],
+        pass_fds: Sequence[int] = (),
+        inherit_stdout: bool = False,
+    ) -> None:
+        self.process = await asyncio.create_subprocess_exec(
+            *cmd,
+            stdin=subprocess.DEVNULL,
+            stdout=None if inherit_stdout else subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            pass_fds=pass_fds,
+            # Own process group so stop() also reaches any children
+            start_new_session=True,
+        )
+        self._drain_task = asyncio.create_task(self._drain())
+        self._watch_task = asyncio.create_task(self._watch())
+    
+    @property
+    def pid(self) -> Optional[int]:
+        return self.process.pid if self.process else None
+    
+    @property
+    def returncode(self) -> Optional[int]:
+        return self.process.returncode if self.process else None
+    
+    @property
+    def running(self) -> bool:
+        return self.process is not None and self.process.returncode is None
+    
+    def stderr_tail(self) -> str:
+        return "\n".join(self.stderr)
+    
+    def expect_exit(self) -> None:
+        """The process has been asked to exit on its own; don't report it."""
+        self._stopping = True
+    
+    async def stop(self, timeout: float) -> None:
+        """SIGTERM the process group, then SIGKILL it if it outlives `timeout`."""
+        self._stopping = True
+        if self.running:
+            self._signal(signal.SIGTERM)
+            try:
+                await asyncio.wait_for(self.process.wait(), timeout)
+            except asyncio.TimeoutError:
+                logger.warning("Process ignored SIGTERM, killing", name=self.name, pid=self.pid)
+                self._signal(signal.SIGKILL)
+                await self.process.wait()
+        for task in (self._watch_task, self._drain_task):
+            if task and not task.done():
+                task.cancel()
+        await asyncio.gather(
+            *(t for t in (self._watch_task, self._drain_task) if t), return_exceptions=True
+        )
+    
+    def _signal(self, sig: int) -> None:
+        try:
+            os.killpg(self.process.pid, sig)
+        except ProcessLookupError:
+            pass
+    
+    async def _drain(self) -> None:
+        while True:
+            line = await self.process.stderr.readline()
+            if not line:
+                return
+            self.stderr.append(line.decode(errors="replace").rstrip())
+    
+    async def _watch(self) -> None:
+        returncode = await self.process.wait()
+        if self._stopping:
+            return
+        # Let the drain pick up the last words before reporting
+        if self._drain_task:
+            await asyncio.wait({self._drain_task}, timeout=0.1)
+        logger.error("Process exited unexpectedly",
+                    name=self.name,
+                    pid=self.pid,
+                    returncode=returncode,
+                    stderr=self.stderr_tail()[-500:])
+        if self.on_exit:
+            self.on_exit(self.name, returncode)
+
+
+async def wait_until_ready(
+    probe: Callable[[], Awaitable[bool]],
+    process: ManagedProcess,
+    timeout: float,
+) -> float:
+    """
+    Poll `probe` with exponential backoff until it succeeds.
+    
+    Returns the seconds it took. Raises RuntimeError if the process exits
+    first or the timeout passes.
+    """
+    started = time.perf_counter()
+    deadline = started + timeout
+    delay = _READY_POLL_INITIAL
+    while True:
+        if not process.running:
+            raise RuntimeError(f"{process.name} failed to start: {process.stderr_tail()}")
+        if await probe():
+            return time.perf_counter() - started
+        remaining = deadline - time.perf_counter()
+        if remaining <= 0:
+            raise RuntimeError(f"{process.name} not ready after {timeout}s")
+        await asyncio.sleep(min(delay, remaining))
+        delay = min(delay * 2, _READY_POLL_MAX)
+
+
+async def x_display_ready(socket_path: Path) -> bool:
+    """True once the X server accepts connections on its Unix socket."""
+    try:
+        _, writer = await asyncio.open_unix_connection(str(socket_path))
+    except OSError:
+        return False
+    writer.close()
+    return True
+
+
+async def rfb_ready(port: int, host: str = "127.0.0.1") -> bool:
+    """True once the VNC server accepts a connection and sends its RFB banner."""
+    try:
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), 1.0)
+    except (OSError, asyncio.TimeoutError):
+        return False
+    try:
+        # "RFB xxx.yyy\n"
+        banner = await asyncio.wait_for(reader.readexactly(12), 1.0)
+        return banner.startswith(b"RFB ")
+    except (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError):
+        return False
+    finally:
+        writer.close()
+
+
 class VNCServer:
     """
     Manages a VNC server instance for a session.
     Provides remote desktop access to the Computer Use Agent's environment.
     """
-    def __init__(self, session_id: str, display_num: int):
+    # Where the X server creates its socket, X<display_num>
+    x11_socket_dir = Path("/tmp/.X11-unix")
+    
+    def __init__(self, session_id: str, display_num: int, vnc_port: Optional[int] = None):
         self.session_id = session_id
         self.display_num = display_num
         self.settings = get_settings()
         
-        # VNC port is base_port + display_num
-        self.vnc_port = self.settings.vnc_base_port + display_num
+        # VNC port defaults to base_port + display_num
+        self.vnc_port = vnc_port or self.settings.vnc_base_port + display_num
+        
+        # Directory where Xvfb keeps the framebuffer for in-process screenshots
+        self.fbdir = Path(self.settings.xvfb_fbdir) / str(display_num)
+        
+        # Called with (process name, exit code) if Xvfb or x11vnc dies on its own
+        self.on_exit: Optional[Callable[[str, int], None]] = None
         
         # Process handles
-        self.xvfb_process: Optional[subprocess.Popen] = None
-        self.x11vnc_process: Optional[subprocess.Popen] = None
+        self.xvfb_process = ManagedProcess("Xvfb", self._process_exited)
+        self.x11vnc_process = ManagedProcess("x11vnc", self._process_exited)
         
         self.is_running = False
+        self.startup_timeout = self.settings.vnc_startup_timeout
+        self.stop_timeout = self.settings.vnc_stop_timeout
+        # Seconds each process took to become ready
+        self.startup_seconds: Dict[str, float] = {}
         
-        logger.info("VNCServer created", 
+        logger.info("VNCServer created",
                    session_id=session_id,
                    display_num=display_num,
                    vnc_port=self.vnc_port)
@@ -52,7 +234,7 @@ class VNCServer:
                        session_id=self.session_id,
                        vnc_port=self.vnc_port,
                        display=f":{self.display_num}")
-            
+        
         except Exception as e:
             logger.error("Failed to start VNC server",
                         session_id=self.session_id,
@@ -64,42 +246,40 @@ class VNCServer:
         """Start Xvfb virtual display."""
         try:
             # Xvfb command: Xvfb :display_num -screen 0 WIDTHxHEIGHTx24
+            self.fbdir.mkdir(parents=True, exist_ok=True)
             cmd = [
                 "Xvfb",
                 f":{self.display_num}",
                 "-screen", "0",
                 f"{self.settings.width}x{self.settings.height}x24",
+                "-fbdir", str(self.fbdir),  # Memory-mapped framebuffer for screenshots
                 "-ac",  # Disable access control
                 "+extension", "RANDR"  # Enable RANDR extension
             ]
             
-            logger.info("Starting Xvfb", 
+            logger.info("Starting Xvfb",
                        session_id=self.session_id,
                        command=" ".join(cmd))
             
-            self.xvfb_process = subprocess.Popen(
-                cmd,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                start_new_session=True
-            )
-            
-            # Wait a bit for Xvfb to start
-            await asyncio.sleep(0.5)
+            await self.xvfb_process.start(cmd)
             
-            # Check if process is still running
-            if self.xvfb_process.poll() is not None:
-                stderr = self.xvfb_process.stderr.read().decode() if self.xvfb_process.stderr else ""
-                raise RuntimeError(f"Xvfb failed to start: {stderr}")
+            # Ready once the display's socket accepts connections
+            socket_path = self.x11_socket_dir / f"X{self.display_num}"
+            self.startup_seconds["xvfb"] = await wait_until_ready(
+                lambda: x_display_ready(socket_path),
+                self.xvfb_process,
+                self.startup_timeout,
+            )
             
-            logger.info("Xvfb started", 
+            logger.info("Xvfb started",
                        session_id=self.session_id,
-                       pid=self.xvfb_process.pid)
-            
+                       pid=self.xvfb_process.pid,
+                       startup_seconds=round(self.startup_seconds["xvfb"], 3))
+        
         except FileNotFoundError:
             raise RuntimeError("Xvfb not found. Please install: apt-get install xvfb")
         except Exception as e:
-            logger.error("Failed to start Xvfb", 
+            logger.error("Failed to start Xvfb",
                         session_id=self.session_id,
                         error=str(e))
             raise
@@ -116,33 +296,27 @@ class VNCServer:
                 "-shared",   # Allow multiple clients
                 "-nopw",     # No password (for development)
                 "-quiet",    # Reduce log output
-                "-bg"        # Run in background
             ]
             
             logger.info("Starting x11vnc",
                        session_id=self.session_id,
                        command=" ".join(cmd))
             
-            self.x11vnc_process = subprocess.Popen(
-                cmd,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                start_new_session=True
-            )
+            await self.x11vnc_process.start(cmd)
             
-            # Wait for x11vnc to start
-            await asyncio.sleep(0.5)
-            
-            # Check if process is still running
-            if self.x11vnc_process.poll() is not None:
-                stderr = self.x11vnc_process.stderr.read().decode() if self.x11vnc_process.stderr else ""
-                raise RuntimeError(f"x11vnc failed to start: {stderr}")
+            # Ready once the port answers with an RFB protocol banner
+            self.startup_seconds["x11vnc"] = await wait_until_ready(
+                lambda: rfb_ready(self.vnc_port),
+                self.x11vnc_process,
+                self.startup_timeout,
+            )
             
             logger.info("x11vnc started",
                        session_id=self.session_id,
                        pid=self.x11vnc_process.pid,
-                       vnc_port=self.vnc_port)
-            
+                       vnc_port=self.vnc_port,
+                       startup_seconds=round(self.startup_seconds["x11vnc"], 3))
+        
         except FileNotFoundError:
             raise RuntimeError("x11vnc not found. Please install: apt-get install x11vnc")
         except Exception as e:
@@ -151,6 +325,11 @@ class VNCServer:
                         error=str(e))
             raise
     
+    def _process_exited(self, name: str, returncode: int) -> None:
+        self.is_running = False
+        if self.on_exit:
+            self.on_exit(name, returncode)
+    
     async def stop(self) -> None:
         """Stop the VNC server and cleanup resources."""
         try:
@@ -158,36 +337,22 @@ class VNCServer:
                        session_id=self.session_id,
                        vnc_port=self.vnc_port)
             
-            # Stop x11vnc
-            if self.x11vnc_process:
+            # x11vnc first so it doesn't see its display disappear
+            for process in (self.x11vnc_process, self.xvfb_process):
+                if process.process is None:
+                    continue
                 try:
-                    self.x11vnc_process.terminate()
-                    await asyncio.sleep(0.2)
-                    if self.x11vnc_process.poll() is None:
-                        self.x11vnc_process.kill()
-                    logger.info("x11vnc stopped", session_id=self.session_id)
+                    await process.stop(self.stop_timeout)
+                    logger.info(f"{process.name} stopped", session_id=self.session_id)
                 except Exception as e:
-                    logger.warning("Error stopping x11vnc", 
-                                 session_id=self.session_id,
-                                 error=str(e))
-            
-            # Stop Xvfb
-            if self.xvfb_process:
-                try:
-                    self.xvfb_process.terminate()
-                    await asyncio.sleep(0.2)
-                    if self.xvfb_process.poll() is None:
-                        self.xvfb_process.kill()
-                    logger.info("Xvfb stopped", session_id=self.session_id)
-                except Exception as e:
-                    logger.warning("Error stopping Xvfb",
+                    logger.warning(f"Error stopping {process.name}",
                                  session_id=self.session_id,
                                  error=str(e))
             
             self.is_running = False
             logger.info("VNC server stopped successfully",
                        session_id=self.session_id)
-            
+        
         except Exception as e:
             logger.error("Error stopping VNC server",
                         session_id=self.session_id,
@@ -203,14 +368,19 @@ class VNCServer:
     
     async def health_check(self) -> dict:
         """Check VNC server health."""
-        xvfb_running = self.xvfb_process and self.xvfb_process.poll() is None
-        x11vnc_running = self.x11vnc_process and self.x11vnc_process.poll() is None
-        
         return {
             "is_running": self.is_running,
-            "xvfb_running": xvfb_running,
-            "x11vnc_running": x11vnc_running,
+            "xvfb_running": self.xvfb_process.running,
+            "x11vnc_running": self.x11vnc_process.running,
+            "exit_codes": {
+                process.name: process.returncode
+                for process in (self.xvfb_process, self.x11vnc_process)
+                if process.returncode is not None
+            },
             "display": self.get_display(),
             "vnc_port": self.vnc_port,
-            "vnc_url": self.get_vnc_url()
+            "vnc_url": self.get_vnc_url(),
+            "startup_seconds": {
+                name: round(seconds, 3) for name, seconds in self.startup_seconds.items()
+            },
         }
@@ -1,7 +1,8 @@
 import asyncio
+import time
 import uuid
-import os
-from typing import Optional, Dict, Any, AsyncIterator
+from collections import deque
+from typing import Optional, Dict, Any, AsyncIterator, Awaitable, Callable, Deque, List
 from datetime import datetime
 
 from ..models.schemas import AgentUpdate, UpdateType
@@ -10,23 +11,84 @@ from ..config import get_settings
 from .agent_service import AgentService
 from .mock_agent_service import MockAgentService
 from .vnc_server import VNCServer
+from .worker_process import AgentProcess
+from .display_allocator import DisplayAllocator, DisplaySlot
 
 logger = get_logger(__name__)
 
+
+class WorkerPoolFull(RuntimeError):
+    """No worker could be allocated; callers should retry after `retry_after` seconds."""
+    
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class AdmissionQueueFull(WorkerPoolFull):
+    """The pool is at capacity and the admission queue is full."""
+
+
+class AdmissionTimeout(WorkerPoolFull):
+    """No worker became available before the admission deadline."""
+
+
+def create_agent_service(
+    session_id: str,
+    display_num: Optional[int],
+    history: Optional[List[Dict[str, str]]] = None,
+):
+    """
+    The real agent when an API key is configured, the mock one otherwise.
+    
+    `history` is the session's stored conversation, for a session that had
+    an earlier worker.
+    """
+    api_key = get_settings().anthropic_api_key
+    use_mock = not api_key or api_key == "your_anthropic_api_key_here" or api_key == ""
+    
+    if use_mock:
+        logger.warning("No API key - using mock agent")
+        service = MockAgentService(session_id)
+    else:
+        service = AgentService(session_id, display_num=display_num)
+    if history:
+        service.load_history(history)
+    return service
+
+
 class Worker:
     
-    def __init__(self, sess_id: str):
+    def __init__(
+        self,
+        sess_id: Optional[str] = None,
+        displays: Optional[DisplayAllocator] = None,
+        history: Optional[List[Dict[str, str]]] = None,
+    ):
+        # Workers created without a session are pre-warmed and bound later
         self.session_id = sess_id
+        # Stored conversation to seed the agent with, consumed by _init_agent
+        self._history = history
         self.worker_id = str(uuid.uuid4())
         self.created_at = datetime.utcnow()
+        # Monotonic time of the last bind or message, used for idle reaping
+        self.last_activity = time.monotonic()
+        # Called when the worker finishes a message and can be evicted again
+        self.on_idle: Optional[Callable[[], None]] = None
         self.status = "initializing"
         self.settings = get_settings()
         
         self.vm_instance = None
         self.vnc_server = None
         self.vnc_port = None
-        self.display_num = self.settings.display_num + hash(sess_id) % 100
+        # Workers in a pool draw a unique display from its allocator; a standalone
+        # worker uses the configured display
+        self.displays = displays
+        self.display: Optional[DisplaySlot] = None
+        self.display_num = None if displays else self.settings.display_num
         self.agent_service = None
+        # With worker_execution="process", the child running this worker's agent
+        self.agent_process: Optional[AgentProcess] = None
         
         logger.info("Worker created", worker_id=self.worker_id, session_id=sess_id)
     
@@ -35,6 +97,12 @@ class Worker:
             self.status = "initializing"
             await self._init_vm()
             await self._init_vnc()
+            if self.settings.worker_execution == "process":
+                await self._init_agent_process()
+            if self.session_id is None:
+                self.status = "warm"
+                logger.info("Worker pre-warmed", worker_id=self.worker_id)
+                return
             await self._init_agent()
             
             self.status = "ready"
@@ -42,8 +110,30 @@ class Worker:
         except Exception as e:
             self.status = "failed"
             logger.error("Worker initialization failed", worker_id=self.worker_id, error=str(e))
+            await self._release_resources()
             raise
     
+    async def bind(self, sess_id: str, history: Optional[List[Dict[str, str]]] = None):
+        """Assign a pre-warmed worker to a session, restoring `history` if given."""
+        if self.status != "warm":
+            raise RuntimeError(f"Worker not warm. Status: {self.status}")
+        
+        self.session_id = sess_id
+        self._history = history
+        if self.vnc_server:
+            self.vnc_server.session_id = sess_id
+        try:
+            await self._init_agent()
+        except Exception as e:
+            self.status = "failed"
+            logger.error("Worker bind failed", worker_id=self.worker_id, session_id=sess_id, error=str(e))
+            await self._release_resources()
+            raise
+        
+        self.last_activity = time.monotonic()
+        self.status = "ready"
+        logger.info("Worker bound", worker_id=self.worker_id, session_id=sess_id)
+    
     async def process_message(self, msg_content: str) -> AsyncIterator[AgentUpdate]:
         if self.status != "ready":
             raise RuntimeError(f"Worker not ready. Status: {self.status}")
@@ -53,14 +143,12 @@ class Worker:
         
         try:
             self.status = "processing"
+            self.last_activity = time.monotonic()
             # print(f"Debug: processing msg for {self.session_id}")  # quick debug
             
             async for update in self.agent_service.process_message(msg_content):
                 yield update
-            
-            self.status = "ready"
         except Exception as e:
-            self.status = "error"
             logger.error("Message processing failed", worker_id=self.worker_id, error=str(e))
             
             yield AgentUpdate(
@@ -69,7 +157,17 @@ class Worker:
                 timestamp=datetime.utcnow(),
                 metadata={"worker_id": self.worker_id, "error": str(e)}
             )
-            self.status = "ready"
+        finally:
+            self.last_activity = time.monotonic()
+            # Also covers a consumer that stops iterating early. An "unhealthy"
+            # status set while processing is kept.
+            if self.status == "processing":
+                self.status = "ready"
+            if self.on_idle:
+                self.on_idle()
+    
+    def idle_seconds(self) -> float:
+        return time.monotonic() - self.last_activity
     
     async def get_vnc_stream(self) -> bytes:
         if not self.vnc_server:
@@ -82,11 +180,18 @@ class Worker:
             logger.info("Cleaning up worker", worker_id=self.worker_id, session_id=self.session_id)
             
             if self.agent_service:
+                # Stops the session's bash shell along with the agent
+                await self.agent_service.close()
                 self.agent_service.clear_history()
                 self.agent_service = None
             
-            if self.vnc_server:
-                await self._cleanup_vnc()
+            if self.agent_process:
+                # Not yet closed if the worker was never bound
+                await self.agent_process.close()
+                self.agent_process = None
+            
+            # Also releases a display held without a running VNC server
+            await self._cleanup_vnc()
             
             if self.vm_instance:
                 await self._cleanup_vm()
@@ -95,37 +200,83 @@ class Worker:
         except Exception as e:
             logger.error("Worker cleanup failed", worker_id=self.worker_id, error=str(e))
             raise
-
+    
     async def _init_vm(self):
         # FIXME: implement actual VM setup later
         await asyncio.sleep(0.1)
     
     async def _init_vnc(self):
         try:
-            self.vnc_server = VNCServer(self.session_id, self.display_num)
+            if self.displays:
+                self.display = self.displays.acquire()
+                self.display_num = self.display.display_num
+            self.vnc_server = VNCServer(
+                self.session_id or self.worker_id,
+                self.display_num,
+                vnc_port=self.display.vnc_port if self.display else None,
+            )
+            self.vnc_server.on_exit = self._on_vnc_exit
             await self.vnc_server.start()
             self.vnc_port = self.vnc_server.vnc_port
-            os.environ["DISPLAY"] = self.vnc_server.get_display()
         except Exception as e:
             logger.warning("VNC init failed, continuing without it", error=str(e))
             self.vnc_server = None
             self.vnc_port = None
+            self._release_display()
+    
+    def _on_vnc_exit(self, name: str, returncode: int):
+        # The desktop is gone; the pool replaces this worker on next use
+        if self.status in ("terminating", "terminated"):
+            return
+        self.status = "unhealthy"
+        logger.error("Worker unhealthy",
+                    worker_id=self.worker_id,
+                    session_id=self.session_id,
+                    process=name,
+                    returncode=returncode)
+    
+    async def _init_agent_process(self):
+        self.agent_process = AgentProcess(self.display_num, on_exit=self._on_agent_exit)
+        try:
+            await self.agent_process.start()
+        except Exception:
+            self.agent_process = None
+            raise
+    
+    async def _release_resources(self):
+        """After a failed start or bind, stop the agent child and desktop and free the display."""
+        try:
+            if self.agent_process:
+                await self.agent_process.close()
+                self.agent_process = None
+            await self._cleanup_vnc()
+        except Exception as e:
+            logger.error("Worker teardown failed", worker_id=self.worker_id, error=str(e))
+    
+    def _on_agent_exit(self, name: str, returncode: int):
+        # Same outcome as losing the desktop: the session starts over on a new worker
+        self._on_vnc_exit(name, returncode)
     
     async def _init_agent(self):
-        api_key = self.settings.anthropic_api_key
-        use_mock = not api_key or api_key == "your_anthropic_api_key_here" or api_key == ""
-        
-        if use_mock:
-            logger.warning("No API key - using mock agent")
-            self.agent_service = MockAgentService(self.session_id)
+        history, self._history = self._history, None
+        if self.agent_process:
+            await self.agent_process.bind(self.session_id, history)
+            self.agent_service = self.agent_process
         else:
-            self.agent_service = AgentService(self.session_id)
+            self.agent_service = create_agent_service(self.session_id, self.display_num, history)
     
     async def _cleanup_vnc(self):
         if self.vnc_server:
             await self.vnc_server.stop()
             self.vnc_server = None
             self.vnc_port = None
+        self._release_display()
+    
+    def _release_display(self):
+        if self.display and self.displays:
+            self.displays.release(self.display)
+            self.display = None
+            self.display_num = None
     
     async def _cleanup_vm(self):
         await asyncio.sleep(0.1)
@@ -134,33 +285,341 @@ class Worker:
 class WorkerPool:
     
     def __init__(self):
+        self.settings = get_settings()
         self.workers = {}
-        self.max_workers = 100
-        logger.info("WorkerPool initialized")
+        self.max_workers = self.settings.max_concurrent_sessions
+        
+        # Idle workers are torn down after worker_timeout. A session whose
+        # worker has been gone for session_timeout is expired via the callback.
+        self.worker_timeout = self.settings.worker_timeout
+        self.session_timeout = self.settings.session_timeout
+        self.reap_interval = self.settings.worker_reap_interval
+        self.on_session_expired: Optional[Callable[[str], Awaitable[None]]] = None
+        # Called when a session's worker is evicted or reaped but the session lives on
+        self.on_worker_retired: Optional[Callable[[str], None]] = None
+        # session_id -> monotonic time of last activity, for sessions without a worker
+        self._idle_sessions: Dict[str, float] = {}
+        self._reaper_task: Optional[asyncio.Task] = None
+        
+        # Requests waiting for capacity, in arrival order. Each waiter's event is
+        # set whenever capacity may have freed up or the queue has moved.
+        self.admission_queue_size = self.settings.admission_queue_size
+        self.admission_timeout = self.settings.admission_timeout
+        self.admission_retry_after = self.settings.admission_retry_after
+        self._admission_queue: Deque[asyncio.Event] = deque()
+        # Slots claimed by workers that are still being started
+        self._starting = 0
+        
+        # Initialized workers waiting for a session, refilled in the background
+        self.warm_workers: List[Worker] = []
+        self.warm_pool_size = self.settings.warm_pool_size
+        self._refill_task: Optional[asyncio.Task] = None
+        self.warm_pool_stats: Dict[str, Any] = {
+            "hits": 0,
+            "misses": 0,
+            "refills": 0,
+            "refill_failures": 0,
+            "last_refill_seconds": None,
+            "total_refill_seconds": 0.0,
+        }
+        
+        # One display per bound or warm worker
+        self.displays = DisplayAllocator(
+            self.settings.vnc_display_base,
+            self.settings.vnc_base_port,
+            self.max_workers + self.warm_pool_size,
+        )
+        logger.info("WorkerPool initialized", warm_pool_size=self.warm_pool_size)
     
-    async def spawn_worker(self, sess_id: str) -> Worker:
-        if sess_id in self.workers:
-            return self.workers[sess_id]
+    @property
+    def active_slots(self) -> int:
+        """Slots held by bound workers and by workers still starting."""
+        return len(self.workers) + self._starting
+    
+    @property
+    def queued(self) -> int:
+        """Requests waiting in the admission queue for a slot."""
+        return len(self._admission_queue)
+    
+    async def start(self):
+        """Fill the warm pool and start reaping idle workers in the background."""
+        self._ensure_warm()
+        if self._reaper_task is None or self._reaper_task.done():
+            self._reaper_task = asyncio.create_task(self._reap_loop())
+    
+    async def spawn_worker(
+        self,
+        sess_id: str,
+        on_queue_position: Optional[Callable[[int], Awaitable[None]]] = None,
+        history: Optional[List[Dict[str, str]]] = None,
+    ) -> Worker:
+        """
+        Get a worker for a session, queueing for capacity if the pool is full.
         
-        if len(self.workers) >= self.max_workers:
-            raise RuntimeError(f"Max workers ({self.max_workers}) reached")
+        A new worker's agent is seeded with `history`, the session's stored
+        conversation. While queued, `on_queue_position` is called with the
+        1-based position whenever it changes. Raises AdmissionQueueFull if the queue is full and
+        AdmissionTimeout if no capacity frees up within admission_timeout.
+        """
+        existing = self.workers.get(sess_id)
+        if existing and existing.status != "unhealthy":
+            return existing
+        if existing:
+            # Its Xvfb or x11vnc died; start the session over on a fresh worker
+            await self.terminate_worker(sess_id)
         
-        worker = Worker(sess_id)
-        await worker.initialize()
-        self.workers[sess_id] = worker
+        # Wait behind anyone already queued, even if a slot is free right now
+        if self._admission_queue or not await self._reserve_slot():
+            await self._wait_for_admission(sess_id, on_queue_position)
+        
+        try:
+            if sess_id in self.workers:
+                return self.workers[sess_id]
+            
+            self._idle_sessions.pop(sess_id, None)
+            
+            await self._discard_unhealthy_warm()
+            if self.warm_workers:
+                worker = self.warm_workers.pop(0)
+                self.warm_pool_stats["hits"] += 1
+                start = worker.bind(sess_id, history)
+            else:
+                self.warm_pool_stats["misses"] += 1
+                worker = Worker(sess_id, displays=self.displays, history=history)
+                start = worker.initialize()
+            try:
+                await start
+            except BaseException:
+                # Neither handed out nor pooled; don't leave Xvfb/x11vnc or the display behind
+                await self._discard_failed(worker)
+                raise
+            worker.on_idle = self._notify_admission
+            self.workers[sess_id] = worker
+        finally:
+            self._starting -= 1
+            # Wakes the queue if the slot went unused
+            self._notify_admission()
         
+        self._ensure_warm()
         return worker
     
+    async def _reserve_slot(self) -> bool:
+        """Claim capacity for one new worker, evicting the LRU idle worker if needed."""
+        if len(self.workers) + self._starting < self.max_workers:
+            self._starting += 1
+            return True
+        
+        idle = [(sid, w) for sid, w in self.workers.items() if w.status == "ready"]
+        if not idle:
+            return False
+        sid, worker = min(idle, key=lambda item: item[1].last_activity)
+        # Claim the slot before tearing down so nobody else can take it meanwhile
+        self._starting += 1
+        logger.info("Evicting least recently used worker",
+                   session_id=sid,
+                   worker_id=worker.worker_id,
+                   idle_seconds=round(worker.idle_seconds(), 1))
+        try:
+            await self._retire_worker(sid)
+        except Exception as e:
+            logger.error("Failed to evict worker", session_id=sid, error=str(e))
+        return True
+    
+    async def _wait_for_admission(
+        self,
+        sess_id: str,
+        on_queue_position: Optional[Callable[[int], Awaitable[None]]],
+    ) -> None:
+        """Queue until this request is first in line and a slot can be reserved."""
+        if len(self._admission_queue) >= self.admission_queue_size:
+            raise AdmissionQueueFull(
+                f"Max workers ({self.max_workers}) reached and "
+                f"{len(self._admission_queue)} requests are already queued",
+                retry_after=self.admission_retry_after,
+            )
+        
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.admission_timeout
+        waiter = asyncio.Event()
+        self._admission_queue.append(waiter)
+        position = None
+        logger.info("Waiting for worker capacity",
+                   session_id=sess_id,
+                   queue_length=len(self._admission_queue))
+        try:
+            while True:
+                waiter.clear()
+                if self._admission_queue[0] is waiter and await self._reserve_slot():
+                    return
+                
+                current = self._admission_queue.index(waiter) + 1
+                if on_queue_position and current != position:
+                    position = current
+                    try:
+                        await on_queue_position(position)
+                    except Exception as e:
+                        logger.warning("Failed to report queue position",
+                                     session_id=sess_id,
+                                     error=str(e))
+                
+                remaining = deadline - loop.time()
+                try:
+                    if remaining <= 0:
+                        raise asyncio.TimeoutError
+                    await asyncio.wait_for(waiter.wait(), remaining)
+                except asyncio.TimeoutError:
+                    raise AdmissionTimeout(
+                        f"No worker became available within {self.admission_timeout}s",
+                        retry_after=self.admission_retry_after,
+                    ) from None
+        finally:
+            self._admission_queue.remove(waiter)
+            self._notify_admission()
+    
+    def _notify_admission(self) -> None:
+        """Wake queued requests to recheck capacity and their position."""
+        for waiter in self._admission_queue:
+            waiter.set()
+    
+    def _ensure_warm(self):
+        if self.warm_pool_size <= 0:
+            return
+        if self._refill_task is None or self._refill_task.done():
+            self._refill_task = asyncio.create_task(self._refill())
+    
+    async def _refill(self):
+        """Start workers until the warm pool is full or the pool is at capacity."""
+        while True:
+            missing = min(
+                self.warm_pool_size - len(self.warm_workers),
+                self.max_workers - len(self.workers) - len(self.warm_workers),
+            )
+            if missing <= 0:
+                return
+            results = await asyncio.gather(
+                *(self._warm_one() for _ in range(missing)), return_exceptions=True
+            )
+            if any(isinstance(r, Exception) for r in results):
+                # Don't spin on a broken environment; the next spawn retries
+                return
+    
+    async def _warm_one(self):
+        started = time.perf_counter()
+        worker = Worker(displays=self.displays)
+        try:
+            await worker.initialize()
+        except asyncio.CancelledError:
+            # Shutting down mid-refill; don't leave Xvfb/x11vnc behind
+            await self._discard_failed(worker)
+            raise
+        except Exception:
+            self.warm_pool_stats["refill_failures"] += 1
+            await self._discard_failed(worker)
+            raise
+        elapsed = time.perf_counter() - started
+        
+        if len(self.workers) + len(self.warm_workers) >= self.max_workers:
+            # Sessions took the capacity while this worker was starting
+            await worker.cleanup()
+            return
+        
+        self.warm_pool_stats["refills"] += 1
+        self.warm_pool_stats["last_refill_seconds"] = round(elapsed, 3)
+        self.warm_pool_stats["total_refill_seconds"] += elapsed
+        self.warm_workers.append(worker)
+    
+    async def _discard_failed(self, worker: Worker):
+        """Tear down a worker that failed to start or bind, keeping the original error."""
+        try:
+            await worker.cleanup()
+        except Exception:
+            # Already logged by cleanup()
+            pass
+    
+    async def _discard_unhealthy_warm(self):
+        unhealthy = [w for w in self.warm_workers if w.status == "unhealthy"]
+        for worker in unhealthy:
+            self.warm_workers.remove(worker)
+            await worker.cleanup()
+    
+    async def _retire_worker(self, sess_id: str):
+        """Tear down a session's worker but remember the session for expiry."""
+        worker = self.workers.get(sess_id)
+        if not worker:
+            return
+        last_activity = worker.last_activity
+        await self.terminate_worker(sess_id)
+        self._idle_sessions[sess_id] = last_activity
+        if self.on_worker_retired:
+            self.on_worker_retired(sess_id)
+    
+    async def reap_idle(self):
+        """One reaper pass: tear down idle or unhealthy workers and expire idle sessions."""
+        if any(w.status == "unhealthy" for w in self.warm_workers):
+            await self._discard_unhealthy_warm()
+            self._ensure_warm()
+        
+        now = time.monotonic()
+        for sid, worker in list(self.workers.items()):
+            if worker.status == "unhealthy":
+                logger.info("Removing unhealthy worker", session_id=sid, worker_id=worker.worker_id)
+                try:
+                    await self._retire_worker(sid)
+                except Exception as e:
+                    logger.error("Failed to remove unhealthy worker", session_id=sid, error=str(e))
+            elif worker.status == "ready" and now - worker.last_activity >= self.worker_timeout:
+                logger.info("Reaping idle worker",
+                           session_id=sid,
+                           worker_id=worker.worker_id,
+                           idle_seconds=round(now - worker.last_activity, 1))
+                try:
+                    await self._retire_worker(sid)
+                except Exception as e:
+                    logger.error("Failed to reap worker", session_id=sid, error=str(e))
+        
+        for sid, last_activity in list(self._idle_sessions.items()):
+            if now - last_activity < self.session_timeout:
+                continue
+            del self._idle_sessions[sid]
+            logger.info("Session timed out", session_id=sid)
+            if self.on_session_expired:
+                try:
+                    await self.on_session_expired(sid)
+                except Exception as e:
+                    logger.error("Failed to expire session", session_id=sid, error=str(e))
+    
+    async def _reap_loop(self):
+        while True:
+            await asyncio.sleep(self.reap_interval)
+            try:
+                await self.reap_idle()
+            except Exception as e:
+                logger.error("Worker reaper pass failed", error=str(e))
+    
+    def had_worker(self, sess_id: str) -> bool:
+        """True if the session's worker was retired or died, so its replacement starts without history."""
+        if sess_id in self._idle_sessions:
+            return True
+        worker = self.workers.get(sess_id)
+        return worker is not None and worker.status == "unhealthy"
+    
     async def get_worker(self, sess_id: str):
-        return self.workers.get(sess_id)
+        worker = self.workers.get(sess_id)
+        # An unhealthy worker is as good as none; spawn_worker replaces it
+        if worker and worker.status == "unhealthy":
+            return None
+        return worker
     
     async def terminate_worker(self, sess_id: str) -> bool:
-        worker = self.workers.get(sess_id)
+        self._idle_sessions.pop(sess_id, None)
+        worker = self.workers.pop(sess_id, None)
         if not worker:
             return False
         
-        await worker.cleanup()
-        del self.workers[sess_id]
+        try:
+            await worker.cleanup()
+        finally:
+            self._notify_admission()
         return True
     
     async def health_check(self):
@@ -170,17 +629,50 @@ class WorkerPool:
                 "worker_id": w.worker_id,
                 "status": w.status,
                 "created_at": w.created_at.isoformat(),
-                "vnc_port": w.vnc_port
+                "idle_seconds": round(w.idle_seconds(), 1),
+                "display_num": w.display_num,
+                "vnc_port": w.vnc_port,
+                "agent_pid": w.agent_process.pid if w.agent_process else None,
+                "vnc_startup_seconds": (
+                    {k: round(v, 3) for k, v in w.vnc_server.startup_seconds.items()}
+                    if w.vnc_server else None
+                ),
             }
         
+        stats = self.warm_pool_stats
         return {
             "total_workers": len(self.workers),
             "max_workers": self.max_workers,
-            "workers": statuses
+            "workers": statuses,
+            "displays": self.displays.stats(),
+            "admission_queue": {
+                "waiting": len(self._admission_queue),
+                "max": self.admission_queue_size,
+            },
+            "warm_pool": {
+                "size": len(self.warm_workers),
+                "target": self.warm_pool_size,
+                "hits": stats["hits"],
+                "misses": stats["misses"],
+                "refills": stats["refills"],
+                "refill_failures": stats["refill_failures"],
+                "last_refill_seconds": stats["last_refill_seconds"],
+                "avg_refill_seconds": (
+                    round(stats["total_refill_seconds"] / stats["refills"], 3)
+                    if stats["refills"] else None
+                ),
+            },
         }
     
     async def cleanup_all(self):
-        tasks = [w.cleanup() for w in self.workers.values()]
+        for task in (self._refill_task, self._reaper_task):
+            if task and not task.done():
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+        
+        workers = list(self.workers.values()) + self.warm_workers
+        tasks = [w.cleanup() for w in workers]
         if tasks:
             await asyncio.gather(*tasks, return_exceptions=True)
-        self.workers.clear()
\ No newline at end of file
+        self.workers.clear()
+        self.warm_workers.clear()
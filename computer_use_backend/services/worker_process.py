@@ -0,0 +1,284 @@
+"""
+Runs a worker's agent in a child process and streams its updates back.
+
+The parent and child talk over a Unix socket pair using length-prefixed JSON
+frames. Run as `python -m computer_use_backend.services.worker_process` to
+start the child side.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import socket
+import struct
+import sys
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson is optional
+    orjson = None
+
+from ..config import get_settings
+from ..logging_config import get_logger
+from ..models.schemas import AgentUpdate
+from .vnc_server import ManagedProcess
+
+logger = get_logger(__name__)
+
+# 4-byte big-endian payload length, then the JSON payload
+_HEADER = struct.Struct("!I")
+# Screenshots travel as base64 inside updates, so frames can be large
+MAX_FRAME_SIZE = 64 * 1024 * 1024
+
+
+async def write_frame(writer: asyncio.StreamWriter, message: Dict[str, Any]) -> None:
+    if orjson is not None:
+        payload = orjson.dumps(message, default=str)
+    else:
+        payload = json.dumps(message, default=str, separators=(",", ":")).encode()
+    writer.write(_HEADER.pack(len(payload)) + payload)
+    await writer.drain()
+
+
+async def read_frame(reader: asyncio.StreamReader) -> Optional[Dict[str, Any]]:
+    """The next message, or None once the other side has closed the channel."""
+    try:
+        header = await reader.readexactly(_HEADER.size)
+    except asyncio.IncompleteReadError:
+        return None
+    (length,) = _HEADER.unpack(header)
+    if length > MAX_FRAME_SIZE:
+        raise ConnectionError(f"IPC frame of {length} bytes exceeds {MAX_FRAME_SIZE}")
+    payload = await reader.readexactly(length)
+    return orjson.loads(payload) if orjson is not None else json.loads(payload)
+
+
+class AgentProcess:
+    """
+    Parent-side handle on a child process running one session's agent.
+    
+    Stands in for AgentService inside a Worker: process_message() yields the
+    updates the child streams back. The child is started before the worker
+    has a session, so warm workers pay the interpreter startup up front, and
+    is bound to a session later. Its DISPLAY and other per-display
+    environment are set in the child only.
+    """
+    
+    def __init__(
+        self,
+        display_num: Optional[int],
+        on_exit: Optional[Callable[[str, int], None]] = None,
+    ):
+        settings = get_settings()
+        self.display_num = display_num
+        self.session_id: Optional[str] = None
+        self.on_exit = on_exit
+        self.startup_timeout = settings.worker_process_startup_timeout
+        self.stop_timeout = settings.worker_process_stop_timeout
+        self.process = ManagedProcess("agent", self._process_exited)
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._read_task: Optional[asyncio.Task] = None
+        self._ready = asyncio.Event()
+        self._bound: Optional[asyncio.Future] = None
+        # request id -> queue of ("update" | "done" | "error", payload)
+        self._requests: Dict[int, asyncio.Queue] = {}
+        self._next_id = 0
+    
+    @property
+    def pid(self) -> Optional[int]:
+        return self.process.pid
+    
+    @property
+    def running(self) -> bool:
+        return self.process.running and self._read_task is not None and not self._read_task.done()
+    
+    async def start(self) -> None:
+        """Spawn the child and wait until it is ready for a session."""
+        parent_sock, child_sock = socket.socketpair()
+        try:
+            cmd = [
+                sys.executable, "-m", __name__,
+                "--fd", str(child_sock.fileno()),
+            ]
+            if self.display_num is not None:
+                cmd += ["--display-num", str(self.display_num)]
+            await self.process.start(cmd, pass_fds=(child_sock.fileno(),), inherit_stdout=True)
+        except BaseException:
+            parent_sock.close()
+            raise
+        finally:
+            child_sock.close()
+        
+        self._reader, self._writer = await asyncio.open_unix_connection(sock=parent_sock)
+        self._read_task = asyncio.create_task(self._read_loop())
+        try:
+            await asyncio.wait_for(self._ready.wait(), self.startup_timeout)
+        except asyncio.TimeoutError:
+            await self.close()
+            raise RuntimeError(
+                f"Agent process not ready after {self.startup_timeout}s: "
+                f"{self.process.stderr_tail()[-500:]}"
+            ) from None
+        logger.info("Agent process started", pid=self.pid, display_num=self.display_num)
+    
+    async def bind(self, session_id: str, history: Optional[List[Dict[str, str]]] = None) -> None:
+        """Create the session's agent in the child, seeded with `history` if given."""
+        self._bound = asyncio.get_running_loop().create_future()
+        await self._send({"op": "bind", "session_id": session_id, "history": history or []})
+        await asyncio.wait_for(self._bound, self.startup_timeout)
+        self.session_id = session_id
+    
+    async def process_message(self, content: str) -> AsyncIterator[AgentUpdate]:
+        if not self.running:
+            raise RuntimeError("Agent process is not running")
+        self._next_id += 1
+        request_id = self._next_id
+        queue: asyncio.Queue = asyncio.Queue()
+        self._requests[request_id] = queue
+        finished = False
+        try:
+            await self._send({"op": "process", "id": request_id, "content": content})
+            while True:
+                kind, payload = await queue.get()
+                if kind == "update":
+                    yield AgentUpdate.model_validate(payload)
+                elif kind == "done":
+                    finished = True
+                    return
+                else:
+                    finished = True
+                    raise RuntimeError(payload)
+        finally:
+            self._requests.pop(request_id, None)
+            if not finished and self.running:
+                # The consumer went away; stop the agent loop in the child too
+                try:
+                    await self._send({"op": "cancel", "id": request_id})
+                except (ConnectionError, OSError):
+                    pass
+    
+    def clear_history(self) -> None:
+        """History lives in the child and goes away with it."""
+    
+    async def close(self) -> None:
+        """Ask the child to stop its tools and exit, killing it if it won't."""
+        if self.running:
+            try:
+                self.process.expect_exit()
+                await self._send({"op": "shutdown"})
+                await asyncio.wait_for(self.process.process.wait(), self.stop_timeout)
+            except (ConnectionError, OSError, asyncio.TimeoutError):
+                pass
+        await self.process.stop(self.stop_timeout)
+        if self._writer is not None:
+            self._writer.close()
+        if self._read_task is not None:
+            self._read_task.cancel()
+            await asyncio.gather(self._read_task, return_exceptions=True)
+    
+    async def _send(self, message: Dict[str, Any]) -> None:
+        if self._writer is None:
+            raise ConnectionError("Agent process not started")
+        await write_frame(self._writer, message)
+    
+    async def _read_loop(self) -> None:
+        error = "Agent process exited"
+        try:
+            while True:
+                message = await read_frame(self._reader)
+                if message is None:
+                    return
+                op = message.get("op")
+                if op == "ready":
+                    self._ready.set()
+                elif op == "bound":
+                    if self._bound is not None and not self._bound.done():
+                        self._bound.set_result(None)
+                elif op in ("update", "done", "error"):
+                    queue = self._requests.get(message["id"])
+                    if queue is not None:
+                        queue.put_nowait((op, message.get("update", message.get("error"))))
+        except (ConnectionError, OSError) as e:
+            error = f"Agent process channel failed: {e}"
+            logger.error("Agent process channel failed", pid=self.pid, error=str(e))
+        finally:
+            for queue in self._requests.values():
+                queue.put_nowait(("error", error))
+            if self._bound is not None and not self._bound.done():
+                self._bound.set_exception(RuntimeError(error))
+    
+    def _process_exited(self, name: str, returncode: int) -> None:
+        if self.on_exit:
+            self.on_exit(name, returncode)
+
+
+async def serve(fd: int, display_num: Optional[int]) -> None:
+    """Child side: build the agent on request and stream its updates back."""
+    from .worker import create_agent_service
+    
+    if display_num is not None:
+        # Only this process's environment; the API process is untouched
+        os.environ["DISPLAY"] = f":{display_num}"
+    
+    sock = socket.socket(fileno=fd)
+    reader, writer = await asyncio.open_unix_connection(sock=sock)
+    agent = None
+    tasks: Dict[int, asyncio.Task] = {}
+    
+    async def run(request_id: int, content: str) -> None:
+        try:
+            async for update in agent.process_message(content):
+                await write_frame(writer, {
+                    "op": "update",
+                    "id": request_id,
+                    "update": update.model_dump(mode="json"),
+                })
+            await write_frame(writer, {"op": "done", "id": request_id})
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            await write_frame(writer, {"op": "error", "id": request_id, "error": str(e)})
+        finally:
+            tasks.pop(request_id, None)
+    
+    await write_frame(writer, {"op": "ready"})
+    try:
+        while True:
+            message = await read_frame(reader)
+            if message is None or message["op"] == "shutdown":
+                break
+            op = message["op"]
+            if op == "bind":
+                agent = create_agent_service(message["session_id"], display_num, message.get("history"))
+                await write_frame(writer, {"op": "bound"})
+            elif op == "process":
+                tasks[message["id"]] = asyncio.create_task(run(message["id"], message["content"]))
+            elif op == "cancel":
+                task = tasks.pop(message["id"], None)
+                if task:
+                    task.cancel()
+    finally:
+        for task in list(tasks.values()):
+            task.cancel()
+        await asyncio.gather(*tasks.values(), return_exceptions=True)
+        if agent is not None and hasattr(agent, "close"):
+            await agent.close()
+        writer.close()
+
+
+def main() -> None:
+    from ..logging_config import setup_logging
+    
+    parser = argparse.ArgumentParser(description="Computer Use worker agent process")
+    parser.add_argument("--fd", type=int, required=True)
+    parser.add_argument("--display-num", type=int, default=None)
+    args = parser.parse_args()
+    setup_logging(get_settings().log_level)
+    asyncio.run(serve(args.fd, args.display_num))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,252 @@
+"""
+Registry of which server process owns each session's worker.
+"""
+
+import asyncio
+import json
+import time
+from collections import Counter
+from dataclasses import asdict, dataclass
+from typing import Dict, List, Optional
+
+from ..config import get_settings
+from ..logging_config import get_logger
+from .redis_client import RedisConnection
+
+logger = get_logger(__name__)
+
+# Compare-and-set of a session's owner, moving it between the two owners'
+# session counts. KEYS: owners, sessions; ARGV: session, new owner, expected owner
+TAKE_OVER_SCRIPT = """
+if redis.call('HGET', KEYS[1], ARGV[1]) ~= ARGV[3] then
+    return 0
+end
+redis.call('HSET', KEYS[1], ARGV[1], ARGV[2])
+if redis.call('HEXISTS', KEYS[2], ARGV[3]) == 1 then
+    redis.call('HINCRBY', KEYS[2], ARGV[3], -1)
+end
+redis.call('HINCRBY', KEYS[2], ARGV[2], 1)
+return 1
+"""
+
+# Delete a session's owner, only if it is ARGV[2] when that is non-empty,
+# and decrement that owner's count. KEYS: owners, sessions; ARGV: session, owner
+RELEASE_SCRIPT = """
+local current = redis.call('HGET', KEYS[1], ARGV[1])
+if not current or (ARGV[2] ~= '' and current ~= ARGV[2]) then
+    return 0
+end
+redis.call('HDEL', KEYS[1], ARGV[1])
+redis.call('HINCRBY', KEYS[2], current, -1)
+return 1
+"""
+
+
+@dataclass
+class NodeInfo:
+    """What a server process advertises about itself on every heartbeat."""
+    # "<node_id>:<pid>", also stored in Session.worker_id
+    owner: str
+    # Base URL other processes forward requests to, if reachable
+    address: Optional[str]
+    capacity: int
+    workers: int = 0
+    queued: int = 0
+    # Sessions assigned to this process, maintained by the registry
+    sessions: int = 0
+    updated_at: float = 0.0
+    
+    @property
+    def load(self) -> float:
+        return (self.workers + self.queued) / max(self.capacity, 1)
+    
+    def to_json(self) -> str:
+        data = asdict(self)
+        del data["sessions"]
+        return json.dumps(data)
+    
+    @classmethod
+    def from_json(cls, raw: str) -> "NodeInfo":
+        return cls(**json.loads(raw))
+
+
+class WorkerRegistry:
+    """
+    Shared map of session -> owning process, plus each process's heartbeat.
+    
+    A process whose heartbeat is older than `node_ttl` is treated as gone:
+    it is dropped from listings and its sessions can be taken over.
+    """
+    
+    def __init__(self, node_ttl: float):
+        self.node_ttl = node_ttl
+    
+    async def heartbeat(self, node: NodeInfo) -> None:
+        raise NotImplementedError
+    
+    async def remove_node(self, owner: str) -> None:
+        raise NotImplementedError
+    
+    async def nodes(self) -> List[NodeInfo]:
+        """Live processes, with their assigned session counts."""
+        raise NotImplementedError
+    
+    async def owner_of(self, session_id: str) -> Optional[str]:
+        raise NotImplementedError
+    
+    async def claim(self, session_id: str, owner: str) -> str:
+        """Assign the session to `owner` unless it already has one; returns the owner."""
+        raise NotImplementedError
+    
+    async def take_over(self, session_id: str, owner: str, previous: str) -> bool:
+        """Reassign a session away from a dead owner. False if someone else changed it first."""
+        raise NotImplementedError
+    
+    async def release(self, session_id: str, owner: Optional[str] = None) -> None:
+        """Forget the session's owner (only if it is `owner`, when given)."""
+        raise NotImplementedError
+    
+    async def close(self) -> None:
+        pass
+    
+    def _is_live(self, node: NodeInfo) -> bool:
+        return time.time() - node.updated_at <= self.node_ttl
+
+
+class InMemoryWorkerRegistry(WorkerRegistry):
+    """Registry for a single process; every session belongs to it."""
+    
+    def __init__(self, node_ttl: float):
+        super().__init__(node_ttl)
+        self._nodes: Dict[str, NodeInfo] = {}
+        self._owners: Dict[str, str] = {}
+        self._sessions: Counter = Counter()
+    
+    async def heartbeat(self, node: NodeInfo) -> None:
+        self._nodes[node.owner] = node
+    
+    async def remove_node(self, owner: str) -> None:
+        self._nodes.pop(owner, None)
+        self._sessions.pop(owner, None)
+    
+    async def nodes(self) -> List[NodeInfo]:
+        live = []
+        for node in list(self._nodes.values()):
+            if not self._is_live(node):
+                await self.remove_node(node.owner)
+                continue
+            node.sessions = self._sessions[node.owner]
+            live.append(node)
+        return live
+    
+    async def owner_of(self, session_id: str) -> Optional[str]:
+        return self._owners.get(session_id)
+    
+    async def claim(self, session_id: str, owner: str) -> str:
+        if session_id not in self._owners:
+            self._owners[session_id] = owner
+            self._sessions[owner] += 1
+        return self._owners[session_id]
+    
+    async def take_over(self, session_id: str, owner: str, previous: str) -> bool:
+        if self._owners.get(session_id) != previous:
+            return False
+        self._owners[session_id] = owner
+        self._sessions[previous] -= 1
+        self._sessions[owner] += 1
+        return True
+    
+    async def release(self, session_id: str, owner: Optional[str] = None) -> None:
+        current = self._owners.get(session_id)
+        if current is None or (owner is not None and current != owner):
+            return
+        del self._owners[session_id]
+        self._sessions[current] -= 1
+
+
+class RedisWorkerRegistry(WorkerRegistry):
+    """
+    Registry kept in three Redis hashes: `<prefix>:nodes` (owner -> heartbeat
+    JSON), `<prefix>:owners` (session -> owner) and `<prefix>:sessions`
+    (owner -> number of sessions assigned).
+    """
+    
+    def __init__(self, url: str, node_ttl: float, prefix: str = "registry"):
+        super().__init__(node_ttl)
+        self.url = url
+        self.nodes_key = f"{prefix}:nodes"
+        self.owners_key = f"{prefix}:owners"
+        self.sessions_key = f"{prefix}:sessions"
+        self._conn: Optional[RedisConnection] = None
+        self._connect_lock = asyncio.Lock()
+    
+    async def _execute(self, *args):
+        if self._conn is None or self._conn.closed:
+            async with self._connect_lock:
+                if self._conn is None or self._conn.closed:
+                    self._conn = await RedisConnection.open(self.url)
+        return await self._conn.execute(*args)
+    
+    async def heartbeat(self, node: NodeInfo) -> None:
+        await self._execute("HSET", self.nodes_key, node.owner, node.to_json())
+    
+    async def remove_node(self, owner: str) -> None:
+        await self._execute("HDEL", self.nodes_key, owner)
+        await self._execute("HDEL", self.sessions_key, owner)
+    
+    async def nodes(self) -> List[NodeInfo]:
+        raw = await self._execute("HGETALL", self.nodes_key)
+        counts = await self._execute("HGETALL", self.sessions_key)
+        sessions = {
+            counts[i].decode(): int(counts[i + 1]) for i in range(0, len(counts), 2)
+        }
+        live = []
+        for i in range(0, len(raw), 2):
+            try:
+                node = NodeInfo.from_json(raw[i + 1].decode())
+            except (ValueError, TypeError):
+                continue
+            if not self._is_live(node):
+                logger.warning("Removing stale node", owner=node.owner)
+                await self.remove_node(node.owner)
+                continue
+            node.sessions = sessions.get(node.owner, 0)
+            live.append(node)
+        return live
+    
+    async def owner_of(self, session_id: str) -> Optional[str]:
+        owner = await self._execute("HGET", self.owners_key, session_id)
+        return owner.decode() if owner is not None else None
+    
+    async def claim(self, session_id: str, owner: str) -> str:
+        if await self._execute("HSETNX", self.owners_key, session_id, owner):
+            await self._execute("HINCRBY", self.sessions_key, owner, 1)
+            return owner
+        return await self.owner_of(session_id) or owner
+    
+    async def take_over(self, session_id: str, owner: str, previous: str) -> bool:
+        # One script, so of two processes racing for a dead owner's session
+        # exactly one sees `previous` and wins
+        return bool(await self._execute(
+            "EVAL", TAKE_OVER_SCRIPT, 2, self.owners_key, self.sessions_key,
+            session_id, owner, previous,
+        ))
+    
+    async def release(self, session_id: str, owner: Optional[str] = None) -> None:
+        await self._execute(
+            "EVAL", RELEASE_SCRIPT, 2, self.owners_key, self.sessions_key,
+            session_id, owner or "",
+        )
+    
+    async def close(self) -> None:
+        if self._conn is not None:
+            await self._conn.close()
+            self._conn = None
+
+
+def create_worker_registry() -> WorkerRegistry:
+    """Build the registry selected by the worker_registry setting."""
+    settings = get_settings()
+    if settings.worker_registry == "redis":
+        return RedisWorkerRegistry(settings.redis_url, settings.node_ttl, settings.registry_prefix)
+    return InMemoryWorkerRegistry(settings.node_ttl)
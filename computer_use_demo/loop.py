@@ -6,17 +6,19 @@ import platform
 from collections.abc import Callable
 from datetime import datetime
 from enum import StrEnum
+from functools import partial
 from typing import Any, cast
 
 import httpx
 from anthropic import (
-    Anthropic,
-    AnthropicBedrock,
-    AnthropicVertex,
     APIError,
     APIResponseValidationError,
     APIStatusError,
+    AsyncAnthropic,
+    AsyncAnthropicBedrock,
+    AsyncAnthropicVertex,
 )
+from anthropic.lib.streaming import BetaMessageStreamEvent
 from anthropic.types.beta import (
     BetaCacheControlEphemeralParam,
     BetaContentBlockParam,
@@ -84,30 +86,57 @@ async def sampling_loop(
     tool_version: ToolVersion,
     thinking_budget: int | None = None,
     token_efficient_tools_beta: bool = False,
+    http_client: httpx.AsyncClient | None = None,
+    base_url: str | None = None,
+    stream_callback: Callable[[BetaMessageStreamEvent], None] | None = None,
+    tool_stream_callback: Callable[[str, str, str], None] | None = None,
+    tool_collection: ToolCollection | None = None,
 ):
     """
     Agentic sampling loop for the assistant/tool interaction of computer use.
+
+    Pass `http_client` to share one keep-alive connection pool across loops;
+    otherwise the SDK creates a client that lives for this call only.
+
+    If `stream_callback` is set, responses are streamed and every stream event
+    (text/thinking deltas, partial tool input, block boundaries) is passed to it
+    as it arrives. `output_callback` still receives each complete block.
+
+    If `tool_stream_callback` is set, tools that produce output while running
+    (bash) report it as `(tool_use_id, stream, text)` as it is produced.
+    `tool_output_callback` and the model still receive the complete result.
+
+    Pass `tool_collection` to keep tools (and the bash shell) across calls; the
+    caller is then responsible for stopping them.
     """
     tool_group = TOOL_GROUPS_BY_VERSION[tool_version]
-    tool_collection = ToolCollection(*(ToolCls() for ToolCls in tool_group.tools))
+    if tool_collection is None:
+        tool_collection = ToolCollection(*(ToolCls() for ToolCls in tool_group.tools))
     system = BetaTextBlockParam(
         type="text",
         text=f"{SYSTEM_PROMPT}{' ' + system_prompt_suffix if system_prompt_suffix else ''}",
     )
 
+    # One client for every iteration so connections are reused between turns
+    enable_prompt_caching = False
+    if provider == APIProvider.ANTHROPIC:
+        client = AsyncAnthropic(
+            api_key=api_key,
+            max_retries=4,
+            http_client=http_client,
+            base_url=base_url,
+        )
+        enable_prompt_caching = True
+    elif provider == APIProvider.VERTEX:
+        client = AsyncAnthropicVertex(http_client=http_client)
+    elif provider == APIProvider.BEDROCK:
+        client = AsyncAnthropicBedrock(http_client=http_client)
+
     while True:
-        enable_prompt_caching = False
         betas = [tool_group.beta_flag] if tool_group.beta_flag else []
         if token_efficient_tools_beta:
             betas.append("token-efficient-tools-2025-02-19")
         image_truncation_threshold = only_n_most_recent_images or 0
-        if provider == APIProvider.ANTHROPIC:
-            client = Anthropic(api_key=api_key, max_retries=4)
-            enable_prompt_caching = True
-        elif provider == APIProvider.VERTEX:
-            client = AnthropicVertex()
-        elif provider == APIProvider.BEDROCK:
-            client = AnthropicBedrock()
 
         if enable_prompt_caching:
             betas.append(PROMPT_CACHING_BETA_FLAG)
@@ -131,20 +160,35 @@ async def sampling_loop(
                 "thinking": {"type": "enabled", "budget_tokens": thinking_budget}
             }
 
+        request_params = dict(
+            max_tokens=max_tokens,
+            messages=messages,
+            model=model,
+            system=[system],
+            tools=tool_collection.to_params(),
+            betas=betas,
+            extra_body=extra_body,
+        )
+
         # Call the API
         # we use raw_response to provide debug information to streamlit. Your
         # implementation may be able call the SDK directly with:
         # `response = client.messages.create(...)` instead.
         try:
-            raw_response = client.beta.messages.with_raw_response.create(
-                max_tokens=max_tokens,
-                messages=messages,
-                model=model,
-                system=[system],
-                tools=tool_collection.to_params(),
-                betas=betas,
-                extra_body=extra_body,
-            )
+            if stream_callback is not None:
+                response = await _stream_response(
+                    client, request_params, stream_callback, api_response_callback
+                )
+            else:
+                raw_response = await client.beta.messages.with_raw_response.create(
+                    **request_params
+                )
+                api_response_callback(
+                    raw_response.http_response.request,
+                    raw_response.http_response,
+                    None,
+                )
+                response = raw_response.parse()
         except (APIStatusError, APIResponseValidationError) as e:
             api_response_callback(e.request, e.response, e)
             return messages
@@ -152,12 +196,6 @@ async def sampling_loop(
             api_response_callback(e.request, e.body, e)
             return messages
 
-        api_response_callback(
-            raw_response.http_response.request, raw_response.http_response, None
-        )
-
-        response = raw_response.parse()
-
         response_params = _response_to_params(response)
         messages.append(
             {
@@ -178,6 +216,11 @@ async def sampling_loop(
                 result = await tool_collection.run(
                     name=tool_use_block["name"],
                     tool_input=cast(dict[str, Any], tool_use_block.get("input", {})),
+                    output_callback=(
+                        partial(tool_stream_callback, tool_use_block["id"])
+                        if tool_stream_callback
+                        else None
+                    ),
                 )
                 tool_result_content.append(
                     _make_api_tool_result(result, tool_use_block["id"])
@@ -190,6 +233,22 @@ async def sampling_loop(
         messages.append({"content": tool_result_content, "role": "user"})
 
 
+async def _stream_response(
+    client: AsyncAnthropic | AsyncAnthropicVertex | AsyncAnthropicBedrock,
+    request_params: dict[str, Any],
+    stream_callback: Callable[[BetaMessageStreamEvent], None],
+    api_response_callback: Callable[
+        [httpx.Request, httpx.Response | object | None, Exception | None], None
+    ],
+) -> BetaMessage:
+    """Stream a response, forwarding events as they arrive, and return the final message."""
+    async with client.beta.messages.stream(**request_params) as stream:
+        api_response_callback(stream.response.request, stream.response, None)
+        async for event in stream:
+            stream_callback(event)
+        return await stream.get_final_message()
+
+
 def _maybe_filter_to_n_most_recent_images(
     messages: list[BetaMessageParam],
     images_to_keep: int,
@@ -8,6 +8,9 @@ from anthropic.types.beta import BetaToolUnionParam
 class BaseAnthropicTool(metaclass=ABCMeta):
     """Abstract base class for Anthropic-defined tools."""
 
+    # Tools that accept an `output_callback` for output produced while they run
+    streams_output: bool = False
+
     @abstractmethod
     def __call__(self, **kwargs) -> Any:
         """Executes the tool with the given arguments."""
@@ -19,6 +22,10 @@ class BaseAnthropicTool(metaclass=ABCMeta):
     ) -> BetaToolUnionParam:
         raise NotImplementedError
 
+    def stop(self) -> None:
+        """Release any processes or connections held by the tool; most hold none."""
+        return None
+
 
 @dataclass(kw_only=True, frozen=True)
 class ToolResult:
@@ -28,6 +35,8 @@ class ToolResult:
     error: str | None = None
     base64_image: str | None = None
     system: str | None = None
+    # Seconds the screen took to settle before the screenshot; not sent to the model
+    settle_time: float | None = None
 
     def __bool__(self):
         return any(getattr(self, field.name) for field in fields(self))
@@ -47,6 +56,7 @@ class ToolResult:
             error=combine_fields(self.error, other.error),
             base64_image=combine_fields(self.base64_image, other.base64_image, False),
             system=combine_fields(self.system, other.system),
+            settle_time=combine_fields(self.settle_time, other.settle_time, False),
         )
 
     def replace(self, **kwargs):
@@ -1,10 +1,52 @@
 import asyncio
+import codecs
 import os
+import signal
+from collections.abc import Callable
 from typing import Any, Literal
 
 from .base import BaseAnthropicTool, CLIResult, ToolError, ToolResult
 
 
+class _OutputBuffer:
+    """
+    Keeps the head and tail of a stream of output, dropping the middle.
+
+    Memory stays bounded no matter how much a command prints; the number of
+    dropped bytes is reported in place of the missing middle.
+    """
+
+    def __init__(self, max_head: int, max_tail: int):
+        self.max_head = max_head
+        self.max_tail = max_tail
+        self.head = bytearray()
+        self.tail = bytearray()
+        self.total = 0
+
+    @property
+    def dropped(self) -> int:
+        return self.total - len(self.head) - len(self.tail)
+
+    def write(self, data: bytes):
+        self.total += len(data)
+        if len(self.head) < self.max_head:
+            room = self.max_head - len(self.head)
+            self.head += data[:room]
+            data = data[room:]
+        self.tail += data
+        if len(self.tail) > self.max_tail:
+            del self.tail[: len(self.tail) - self.max_tail]
+
+    def text(self) -> str:
+        if not self.dropped:
+            return (self.head + self.tail).decode(errors="replace")
+        return (
+            self.head.decode(errors="replace")
+            + f"\n<response clipped: {self.dropped} bytes omitted>\n"
+            + self.tail.decode(errors="replace")
+        )
+
+
 class _BashSession:
     """A session of a bash shell."""
 
@@ -12,13 +54,20 @@ class _BashSession:
     _process: asyncio.subprocess.Process
 
     command: str = "/bin/bash"
-    _output_delay: float = 0.2  # seconds
     _timeout: float = 120.0  # seconds
     _sentinel: str = "<<exit>>"
+    _read_size: int = 64 * 1024
+    # how much of each stream's output is kept for the result
+    _max_head_bytes: int = 16 * 1024
+    _max_tail_bytes: int = 16 * 1024
 
-    def __init__(self):
+    def __init__(self, env: dict[str, str] | None = None):
         self._started = False
         self._timed_out = False
+        # variables set for this shell only, on top of the process environment
+        self._env = env
+        # receives (stream name, text) for output of the running command as it arrives
+        self._output_callback: Callable[[str, str], None] | None = None
 
     async def start(self):
         if self._started:
@@ -32,8 +81,25 @@ class _BashSession:
             stdin=asyncio.subprocess.PIPE,
             stdout=asyncio.subprocess.PIPE,
             stderr=asyncio.subprocess.PIPE,
+            env={**os.environ, **self._env} if self._env else None,
         )
 
+        # we know these are not None because we created the process with PIPEs
+        assert self._process.stdout
+        assert self._process.stderr
+
+        # one result per command and stream: (output, reached_sentinel)
+        self._stdout_results: asyncio.Queue[tuple[str, bool]] = asyncio.Queue()
+        self._stderr_results: asyncio.Queue[tuple[str, bool]] = asyncio.Queue()
+        self._readers = [
+            asyncio.create_task(
+                self._read("stdout", self._process.stdout, self._stdout_results)
+            ),
+            asyncio.create_task(
+                self._read("stderr", self._process.stderr, self._stderr_results)
+            ),
+        ]
+
         self._started = True
 
     def stop(self):
@@ -42,10 +108,60 @@ class _BashSession:
             raise ToolError("Session has not started.")
         if self._process.returncode is not None:
             return
-        self._process.terminate()
+        # bash runs under `sh -c` in its own session; signal the whole group so
+        # the shell and anything it started go away, not just the wrapper
+        try:
+            os.killpg(self._process.pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
 
-    async def run(self, command: str):
-        """Execute a command in the bash shell."""
+    async def _read(
+        self, name: str, stream: asyncio.StreamReader, results: asyncio.Queue
+    ):
+        """
+        Consume a stream as data arrives, splitting it into per-command results.
+
+        The sentinel may be split across reads, so the last few bytes of each
+        read are held back until the next one shows whether they start it.
+        """
+        sentinel = f"{self._sentinel}\n".encode()
+        buffer = _OutputBuffer(self._max_head_bytes, self._max_tail_bytes)
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+
+        def write(data: bytes, final: bool = False):
+            buffer.write(data)
+            if self._output_callback is not None and (
+                text := decoder.decode(data, final=final)
+            ):
+                self._output_callback(name, text)
+
+        pending = b""
+        while chunk := await stream.read(self._read_size):
+            pending += chunk
+            while (index := pending.find(sentinel)) != -1:
+                write(pending[:index], final=True)
+                results.put_nowait((buffer.text(), True))
+                buffer = _OutputBuffer(self._max_head_bytes, self._max_tail_bytes)
+                decoder.reset()
+                pending = pending[index + len(sentinel) :]
+            keep = len(sentinel) - 1
+            if len(pending) > keep:
+                write(pending[:-keep])
+                pending = pending[-keep:]
+        write(pending, final=True)
+        results.put_nowait((buffer.text(), False))
+
+    async def run(
+        self,
+        command: str,
+        output_callback: Callable[[str, str], None] | None = None,
+    ):
+        """
+        Execute a command in the bash shell.
+
+        If `output_callback` is given, it is called with the stream name ("stdout"
+        or "stderr") and each piece of output as the command produces it.
+        """
         if not self._started:
             raise ToolError("Session has not started.")
         if self._process.returncode is not None:
@@ -58,45 +174,41 @@ class _BashSession:
                 f"timed out: bash has not returned in {self._timeout} seconds and must be restarted",
             )
 
-        # we know these are not None because we created the process with PIPEs
         assert self._process.stdin
-        assert self._process.stdout
-        assert self._process.stderr
 
-        # send command to the process
+        # send command to the process, marking the end of its output on both streams
         self._process.stdin.write(
-            command.encode() + f"; echo '{self._sentinel}'\n".encode()
+            command.encode()
+            + f"; echo '{self._sentinel}'; echo '{self._sentinel}' >&2\n".encode()
         )
         await self._process.stdin.drain()
 
-        # read output from the process, until the sentinel is found
+        # wait for the readers to reach the sentinel
+        self._output_callback = output_callback
         try:
             async with asyncio.timeout(self._timeout):
-                while True:
-                    await asyncio.sleep(self._output_delay)
-                    # if we read directly from stdout/stderr, it will wait forever for
-                    # EOF. use the StreamReader buffer directly instead.
-                    output = self._process.stdout._buffer.decode()  # pyright: ignore[reportAttributeAccessIssue]
-                    if self._sentinel in output:
-                        # strip the sentinel and break
-                        output = output[: output.index(self._sentinel)]
-                        break
+                output, completed = await self._stdout_results.get()
+                error, _ = await self._stderr_results.get()
         except asyncio.TimeoutError:
             self._timed_out = True
             raise ToolError(
                 f"timed out: bash has not returned in {self._timeout} seconds and must be restarted",
             ) from None
+        finally:
+            self._output_callback = None
 
         if output.endswith("\n"):
             output = output[:-1]
-
-        error = self._process.stderr._buffer.decode()  # pyright: ignore[reportAttributeAccessIssue]
         if error.endswith("\n"):
             error = error[:-1]
 
-        # clear the buffers so that the next output can be read correctly
-        self._process.stdout._buffer.clear()  # pyright: ignore[reportAttributeAccessIssue]
-        self._process.stderr._buffer.clear()  # pyright: ignore[reportAttributeAccessIssue]
+        if not completed:
+            returncode = await self._process.wait()
+            return ToolResult(
+                output=output,
+                system="tool must be restarted",
+                error=error or f"bash has exited with returncode {returncode}",
+            )
 
         return CLIResult(output=output, error=error)
 
@@ -112,8 +224,10 @@ class BashTool20250124(BaseAnthropicTool):
     api_type: Literal["bash_20250124"] = "bash_20250124"
     name: Literal["bash"] = "bash"
 
-    def __init__(self):
+    def __init__(self, env: dict[str, str] | None = None):
         self._session = None
+        # e.g. DISPLAY, so each session's shell targets its own desktop
+        self.env = env
         super().__init__()
 
     def to_params(self) -> Any:
@@ -122,23 +236,35 @@ class BashTool20250124(BaseAnthropicTool):
             "name": self.name,
         }
 
+    def stop(self) -> None:
+        if self._session:
+            self._session.stop()
+            self._session = None
+
+    # ToolCollection passes an output_callback for live output
+    streams_output = True
+
     async def __call__(
-        self, command: str | None = None, restart: bool = False, **kwargs
+        self,
+        command: str | None = None,
+        restart: bool = False,
+        output_callback: Callable[[str, str], None] | None = None,
+        **kwargs,
     ):
         if restart:
             if self._session:
                 self._session.stop()
-            self._session = _BashSession()
+            self._session = _BashSession(self.env)
             await self._session.start()
 
             return ToolResult(system="tool has been restarted.")
 
         if self._session is None:
-            self._session = _BashSession()
+            self._session = _BashSession(self.env)
             await self._session.start()
 
         if command is not None:
-            return await self._session.run(command)
+            return await self._session.run(command, output_callback)
 
         raise ToolError("no command provided.")
 
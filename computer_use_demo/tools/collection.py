@@ -1,5 +1,6 @@
 """Collection classes for managing multiple tools."""
 
+from collections.abc import Callable
 from typing import Any, cast
 
 from anthropic.types.beta import BetaToolUnionParam
@@ -26,11 +27,24 @@ class ToolCollection:
     ) -> list[BetaToolUnionParam]:
         return [tool.to_params() for tool in self.tools]
 
-    async def run(self, *, name: str, tool_input: dict[str, Any]) -> ToolResult:
+    def stop(self) -> None:
+        """Stop every tool, e.g. terminate the bash shell."""
+        for tool in self.tools:
+            tool.stop()
+
+    async def run(
+        self,
+        *,
+        name: str,
+        tool_input: dict[str, Any],
+        output_callback: Callable[[str, str], None] | None = None,
+    ) -> ToolResult:
         tool = self.tool_map.get(name)
         if not tool:
             return ToolFailure(error=f"Tool {name} is invalid")
         try:
+            if output_callback is not None and tool.streams_output:
+                return await tool(**tool_input, output_callback=output_callback)
             return await tool(**tool_input)
         except ToolError as e:
             return ToolFailure(error=e.message)
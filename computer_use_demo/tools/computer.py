@@ -3,6 +3,7 @@ import base64
 import os
 import shlex
 import shutil
+import time
 from enum import StrEnum
 from pathlib import Path
 from typing import Literal, TypedDict, cast, get_args
@@ -11,7 +12,9 @@ from uuid import uuid4
 from anthropic.types.beta import BetaToolComputerUse20241022Param, BetaToolUnionParam
 
 from .base import BaseAnthropicTool, ToolError, ToolResult
+from .framebuffer import FramebufferCapture
 from .run import run
+from .xinput import UnsupportedCommand, XInputChannel, XInputError
 
 OUTPUT_DIR = "/tmp/outputs"
 
@@ -96,7 +99,11 @@ class BaseComputerTool:
     height: int
     display_num: int | None
 
+    # Upper bound on how long to wait for the screen to settle after an action
     _screenshot_delay = 2.0
+    # The screen counts as settled once it has been unchanged for this long
+    _settle_quiet_window = 0.3
+    _settle_poll_interval = 0.05
     _scaling_enabled = True
 
     @property
@@ -110,14 +117,27 @@ class BaseComputerTool:
             "display_number": self.display_num,
         }
 
-    def __init__(self):
+    def __init__(
+        self,
+        *,
+        width: int | None = None,
+        height: int | None = None,
+        display_num: int | None = None,
+        fbdir: str | None = None,
+        settle_timeout: float | None = None,
+        settle_quiet_window: float | None = None,
+    ):
         super().__init__()
 
-        self.width = int(os.getenv("WIDTH") or 0)
-        self.height = int(os.getenv("HEIGHT") or 0)
+        # Settings not passed in come from the environment, as the demo sets them;
+        # a process running several sessions passes each tool its own
+        self.width = width or int(os.getenv("WIDTH") or 0)
+        self.height = height or int(os.getenv("HEIGHT") or 0)
         assert self.width and self.height, "WIDTH, HEIGHT must be set"
-        if (display_num := os.getenv("DISPLAY_NUM")) is not None:
-            self.display_num = int(display_num)
+        if display_num is None and (env_display := os.getenv("DISPLAY_NUM")) is not None:
+            display_num = int(env_display)
+        if display_num is not None:
+            self.display_num = display_num
             self._display_prefix = f"DISPLAY=:{self.display_num} "
         else:
             self.display_num = None
@@ -125,6 +145,30 @@ class BaseComputerTool:
 
         self.xdotool = f"{self._display_prefix}xdotool"
 
+        if settle_timeout is None and (env_timeout := os.getenv("SCREEN_SETTLE_TIMEOUT")) is not None:
+            settle_timeout = float(env_timeout)
+        if settle_timeout is not None:
+            self._screenshot_delay = settle_timeout
+        if settle_quiet_window is None and (env_window := os.getenv("SCREEN_SETTLE_QUIET_WINDOW")) is not None:
+            settle_quiet_window = float(env_window)
+        if settle_quiet_window is not None:
+            self._settle_quiet_window = settle_quiet_window
+
+        # Capture straight from the Xvfb framebuffer when it is exposed via -fbdir
+        if fbdir is None:
+            fbdir = os.getenv("XVFB_FBDIR")
+        self._framebuffer = FramebufferCapture.from_dir(fbdir)
+        # Send input over a persistent XTEST connection instead of forking xdotool
+        self._input = XInputChannel.for_display(self.display_num)
+
+    def stop(self) -> None:
+        if self._input is not None:
+            self._input.release()
+            self._input = None
+        if self._framebuffer is not None:
+            self._framebuffer.close()
+            self._framebuffer = None
+
     async def __call__(
         self,
         *,
@@ -227,6 +271,28 @@ class BaseComputerTool:
 
     async def screenshot(self):
         """Take a screenshot of the current screen and return the base64 encoded image."""
+        framebuffer = self._framebuffer
+        if framebuffer is not None:
+            try:
+                png = await asyncio.to_thread(
+                    framebuffer.capture_png, self._screenshot_size()
+                )
+                return ToolResult(base64_image=base64.b64encode(png).decode())
+            except (OSError, ValueError):
+                # The display went away, changed format or the tool was stopped
+                # mid-capture; use the external tools
+                framebuffer.close()
+                if self._framebuffer is framebuffer:
+                    self._framebuffer = None
+        return await self._screenshot_subprocess()
+
+    def _screenshot_size(self) -> tuple[int, int] | None:
+        if not self._scaling_enabled:
+            return None
+        return self.scale_coordinates(ScalingSource.COMPUTER, self.width, self.height)
+
+    async def _screenshot_subprocess(self):
+        """Take a screenshot with gnome-screenshot/scrot and resize it with ImageMagick."""
         output_dir = Path(OUTPUT_DIR)
         output_dir.mkdir(parents=True, exist_ok=True)
         path = output_dir / f"screenshot_{uuid4().hex}.png"
@@ -239,10 +305,8 @@ class BaseComputerTool:
             screenshot_cmd = f"{self._display_prefix}scrot -p {path}"
 
         result = await self.shell(screenshot_cmd, take_screenshot=False)
-        if self._scaling_enabled:
-            x, y = self.scale_coordinates(
-                ScalingSource.COMPUTER, self.width, self.height
-            )
+        if size := self._screenshot_size():
+            x, y = size
             await self.shell(
                 f"convert {path} -resize {x}x{y}! {path}", take_screenshot=False
             )
@@ -255,15 +319,78 @@ class BaseComputerTool:
 
     async def shell(self, command: str, take_screenshot=True) -> ToolResult:
         """Run a shell command and return the output, error, and optionally a screenshot."""
-        _, stdout, stderr = await run(command)
+        if (xdotool_args := self._xdotool_args(command)) is not None:
+            try:
+                stdout, stderr = await self._input.run(xdotool_args), ""
+            except UnsupportedCommand:
+                # Nothing was sent; let xdotool handle what we can't
+                _, stdout, stderr = await run(command)
+            except XInputError as exc:
+                if exc.delivered:
+                    # Part of the input may have landed; replaying it could double it
+                    stdout, stderr = "", str(exc)
+                else:
+                    _, stdout, stderr = await run(command)
+        else:
+            _, stdout, stderr = await run(command)
         base64_image = None
 
+        settle_time = None
+
         if take_screenshot:
-            # delay to let things settle before taking a screenshot
-            await asyncio.sleep(self._screenshot_delay)
+            # let things settle before taking a screenshot
+            settle_time = await self.wait_for_settle()
             base64_image = (await self.screenshot()).base64_image
 
-        return ToolResult(output=stdout, error=stderr, base64_image=base64_image)
+        return ToolResult(
+            output=stdout,
+            error=stderr,
+            base64_image=base64_image,
+            settle_time=settle_time,
+        )
+
+    def _xdotool_args(self, command: str) -> str | None:
+        """The xdotool arguments of `command` if it can go over the input channel."""
+        if self._input is not None and self._input.closed:
+            # The connection failed; reconnect, in case the display was restarted
+            self._input = XInputChannel.for_display(self.display_num)
+        if self._input is None:
+            return None
+        prefix = f"{self.xdotool} "
+        return command[len(prefix) :] if command.startswith(prefix) else None
+
+    async def wait_for_settle(self) -> float:
+        """
+        Wait until the screen stops changing and return how long that took.
+
+        Polls a low-resolution fingerprint of the framebuffer and returns once it
+        has been stable for the quiet window, or after `_screenshot_delay` at most.
+        Without framebuffer access this is a fixed `_screenshot_delay` sleep.
+        """
+        start = time.monotonic()
+        framebuffer = self._framebuffer
+        if framebuffer is None:
+            await asyncio.sleep(self._screenshot_delay)
+            return time.monotonic() - start
+
+        deadline = start + self._screenshot_delay
+        try:
+            fingerprint = framebuffer.fingerprint()
+            last_change = start
+            while True:
+                await asyncio.sleep(self._settle_poll_interval)
+                now = time.monotonic()
+                current = framebuffer.fingerprint()
+                if current != fingerprint:
+                    fingerprint, last_change = current, now
+                elif now - last_change >= self._settle_quiet_window:
+                    break
+                if now >= deadline:
+                    break
+        except (OSError, ValueError):
+            # The framebuffer went away mid-poll; screenshot() will fall back
+            await asyncio.sleep(max(0.0, deadline - time.monotonic()))
+        return time.monotonic() - start
 
     def scale_coordinates(self, source: ScalingSource, x: int, y: int):
         """Scale coordinates to a target maximum resolution."""
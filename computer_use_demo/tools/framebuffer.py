@@ -0,0 +1,144 @@
+"""In-process screen capture from the Xvfb framebuffer file."""
+
+import io
+import mmap
+import os
+import struct
+import threading
+import zlib
+from contextlib import contextmanager
+from pathlib import Path
+
+try:
+    from PIL import Image
+except ImportError:  # pragma: no cover - Pillow is optional
+    Image = None
+
+# Xvfb started with `-fbdir DIR` keeps screen 0 in DIR/Xvfb_screen0 as an XWD image
+FRAMEBUFFER_FILE = "Xvfb_screen0"
+
+# XWD file header: 25 big-endian CARD32 fields
+_XWD_HEADER = struct.Struct(">25I")
+_XWD_COLOR_SIZE = 12
+_ZPIXMAP = 2
+_LSB_FIRST = 0
+
+# Rows sampled by fingerprint(); enough to catch any visible redraw
+_FINGERPRINT_ROW_STEP = 4
+
+
+class FramebufferCapture:
+    """
+    Reads the live Xvfb framebuffer through a shared memory mapping.
+
+    Xvfb updates the mapped file in place, so every grab sees the current screen
+    without spawning a screenshot tool or touching the disk. Reads may run in a
+    worker thread; close() waits for any read in progress before unmapping.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._closed = False
+        self._file = open(path, "rb")
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            self._parse_header()
+        except Exception:
+            self._file.close()
+            raise
+
+    @classmethod
+    def from_env(cls) -> "FramebufferCapture | None":
+        """Open the framebuffer named by XVFB_FBDIR, or None if it is unavailable."""
+        return cls.from_dir(os.getenv("XVFB_FBDIR"))
+
+    @classmethod
+    def from_dir(cls, fbdir: str | None) -> "FramebufferCapture | None":
+        """Open the framebuffer Xvfb keeps in `fbdir`, or None if it is unavailable."""
+        if Image is None or not fbdir:
+            return None
+        path = Path(fbdir) / FRAMEBUFFER_FILE
+        if not path.exists():
+            return None
+        try:
+            return cls(path)
+        except (OSError, ValueError):
+            return None
+
+    def _parse_header(self):
+        fields = _XWD_HEADER.unpack_from(self._map, 0)
+        header_size = fields[0]
+        pixmap_format = fields[2]
+        self.width, self.height = fields[4], fields[5]
+        byte_order = fields[7]
+        bits_per_pixel = fields[11]
+        self.bytes_per_line = fields[12]
+        ncolors = fields[19]
+
+        if pixmap_format != _ZPIXMAP or bits_per_pixel != 32:
+            raise ValueError(
+                f"unsupported framebuffer format {pixmap_format=} {bits_per_pixel=}"
+            )
+        self._rawmode = "BGRX" if byte_order == _LSB_FIRST else "XRGB"
+        self._offset = header_size + ncolors * _XWD_COLOR_SIZE
+        if self._offset + self.bytes_per_line * self.height > len(self._map):
+            raise ValueError("framebuffer file is truncated")
+
+    def pixels(self) -> memoryview:
+        """The raw pixel rows of the current frame."""
+        end = self._offset + self.bytes_per_line * self.height
+        return memoryview(self._map)[self._offset : end]
+
+    @contextmanager
+    def _frame(self):
+        with self._lock:
+            if self._closed:
+                raise ValueError("framebuffer is closed")
+            with self.pixels() as pixels:
+                yield pixels
+
+    def fingerprint(self) -> int:
+        """
+        A cheap checksum of a low-resolution sample of the current frame.
+
+        Only every few rows are hashed, so this costs well under a millisecond even
+        for large screens and is suitable for polling while the screen settles.
+        """
+        checksum = 0
+        with self._frame() as pixels:
+            step = self.bytes_per_line * _FINGERPRINT_ROW_STEP
+            for start in range(0, len(pixels), step):
+                checksum = zlib.crc32(pixels[start : start + self.bytes_per_line], checksum)
+        return checksum
+
+    def grab(self):
+        """Copy the current frame into an RGB image."""
+        with self._frame() as pixels:
+            return Image.frombuffer(
+                "RGB",
+                (self.width, self.height),
+                pixels,
+                "raw",
+                self._rawmode,
+                self.bytes_per_line,
+                1,
+            )
+
+    def capture_png(self, size: tuple[int, int] | None = None) -> bytes:
+        """Grab the screen, optionally resize it, and encode it as PNG in memory."""
+        image = self.grab()
+        if size and size != image.size:
+            image = image.resize(size, Image.Resampling.LANCZOS)
+        buffer = io.BytesIO()
+        # Favour encode latency over size; screenshots are sent once and discarded
+        image.save(buffer, format="PNG", compress_level=1)
+        return buffer.getvalue()
+
+    def close(self):
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._map.close()
+            self._file.close()
@@ -0,0 +1,333 @@
+"""
+In-process keyboard and mouse input over a persistent XTEST connection.
+
+ComputerTool builds its input actions as xdotool command lines. Running them
+means forking a shell and an xdotool process per action, and xdotool opens a new
+X connection each time. XInputChannel understands the subset of xdotool
+commands the tool uses and replays them through XTEST on one long-lived
+connection per display. All events of a command line are sent as one batch and
+confirmed with a single round trip to the server.
+"""
+
+import asyncio
+import os
+import shlex
+from dataclasses import dataclass
+
+try:
+    from Xlib import XK, X, display as xdisplay, error as xerror
+    from Xlib.ext import xtest
+except ImportError:  # pragma: no cover - python-xlib is optional
+    X = XK = xdisplay = xerror = xtest = None
+
+# xdotool's defaults, kept so that in-process input behaves like the CLI
+DEFAULT_KEY_DELAY_MS = 12
+DEFAULT_CLICK_DELAY_MS = 100
+
+COMMANDS = frozenset(
+    (
+        "mousemove",
+        "mousedown",
+        "mouseup",
+        "click",
+        "key",
+        "keydown",
+        "keyup",
+        "type",
+        "sleep",
+        "getmouselocation",
+    )
+)
+
+# Modifier aliases accepted by xdotool
+KEY_ALIASES = {
+    "ctrl": "Control_L",
+    "control": "Control_L",
+    "alt": "Alt_L",
+    "shift": "Shift_L",
+    "super": "Super_L",
+    "meta": "Meta_L",
+    "win": "Super_L",
+}
+
+# Characters that have no keysym of the same code point
+CHAR_KEYSYMS = {
+    "\n": "Return",
+    "\r": "Return",
+    "\t": "Tab",
+}
+
+
+class UnsupportedCommand(ValueError):
+    """The command line can't be replayed in-process; use the xdotool binary."""
+
+
+class XInputError(RuntimeError):
+    """
+    The X connection failed while sending input.
+
+    `delivered` is False if the failure came before any of the command's
+    events were written to the server, so it is safe to retry with xdotool.
+    """
+
+    def __init__(self, message: str, delivered: bool):
+        super().__init__(message)
+        self.delivered = delivered
+
+
+@dataclass(frozen=True)
+class InputEvent:
+    """A single XTEST event, or a pause when `event_type` is None."""
+
+    event_type: int | None
+    detail: int = 0
+    x: int = 0
+    y: int = 0
+    delay: float = 0.0
+
+
+@dataclass(frozen=True)
+class QueryPointer:
+    """Report the pointer position the way `getmouselocation --shell` does."""
+
+
+class XInputChannel:
+    """
+    A persistent XTEST connection to one X display.
+
+    Tools on the same display share a channel through for_display(), and hand
+    it back with release(); the connection is closed when the last user
+    releases it or as soon as it fails.
+    """
+
+    _channels: dict[str, "XInputChannel"] = {}
+
+    def __init__(self, display):
+        self._display = display
+        self._lock = asyncio.Lock()
+        self._users = 0
+        self.closed = False
+
+    @classmethod
+    def for_display(cls, display_num: int | None) -> "XInputChannel | None":
+        """Return the shared channel for a display, or None if XTEST is unavailable."""
+        if xdisplay is None:
+            return None
+        name = f":{display_num}" if display_num is not None else os.getenv("DISPLAY")
+        if not name:
+            return None
+        channel = cls._channels.get(name)
+        if channel is not None and not channel._alive():
+            # The server on this display went away or was replaced
+            channel.close()
+            channel = None
+        if channel is None:
+            try:
+                display = xdisplay.Display(name)
+            except (xerror.DisplayError, OSError):
+                return None
+            if not display.has_extension("XTEST"):
+                display.close()
+                return None
+            channel = cls._channels[name] = cls(display)
+        channel._users += 1
+        return channel
+
+    def _alive(self) -> bool:
+        if self.closed:
+            return False
+        try:
+            # Any request with a reply; fails once the server's end is gone
+            self._display.get_input_focus()
+            return True
+        except (xerror.ConnectionClosedError, xerror.XError, OSError):
+            return False
+
+    def compile(self, args: str) -> list[InputEvent | QueryPointer]:
+        """
+        Translate xdotool arguments into input events without sending anything.
+
+        Raises UnsupportedCommand for anything outside the supported subset, so
+        callers can fall back to xdotool before any input has been delivered.
+        """
+        try:
+            return self._compile(shlex.split(args))
+        except UnsupportedCommand:
+            raise
+        except ValueError as exc:
+            raise UnsupportedCommand(f"can't parse xdotool arguments: {exc}") from exc
+
+    def _compile(self, tokens: list[str]) -> list[InputEvent | QueryPointer]:
+        events: list[InputEvent | QueryPointer] = []
+        while tokens:
+            command = tokens.pop(0)
+            options = _pop_options(tokens)
+            if command == "mousemove":
+                x, y = _pop_args(tokens, 2, command, int)
+                events.append(InputEvent(X.MotionNotify, x=x, y=y))
+            elif command in ("mousedown", "mouseup"):
+                (button,) = _pop_args(tokens, 1, command, int)
+                press = command == "mousedown"
+                events.append(InputEvent(X.ButtonPress if press else X.ButtonRelease, button))
+            elif command == "click":
+                (button,) = _pop_args(tokens, 1, command, int)
+                repeat = int(options.get("--repeat", 1))
+                delay = int(options.get("--delay", DEFAULT_CLICK_DELAY_MS)) / 1000
+                for i in range(repeat):
+                    if i:
+                        events.append(InputEvent(None, delay=delay))
+                    events.append(InputEvent(X.ButtonPress, button))
+                    events.append(InputEvent(X.ButtonRelease, button))
+            elif command in ("key", "keydown", "keyup"):
+                delay = int(options.get("--delay", DEFAULT_KEY_DELAY_MS)) / 1000
+                sequences = _pop_until_command(tokens)
+                if not sequences:
+                    raise UnsupportedCommand(f"{command} needs a key sequence")
+                for i, sequence in enumerate(sequences):
+                    if i and command == "key":
+                        events.append(InputEvent(None, delay=delay))
+                    keycodes = [self._keycode(name) for name in sequence.split("+")]
+                    if command != "keyup":
+                        events.extend(InputEvent(X.KeyPress, code) for code in keycodes)
+                    if command != "keydown":
+                        events.extend(
+                            InputEvent(X.KeyRelease, code) for code in reversed(keycodes)
+                        )
+            elif command == "type":
+                delay = int(options.get("--delay", DEFAULT_KEY_DELAY_MS)) / 1000
+                for i, char in enumerate("".join(tokens)):
+                    if i and delay:
+                        events.append(InputEvent(None, delay=delay))
+                    events.extend(self._type_char(char))
+                tokens = []
+            elif command == "sleep":
+                (seconds,) = _pop_args(tokens, 1, command, float)
+                events.append(InputEvent(None, delay=seconds))
+            elif command == "getmouselocation":
+                events.append(QueryPointer())
+            else:
+                raise UnsupportedCommand(f"unsupported xdotool command: {command}")
+        return events
+
+    async def execute(self, events: list[InputEvent | QueryPointer]) -> str:
+        """Send compiled events as one batch and return any xdotool-style output."""
+        output = ""
+        delivered = False
+        async with self._lock:
+            try:
+                for event in events:
+                    if isinstance(event, QueryPointer):
+                        output += self._query_pointer()
+                        delivered = True
+                    elif event.event_type is None:
+                        # Deliver what is queued before pausing
+                        self._display.flush()
+                        delivered = True
+                        await asyncio.sleep(event.delay)
+                    else:
+                        xtest.fake_input(
+                            self._display,
+                            event.event_type,
+                            detail=event.detail,
+                            x=event.x,
+                            y=event.y,
+                        )
+                # One round trip: returns once the server has processed every event
+                await asyncio.to_thread(self._display.sync)
+            except (xerror.ConnectionClosedError, OSError) as exc:
+                self.close()
+                raise XInputError(f"X connection lost: {exc}", delivered) from exc
+        return output
+
+    async def run(self, args: str) -> str:
+        """Compile and execute one xdotool argument string."""
+        return await self.execute(self.compile(args))
+
+    def release(self):
+        """Stop using a channel from for_display(); the last user closes it."""
+        self._users -= 1
+        if self._users <= 0:
+            self.close()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        for name, channel in list(self._channels.items()):
+            if channel is self:
+                del self._channels[name]
+        try:
+            self._display.close()
+        except Exception:
+            pass
+
+    def _keycode(self, name: str) -> int:
+        name = KEY_ALIASES.get(name.lower(), name)
+        keysym = XK.string_to_keysym(name)
+        if not keysym and len(name) == 1:
+            keysym = _char_keysym(name)
+        keycode = self._display.keysym_to_keycode(keysym) if keysym else 0
+        if not keycode:
+            raise UnsupportedCommand(f"no keycode for key {name!r}")
+        return keycode
+
+    def _type_char(self, char: str) -> list[InputEvent]:
+        keysym = _char_keysym(char)
+        # Prefer the unshifted mapping; fall back to Shift for the second level
+        for keycode, index in sorted(
+            self._display.keysym_to_keycodes(keysym), key=lambda item: item[1]
+        ):
+            if index == 0:
+                return [InputEvent(X.KeyPress, keycode), InputEvent(X.KeyRelease, keycode)]
+            if index == 1:
+                shift = self._keycode("Shift_L")
+                return [
+                    InputEvent(X.KeyPress, shift),
+                    InputEvent(X.KeyPress, keycode),
+                    InputEvent(X.KeyRelease, keycode),
+                    InputEvent(X.KeyRelease, shift),
+                ]
+        raise UnsupportedCommand(f"no key types {char!r} on this keyboard")
+
+    def _query_pointer(self) -> str:
+        pointer = self._display.screen().root.query_pointer()
+        window = pointer.child.id if pointer.child else 0
+        return f"X={pointer.root_x}\nY={pointer.root_y}\nSCREEN=0\nWINDOW={window}\n"
+
+
+def _char_keysym(char: str) -> int:
+    if char in CHAR_KEYSYMS:
+        return XK.string_to_keysym(CHAR_KEYSYMS[char])
+    code = ord(char)
+    # Latin-1 keysyms share their code points; everything else uses the Unicode range
+    if 0x20 <= code <= 0x7E or 0xA0 <= code <= 0xFF:
+        return code
+    return 0x01000000 + code
+
+
+def _pop_options(tokens: list[str]) -> dict[str, str]:
+    options: dict[str, str] = {}
+    while tokens and tokens[0].startswith("--"):
+        option = tokens.pop(0)
+        if option == "--":
+            break
+        if option in ("--repeat", "--delay"):
+            if not tokens:
+                raise UnsupportedCommand(f"{option} needs a value")
+            options[option] = tokens.pop(0)
+        elif option not in ("--sync", "--shell"):
+            raise UnsupportedCommand(f"unsupported option: {option}")
+    return options
+
+
+def _pop_until_command(tokens: list[str]) -> list[str]:
+    args = []
+    while tokens and tokens[0] not in COMMANDS:
+        args.append(tokens.pop(0))
+    return args
+
+
+def _pop_args(tokens: list[str], count: int, command: str, convert) -> list:
+    if len(tokens) < count:
+        raise UnsupportedCommand(f"{command} needs {count} argument(s)")
+    return [convert(tokens.pop(0)) for _ in range(count)]
@@ -33,8 +33,15 @@ if check_xvfb_running; then
     exit 0
 fi
 
+# Expose the framebuffer as a memory-mapped file for in-process screenshots
+FBDIR_ARGS=""
+if [ -n "$XVFB_FBDIR" ]; then
+    mkdir -p "$XVFB_FBDIR"
+    FBDIR_ARGS="-fbdir $XVFB_FBDIR"
+fi
+
 # Start Xvfb
-Xvfb $DISPLAY -ac -screen 0 $RES_AND_DEPTH -retro -dpi $DPI -nolisten tcp -nolisten unix &
+Xvfb $DISPLAY -ac -screen 0 $RES_AND_DEPTH -retro -dpi $DPI -nolisten tcp -nolisten unix $FBDIR_ARGS &
 XVFB_PID=$!
 
 # Wait for Xvfb to start
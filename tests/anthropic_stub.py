@@ -0,0 +1,144 @@
+"""
+Minimal local stand-in for the Anthropic Messages API.
+
+Speaks just enough HTTP/1.1 (with keep-alive) to serve canned
+`POST /v1/messages` responses, either as JSON or, when the request asks for
+`stream: true`, as server-sent events. Counts TCP connections and requests so
+tests can assert on connection reuse.
+"""
+
+import asyncio
+import json
+from typing import Any, Dict, List
+
+
+def text_message(text: str) -> Dict[str, Any]:
+    """A final assistant message containing a single text block."""
+    return _message([{"type": "text", "text": text}], stop_reason="end_turn")
+
+
+def tool_use_message(tool_id: str, name: str, tool_input: Dict[str, Any]) -> Dict[str, Any]:
+    """An assistant message asking for a single tool call."""
+    return _message(
+        [{"type": "tool_use", "id": tool_id, "name": name, "input": tool_input}],
+        stop_reason="tool_use",
+    )
+
+
+def _message(content: List[Dict[str, Any]], stop_reason: str) -> Dict[str, Any]:
+    return {
+        "id": "msg_stub",
+        "type": "message",
+        "role": "assistant",
+        "model": "stub-model",
+        "content": content,
+        "stop_reason": stop_reason,
+        "stop_sequence": None,
+        "usage": {"input_tokens": 1, "output_tokens": 1},
+    }
+
+
+class StubMessagesServer:
+    """Serves queued Messages API responses on localhost."""
+
+    def __init__(self, responses: List[Dict[str, Any]], event_delay: float = 0.0):
+        self.responses = list(responses)
+        self.event_delay = event_delay
+        self.requests: List[Dict[str, Any]] = []
+        self.connections = 0
+        self._server: asyncio.AbstractServer | None = None
+
+    @property
+    def url(self) -> str:
+        assert self._server is not None
+        host, port = self._server.sockets[0].getsockname()[:2]
+        return f"http://{host}:{port}"
+
+    async def __aenter__(self) -> "StubMessagesServer":
+        self._server = await asyncio.start_server(self._handle, "127.0.0.1", 0)
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        assert self._server is not None
+        self._server.close()
+        await self._server.wait_closed()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.connections += 1
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                headers: Dict[str, str] = {}
+                while (line := await reader.readline()) not in (b"\r\n", b""):
+                    name, _, value = line.decode().partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+                request = json.loads(body) if body else {}
+                self.requests.append(request)
+                if request.get("stream"):
+                    await self._respond_stream(writer, self.responses.pop(0))
+                else:
+                    await self._respond(writer, self.responses.pop(0))
+        except (ConnectionResetError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _respond(self, writer: asyncio.StreamWriter, message: Dict[str, Any]) -> None:
+        payload = json.dumps(message).encode()
+        writer.write(
+            b"HTTP/1.1 200 OK\r\n"
+            b"content-type: application/json\r\n"
+            b"connection: keep-alive\r\n"
+            + f"content-length: {len(payload)}\r\n\r\n".encode()
+            + payload
+        )
+        await writer.drain()
+
+    async def _respond_stream(self, writer: asyncio.StreamWriter, message: Dict[str, Any]) -> None:
+        writer.write(
+            b"HTTP/1.1 200 OK\r\n"
+            b"content-type: text/event-stream\r\n"
+            b"connection: keep-alive\r\n"
+            b"transfer-encoding: chunked\r\n\r\n"
+        )
+        for event in stream_events(message):
+            frame = f"event: {event['type']}\ndata: {json.dumps(event)}\n\n".encode()
+            writer.write(f"{len(frame):x}\r\n".encode() + frame + b"\r\n")
+            await writer.drain()
+            if self.event_delay:
+                await asyncio.sleep(self.event_delay)
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+
+
+def stream_events(message: Dict[str, Any], chunk_size: int = 4) -> List[Dict[str, Any]]:
+    """Split a complete message into the Messages API streaming event sequence."""
+    events: List[Dict[str, Any]] = [
+        {"type": "message_start", "message": {**message, "content": [], "stop_reason": None}}
+    ]
+    for index, block in enumerate(message["content"]):
+        if block["type"] == "text":
+            start, field, delta_type = {**block, "text": ""}, block["text"], "text_delta"
+        elif block["type"] == "thinking":
+            start, field, delta_type = {**block, "thinking": ""}, block["thinking"], "thinking_delta"
+        else:
+            start, field, delta_type = {**block, "input": {}}, json.dumps(block["input"]), "input_json_delta"
+        events.append({"type": "content_block_start", "index": index, "content_block": start})
+        key = {"text_delta": "text", "thinking_delta": "thinking", "input_json_delta": "partial_json"}[delta_type]
+        for i in range(0, len(field), chunk_size):
+            events.append({
+                "type": "content_block_delta",
+                "index": index,
+                "delta": {"type": delta_type, key: field[i:i + chunk_size]},
+            })
+        events.append({"type": "content_block_stop", "index": index})
+    events.append({
+        "type": "message_delta",
+        "delta": {"stop_reason": message["stop_reason"], "stop_sequence": None},
+        "usage": {"output_tokens": message["usage"]["output_tokens"]},
+    })
+    events.append({"type": "message_stop"})
+    return events
@@ -10,6 +10,14 @@ from computer_use_backend.main import create_app
 from computer_use_backend.database import get_db_session
 
 
+@pytest.fixture(autouse=True)
+def demo_screen_size(request, monkeypatch):
+    """ComputerTool reads its screen size from the environment; set one for the demo tests."""
+    if request.node.path.name.endswith("_test.py"):
+        monkeypatch.setenv("WIDTH", "1024")
+        monkeypatch.setenv("HEIGHT", "768")
+
+
 # Test database URL (use in-memory SQLite for tests)
 TEST_DATABASE_URL = "sqlite+aiosqlite:///:memory:"
 
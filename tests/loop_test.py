@@ -1,13 +1,18 @@
+import asyncio
 from unittest import mock
 
+import httpx
 from anthropic.types import TextBlock, ToolUseBlock
 from anthropic.types.beta import BetaMessage, BetaMessageParam, BetaTextBlockParam
 
 from computer_use_demo.loop import APIProvider, sampling_loop
 
+from .anthropic_stub import StubMessagesServer, text_message, tool_use_message
+
 
 async def test_loop():
     client = mock.Mock()
+    client.beta.messages.with_raw_response.create = mock.AsyncMock()
     client.beta.messages.with_raw_response.create.return_value = mock.Mock()
     client.beta.messages.with_raw_response.create.return_value.parse.side_effect = [
         mock.Mock(
@@ -32,7 +37,7 @@ async def test_loop():
     api_response_callback = mock.Mock()
 
     with (
-        mock.patch("computer_use_demo.loop.Anthropic", return_value=client),
+        mock.patch("computer_use_demo.loop.AsyncAnthropic", return_value=client),
         mock.patch(
             "computer_use_demo.loop.ToolCollection", return_value=tool_collection
         ),
@@ -58,7 +63,7 @@ async def test_loop():
 
         assert client.beta.messages.with_raw_response.create.call_count == 2
         tool_collection.run.assert_called_once_with(
-            name="computer", tool_input={"action": "test"}
+            name="computer", tool_input={"action": "test"}, output_callback=None
         )
         output_callback.assert_called_with(
             BetaTextBlockParam(text="Done!", type="text", citations=None)
@@ -66,3 +71,167 @@ async def test_loop():
         assert output_callback.call_count == 3
         assert tool_output_callback.call_count == 1
         assert api_response_callback.call_count == 2
+
+
+async def test_loop_reuses_pooled_connection():
+    tool_collection = mock.AsyncMock()
+    tool_collection.to_params = mock.Mock(return_value=[])
+    tool_collection.run.return_value = mock.Mock(
+        output="Tool output", error=None, base64_image=None, system=None
+    )
+
+    responses = [
+        tool_use_message("toolu_1", "computer", {"action": "screenshot"}),
+        text_message("Done!"),
+        text_message("Second session done!"),
+    ]
+    async with (
+        StubMessagesServer(responses) as stub,
+        httpx.AsyncClient() as http_client,
+    ):
+        with mock.patch(
+            "computer_use_demo.loop.ToolCollection", return_value=tool_collection
+        ):
+            for _ in range(2):  # two sessions sharing one pool
+                await sampling_loop(
+                    model="test-model",
+                    provider=APIProvider.ANTHROPIC,
+                    system_prompt_suffix="",
+                    messages=[{"role": "user", "content": "Test message"}],
+                    output_callback=mock.Mock(),
+                    tool_output_callback=mock.Mock(),
+                    api_response_callback=mock.Mock(),
+                    api_key="test-key",
+                    tool_version="computer_use_20250124",
+                    http_client=http_client,
+                    base_url=stub.url,
+                )
+
+    assert len(stub.requests) == 3
+    assert stub.requests[0]["model"] == "test-model"
+    assert stub.requests[1]["messages"][-1]["content"][0]["type"] == "tool_result"
+    assert stub.connections == 1
+
+
+async def test_loop_does_not_block_event_loop():
+    tool_collection = mock.AsyncMock()
+    tool_collection.to_params = mock.Mock(return_value=[])
+    ticks = 0
+
+    async def ticker():
+        nonlocal ticks
+        while True:
+            await asyncio.sleep(0.001)
+            ticks += 1
+
+    async with StubMessagesServer([text_message("Done!")]) as stub:
+        ticker_task = asyncio.create_task(ticker())
+        with mock.patch(
+            "computer_use_demo.loop.ToolCollection", return_value=tool_collection
+        ):
+            await sampling_loop(
+                model="test-model",
+                provider=APIProvider.ANTHROPIC,
+                system_prompt_suffix="",
+                messages=[{"role": "user", "content": "Test message"}],
+                output_callback=mock.Mock(),
+                tool_output_callback=mock.Mock(),
+                api_response_callback=mock.Mock(),
+                api_key="test-key",
+                tool_version="computer_use_20250124",
+                base_url=stub.url,
+            )
+        ticker_task.cancel()
+
+    # Other tasks keep running while the request is in flight
+    assert ticks > 0
+
+
+async def test_loop_streams_deltas_and_assembles_tool_input():
+    tool_collection = mock.AsyncMock()
+    tool_collection.to_params = mock.Mock(return_value=[])
+    tool_collection.run.return_value = mock.Mock(
+        output="Tool output", error=None, base64_image=None, system=None
+    )
+    events = []
+    output_callback = mock.Mock()
+
+    responses = [
+        tool_use_message("toolu_1", "bash", {"command": "echo hello world"}),
+        text_message("All done, the command printed hello world."),
+    ]
+    async with StubMessagesServer(responses) as stub:
+        with mock.patch(
+            "computer_use_demo.loop.ToolCollection", return_value=tool_collection
+        ):
+            await sampling_loop(
+                model="test-model",
+                provider=APIProvider.ANTHROPIC,
+                system_prompt_suffix="",
+                messages=[{"role": "user", "content": "Test message"}],
+                output_callback=output_callback,
+                tool_output_callback=mock.Mock(),
+                api_response_callback=mock.Mock(),
+                api_key="test-key",
+                tool_version="computer_use_20250124",
+                base_url=stub.url,
+                stream_callback=events.append,
+            )
+
+    assert all(request["stream"] for request in stub.requests)
+    partial_json = [
+        e.delta.partial_json
+        for e in events
+        if e.type == "content_block_delta" and e.delta.type == "input_json_delta"
+    ]
+    assert len(partial_json) > 1
+    text_deltas = [
+        e.delta.text
+        for e in events
+        if e.type == "content_block_delta" and e.delta.type == "text_delta"
+    ]
+    assert "".join(text_deltas) == "All done, the command printed hello world."
+
+    tool_collection.run.assert_called_once_with(
+        name="bash",
+        tool_input={"command": "echo hello world"},
+        output_callback=None,
+    )
+    assert output_callback.call_args_list[-1].args[0]["text"] == (
+        "All done, the command printed hello world."
+    )
+
+
+async def test_loop_streams_tool_output_while_running():
+    chunks = []
+    results = []
+    responses = [
+        tool_use_message(
+            "toolu_1", "bash", {"command": "for i in 1 2 3; do echo line$i; sleep 0.05; done"}
+        ),
+        text_message("Printed three lines."),
+    ]
+    async with StubMessagesServer(responses) as stub:
+        await sampling_loop(
+            model="test-model",
+            provider=APIProvider.ANTHROPIC,
+            system_prompt_suffix="",
+            messages=[{"role": "user", "content": "Test message"}],
+            output_callback=mock.Mock(),
+            tool_output_callback=lambda result, tool_id: results.append(result),
+            api_response_callback=mock.Mock(),
+            api_key="test-key",
+            tool_version="computer_use_20250124",
+            base_url=stub.url,
+            tool_stream_callback=lambda *chunk: chunks.append(chunk),
+        )
+
+    # Output arrived in pieces, tagged with the tool use it belongs to
+    assert len(chunks) >= 3
+    assert {(tool_id, stream) for tool_id, stream, _ in chunks} == {("toolu_1", "stdout")}
+    assert "".join(text for _, _, text in chunks) == "line1\nline2\nline3\n"
+
+    # The model still gets the complete result
+    assert results[0].output == "line1\nline2\nline3"
+    tool_result = stub.requests[1]["messages"][-1]["content"][0]
+    assert tool_result["content"][0]["text"] == "line1\nline2\nline3"
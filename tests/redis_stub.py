@@ -0,0 +1,190 @@
+"""
+Minimal local stand-in for a Redis server.
+
+Speaks RESP2 and implements the few commands the backend uses: PING, AUTH,
+SELECT, PUBLISH, PSUBSCRIBE, the hash commands (HSET, HSETNX, HGET,
+HGETALL, HDEL, HEXISTS, HINCRBY) and EVAL of the worker registry's Lua
+scripts, which run as Python equivalents. Tracks connections, published
+messages and hash contents so tests can assert on them, and can drop every
+client to simulate the broker restarting.
+"""
+
+import asyncio
+from fnmatch import fnmatchcase
+from typing import Any, Callable, Dict, List, Set, Tuple
+
+from computer_use_backend.services.worker_registry import RELEASE_SCRIPT, TAKE_OVER_SCRIPT
+
+
+def _encode(value: Any) -> bytes:
+    if value is None:
+        return b"$-1\r\n"
+    if isinstance(value, int):
+        return b":%d\r\n" % value
+    if isinstance(value, str):
+        return b"+%s\r\n" % value.encode()
+    if isinstance(value, bytes):
+        return b"$%d\r\n%s\r\n" % (len(value), value)
+    if isinstance(value, Exception):
+        return b"-ERR %s\r\n" % str(value).encode()
+    return b"*%d\r\n" % len(value) + b"".join(_encode(item) for item in value)
+
+
+class StubRedisServer:
+    """Serves the Redis protocol on localhost."""
+
+    def __init__(self, password: str | None = None):
+        self.password = password
+        self.connections = 0
+        self.published: List[Tuple[str, bytes]] = []
+        self.hashes: Dict[bytes, Dict[bytes, bytes]] = {}
+        self._subscribers: Dict[asyncio.StreamWriter, Set[bytes]] = {}
+        self._writers: Set[asyncio.StreamWriter] = set()
+        self._server: asyncio.AbstractServer | None = None
+
+    @property
+    def url(self) -> str:
+        assert self._server is not None
+        host, port = self._server.sockets[0].getsockname()[:2]
+        auth = f":{self.password}@" if self.password else ""
+        return f"redis://{auth}{host}:{port}/0"
+
+    async def __aenter__(self) -> "StubRedisServer":
+        self._server = await asyncio.start_server(self._handle, "127.0.0.1", 0)
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        assert self._server is not None
+        self._server.close()
+        self.drop_clients()
+        await self._server.wait_closed()
+
+    def drop_clients(self) -> None:
+        """Close every client connection, as a broker restart would."""
+        for writer in list(self._writers):
+            writer.close()
+
+    async def wait_for_subscribers(self, count: int) -> None:
+        for _ in range(200):
+            if len(self._subscribers) >= count:
+                return
+            await asyncio.sleep(0.01)
+        raise AssertionError(f"never reached {count} subscribers")
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.connections += 1
+        self._writers.add(writer)
+        authed = self.password is None
+        try:
+            while True:
+                command = await self._read_command(reader)
+                if command is None:
+                    break
+                name = command[0].upper()
+                if name == b"AUTH":
+                    authed = command[-1].decode() == self.password
+                    writer.write(_encode("OK" if authed else Exception("invalid password")))
+                elif not authed:
+                    writer.write(_encode(Exception("NOAUTH Authentication required")))
+                elif name in (b"PING", b"SELECT"):
+                    writer.write(_encode("PONG" if name == b"PING" else "OK"))
+                elif name == b"PSUBSCRIBE":
+                    patterns = self._subscribers.setdefault(writer, set())
+                    for pattern in command[1:]:
+                        patterns.add(pattern)
+                        writer.write(_encode([b"psubscribe", pattern, len(patterns)]))
+                elif name == b"PUBLISH":
+                    writer.write(_encode(self._publish(command[1], command[2])))
+                elif name.startswith(b"H"):
+                    writer.write(_encode(self._hash_command(name, command[1:])))
+                elif name == b"EVAL":
+                    writer.write(_encode(self._eval(command[1], command[2:])))
+                else:
+                    writer.write(_encode(Exception(f"unknown command '{name.decode()}'")))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self._subscribers.pop(writer, None)
+            self._writers.discard(writer)
+            writer.close()
+
+    def _publish(self, channel: bytes, message: bytes) -> int:
+        self.published.append((channel.decode(), message))
+        receivers = 0
+        for subscriber, patterns in list(self._subscribers.items()):
+            for pattern in patterns:
+                if fnmatchcase(channel.decode(), pattern.decode()):
+                    subscriber.write(_encode([b"pmessage", pattern, channel, message]))
+                    receivers += 1
+        return receivers
+
+    def _hash_command(self, name: bytes, args: List[bytes]) -> Any:
+        table = self.hashes.setdefault(args[0], {})
+        if name == b"HSET":
+            added = sum(1 for field in args[1::2] if field not in table)
+            table.update(zip(args[1::2], args[2::2]))
+            return added
+        if name == b"HSETNX":
+            if args[1] in table:
+                return 0
+            table[args[1]] = args[2]
+            return 1
+        if name == b"HGET":
+            return table.get(args[1])
+        if name == b"HGETALL":
+            return [item for pair in table.items() for item in pair]
+        if name == b"HDEL":
+            return sum(1 for field in args[1:] if table.pop(field, None) is not None)
+        if name == b"HEXISTS":
+            return int(args[1] in table)
+        if name == b"HINCRBY":
+            value = int(table.get(args[1], b"0")) + int(args[2])
+            table[args[1]] = str(value).encode()
+            return value
+        return Exception(f"unknown command '{name.decode()}'")
+
+    def _eval(self, script: bytes, args: List[bytes]) -> Any:
+        numkeys = int(args[0])
+        keys, argv = args[1:numkeys + 1], args[numkeys + 1:]
+        handler = self._scripts().get(script.decode())
+        if handler is None:
+            return Exception("unknown script")
+        # Runs without yielding, so it is atomic like a script on a real server
+        return handler(keys, argv)
+
+    def _scripts(self) -> Dict[str, Callable[[List[bytes], List[bytes]], Any]]:
+        return {TAKE_OVER_SCRIPT: self._take_over, RELEASE_SCRIPT: self._release}
+
+    def _take_over(self, keys: List[bytes], argv: List[bytes]) -> int:
+        owners = self.hashes.setdefault(keys[0], {})
+        session, owner, previous = argv
+        if owners.get(session) != previous:
+            return 0
+        owners[session] = owner
+        if self._hash_command(b"HEXISTS", [keys[1], previous]):
+            self._hash_command(b"HINCRBY", [keys[1], previous, b"-1"])
+        self._hash_command(b"HINCRBY", [keys[1], owner, b"1"])
+        return 1
+
+    def _release(self, keys: List[bytes], argv: List[bytes]) -> int:
+        owners = self.hashes.setdefault(keys[0], {})
+        session, owner = argv
+        current = owners.get(session)
+        if current is None or (owner and current != owner):
+            return 0
+        del owners[session]
+        self._hash_command(b"HINCRBY", [keys[1], current, b"-1"])
+        return 1
+
+    @staticmethod
+    async def _read_command(reader: asyncio.StreamReader) -> List[bytes] | None:
+        line = await reader.readline()
+        if not line:
+            return None
+        assert line.startswith(b"*"), line
+        args = []
+        for _ in range(int(line[1:])):
+            length = int((await reader.readline())[1:])
+            args.append((await reader.readexactly(length + 2))[:-2])
+        return args
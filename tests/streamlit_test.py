@@ -2,7 +2,8 @@ from unittest import mock
 
 import pytest
 from anthropic.types import TextBlockParam
-from streamlit.testing.v1 import AppTest
+
+AppTest = pytest.importorskip("streamlit.testing.v1").AppTest
 
 from computer_use_demo.streamlit import Sender
 
@@ -0,0 +1,242 @@
+"""
+Tests for AgentService update streaming.
+"""
+
+import asyncio
+import os
+import time
+from unittest import mock
+
+import pytest
+
+from computer_use_demo.tools import ToolResult
+from computer_use_backend.models.schemas import UpdateType
+from computer_use_backend.services import close_shared_http_client
+from computer_use_backend.services.agent_service import AgentService
+
+from .anthropic_stub import StubMessagesServer, text_message
+
+
+@pytest.fixture
+def agent_service():
+    return AgentService("test-session")
+
+
+@pytest.fixture
+async def shared_http_client():
+    yield
+    await close_shared_http_client()
+
+
+def fake_sampling_loop(steps):
+    """Build a sampling_loop replacement that replays `steps` through the callbacks."""
+    async def _loop(*, messages, output_callback, tool_output_callback, **kwargs):
+        for step in steps:
+            if isinstance(step, ToolResult):
+                tool_output_callback(step, "tool-1")
+            elif isinstance(step, float):
+                await asyncio.sleep(step)
+            else:
+                output_callback(step)
+        return messages + [{"role": "assistant", "content": []}]
+    return _loop
+
+
+async def test_updates_are_merged_in_order(agent_service):
+    steps = [
+        {"type": "text", "text": "Looking at the screen"},
+        {"type": "tool_use", "name": "bash", "input": {"command": "ls"}, "id": "tool-1"},
+        ToolResult(output="file.txt"),
+        {"type": "text", "text": "Done"},
+    ]
+    with mock.patch(
+        "computer_use_backend.services.agent_service.sampling_loop",
+        fake_sampling_loop(steps),
+    ):
+        updates = [u async for u in agent_service.process_message("list files")]
+
+    assert [u.update_type for u in updates] == [
+        UpdateType.THINKING,
+        UpdateType.THINKING,
+        UpdateType.TOOL_USE,
+        UpdateType.TOOL_RESULT,
+        UpdateType.THINKING,
+        UpdateType.COMPLETE,
+    ]
+    assert updates[1].content == "Looking at the screen"
+    assert updates[3].metadata["tool_id"] == "tool-1"
+    assert updates[4].content == "Done"
+    assert agent_service.messages[-1]["role"] == "assistant"
+
+
+async def test_tool_result_reports_settle_time(agent_service):
+    steps = [ToolResult(output="clicked", base64_image="png", settle_time=0.31234)]
+    with mock.patch(
+        "computer_use_backend.services.agent_service.sampling_loop",
+        fake_sampling_loop(steps),
+    ):
+        updates = [u async for u in agent_service.process_message("click")]
+
+    tool_result = next(u for u in updates if u.update_type == UpdateType.TOOL_RESULT)
+    assert tool_result.metadata["settle_time"] == 0.312
+    assert tool_result.metadata["has_screenshot"]
+
+
+async def test_updates_are_delivered_without_polling_delay(agent_service):
+    steps = [0.2, {"type": "text", "text": "late block"}]
+    with mock.patch(
+        "computer_use_backend.services.agent_service.sampling_loop",
+        fake_sampling_loop(steps),
+    ):
+        stream = agent_service.process_message("hello")
+        await stream.__anext__()  # initial status update
+
+        start = time.perf_counter()
+        update = await stream.__anext__()
+        elapsed = time.perf_counter() - start
+        await stream.aclose()
+
+    assert update.content == "late block"
+    # The block is emitted after 0.2s; a polling consumer would add up to 0.25s on top
+    assert elapsed < 0.2 + 0.05
+
+
+async def test_agent_failure_is_reported(agent_service):
+    async def failing_loop(**kwargs):
+        raise RuntimeError("boom")
+
+    with mock.patch(
+        "computer_use_backend.services.agent_service.sampling_loop", failing_loop
+    ):
+        updates = [u async for u in agent_service.process_message("hello")]
+
+    assert updates[-2].update_type == UpdateType.ERROR
+    assert "boom" in updates[-2].content
+    assert updates[-1].update_type == UpdateType.COMPLETE
+
+
+async def test_sessions_share_http_connection_pool(shared_http_client):
+    responses = [text_message("first"), text_message("second")]
+    async with StubMessagesServer(responses) as stub:
+        for session_id in ("session-a", "session-b"):
+            service = AgentService(session_id)
+            service.api_key = "test-key"
+            service.base_url = stub.url
+            updates = [u async for u in service.process_message("hello")]
+            assert updates[-1].update_type == UpdateType.COMPLETE
+
+    assert len(stub.requests) == 2
+    assert stub.connections == 1
+
+
+async def test_streamed_text_arrives_before_turn_completes(shared_http_client):
+    text = "Streaming lets the user read this sentence while it is being written."
+    async with StubMessagesServer([text_message(text)], event_delay=0.01) as stub:
+        service = AgentService("session-stream")
+        service.api_key = "test-key"
+        service.base_url = stub.url
+
+        received = []
+        async for update in service.process_message("hello"):
+            received.append((time.perf_counter(), update))
+
+    deltas = [(t, u) for t, u in received if u.update_type == UpdateType.CONTENT_DELTA]
+    final = next(
+        (t, u) for t, u in received
+        if u.update_type == UpdateType.THINKING and u.content == text
+    )
+    assert "".join(u.content for _, u in deltas) == text
+    assert all(u.metadata["delta_type"] == "text" for _, u in deltas)
+    # The first token is delivered long before the complete block
+    assert final[0] - deltas[0][0] > 0.1
+
+
+async def test_live_tool_output_is_coalesced_before_final_result(agent_service):
+    agent_service.tool_output_flush_interval = 0.05
+
+    async def chatty_loop(*, messages, tool_output_callback, tool_stream_callback, **kwargs):
+        for i in range(200):
+            tool_stream_callback("tool-1", "stdout", f"line {i}\n")
+            if i % 20 == 0:
+                await asyncio.sleep(0.01)
+        tool_output_callback(ToolResult(output="all lines"), "tool-1")
+        return messages
+
+    with mock.patch(
+        "computer_use_backend.services.agent_service.sampling_loop", chatty_loop
+    ):
+        updates = [u async for u in agent_service.process_message("build")]
+
+    tool_updates = [u for u in updates if u.update_type == UpdateType.TOOL_RESULT]
+    partial, final = tool_updates[:-1], tool_updates[-1]
+    assert 1 < len(partial) < 20
+    assert all(u.metadata["partial"] and u.metadata["stream"] == "stdout" for u in partial)
+    assert "".join(u.content for u in partial) == "".join(f"line {i}\n" for i in range(200))
+    assert "partial" not in final.metadata
+    assert "all lines" in final.content
+
+
+async def test_live_tool_output_is_capped_per_update(agent_service):
+    agent_service.tool_output_max_chars = 100
+
+    async def flooding_loop(*, messages, tool_output_callback, tool_stream_callback, **kwargs):
+        tool_stream_callback("tool-1", "stderr", "x" * 1000)
+        tool_stream_callback("tool-1", "stderr", "tail")
+        tool_output_callback(ToolResult(error="failed"), "tool-1")
+        return messages
+
+    with mock.patch(
+        "computer_use_backend.services.agent_service.sampling_loop", flooding_loop
+    ):
+        updates = [u async for u in agent_service.process_message("flood")]
+
+    partial = [u for u in updates if u.metadata.get("partial")]
+    assert len(partial) == 1
+    assert partial[0].content == "x" * 96 + "tail"
+    assert partial[0].metadata["dropped_chars"] == 904
+    assert partial[0].metadata["stream"] == "stderr"
+
+
+async def test_close_terminates_bash_shell(agent_service):
+    result = await agent_service.tool_collection.run(
+        name="bash", tool_input={"command": "echo running"}
+    )
+    assert result.output == "running"
+    bash = agent_service.tool_collection.tool_map["bash"]
+    process = bash._session._process
+
+    await agent_service.close()
+
+    await asyncio.wait_for(process.wait(), timeout=5)
+    assert bash._session is None
+
+
+def test_load_history_builds_alternating_turns(agent_service):
+    agent_service.load_history([
+        {"role": "assistant", "content": "stray reply"},
+        {"role": "user", "content": "open the browser"},
+        {"role": "user", "content": "and go to example.com"},
+        {"role": "assistant", "content": "Done"},
+    ])
+    
+    assert agent_service.messages == [
+        {"role": "user", "content": [
+            {"type": "text", "text": "open the browser"},
+            {"type": "text", "text": "and go to example.com"},
+        ]},
+        {"role": "assistant", "content": [{"type": "text", "text": "Done"}]},
+    ]
+
+
+def test_sessions_keep_their_own_display(monkeypatch):
+    for key in ("DISPLAY_NUM", "XVFB_FBDIR", "WIDTH", "HEIGHT"):
+        monkeypatch.delenv(key, raising=False)
+
+    first = AgentService("session-a", display_num=3)
+    second = AgentService("session-b", display_num=4)
+
+    assert first.tool_collection.tool_map["computer"].display_num == 3
+    assert second.tool_collection.tool_map["computer"].display_num == 4
+    assert "DISPLAY_NUM" not in os.environ
+    first.tool_collection.stop()
+    second.tool_collection.stop()
@@ -1,12 +1,20 @@
+import asyncio
 import pytest
+import time
 import uuid
 import pytest_asyncio
+from unittest import mock
+from datetime import datetime, timedelta
 from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
-from sqlalchemy import select
+from sqlalchemy import event, select
 
+from computer_use_backend.config import get_settings
 from computer_use_backend.models.database import Base, Session, Message
 from computer_use_backend.models.schemas import SessionCreate, MessageCreate, MessageRole
-from computer_use_backend.services.session_manager import SessionManager
+from computer_use_backend.services.message_writer import MessageWriter
+from computer_use_backend.services.session_cache import LiveSessionCache
+from computer_use_backend.services.session_manager import SessionManager, encode_message_cursor, encode_session_cursor
+from computer_use_backend.services.worker import Worker, WorkerPool
 
 # Use in-memory SQLite for tests
 TEST_DATABASE_URL = "sqlite+aiosqlite:///:memory:"
@@ -113,3 +121,469 @@ async def test_session_terminate(db_session):
     # But should still get retrieved directly
     retrieved = await manager.get_session(db_session, session_id)
     assert retrieved.status == "terminated"
+
+@pytest.mark.asyncio
+async def test_session_owner_is_recorded(db_session):
+    """Test storing the owning process in Session.worker_id."""
+    manager = SessionManager()
+    session = await manager.create_session(db_session, SessionCreate(), worker_id="node-a:1")
+    assert session.worker_id == "node-a:1"
+    
+    session_id = str(session.session_id)
+    await manager.record_owner(db_session, session_id, "node-b:2")
+    db_session.expire_all()
+    
+    retrieved = await manager.get_session(db_session, session_id)
+    assert retrieved.worker_id == "node-b:2"
+
+async def add_messages(db_session, session_id, count, start=None):
+    """Insert messages one second apart, with every other pair sharing a timestamp."""
+    start = start or datetime(2026, 1, 1, 12, 0, 0)
+    for i in range(count):
+        db_session.add(Message(
+            session_id=uuid.UUID(session_id),
+            role="user",
+            content=f"m{i}",
+            timestamp=start + timedelta(seconds=i // 2),
+        ))
+    await db_session.commit()
+
+@pytest.mark.asyncio
+async def test_message_pages_walk_the_history(db_session):
+    """Test keyset pagination backwards and forwards through a session's messages."""
+    manager = SessionManager()
+    session = await manager.create_session(db_session, SessionCreate())
+    session_id = str(session.session_id)
+    other = await manager.create_session(db_session, SessionCreate())
+    await add_messages(db_session, session_id, 25)
+    await add_messages(db_session, str(other.session_id), 5)
+    everything = await manager.get_message_page(db_session, session_id, 1000)
+    expected = [m.message_id for m in everything[0]]
+    assert len(expected) == 25
+    
+    # Latest page first, then page backwards with the first message's cursor
+    latest, has_more = await manager.get_message_page(db_session, session_id, 10)
+    assert [m.message_id for m in latest] == expected[-10:]
+    assert has_more
+    seen = latest
+    while has_more:
+        page, has_more = await manager.get_message_page(
+            db_session, session_id, 10, before=encode_message_cursor(seen[0])
+        )
+        seen = page + seen
+    assert [m.message_id for m in seen] == expected
+    
+    # Forwards from a cursor, with nothing newer past the last page
+    page, has_more = await manager.get_message_page(
+        db_session, session_id, 10, after=encode_message_cursor(seen[14])
+    )
+    assert [m.message_id for m in page] == expected[15:25]
+    assert not has_more
+    
+    page, _ = await manager.get_message_page(
+        db_session, session_id, 100, since=datetime(2026, 1, 1, 12, 0, 10)
+    )
+    assert [m.message_id for m in page] == expected[20:]
+
+@pytest.mark.asyncio
+async def test_message_page_rejects_bad_cursors(db_session):
+    """Test that malformed cursors raise ValueError."""
+    manager = SessionManager()
+    session = await manager.create_session(db_session, SessionCreate())
+    
+    with pytest.raises(ValueError):
+        await manager.get_message_page(db_session, str(session.session_id), 10, before="not-a-cursor")
+
+@pytest.mark.asyncio
+async def test_latest_page_reads_the_composite_index(db_session):
+    """Test that the latest page is an index range scan rather than a sort of the session."""
+    manager = SessionManager()
+    session = await manager.create_session(db_session, SessionCreate())
+    await add_messages(db_session, str(session.session_id), 10)
+    
+    plans = []
+    
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith("SELECT") and "messages" in statement:
+            plans.append(conn.exec_driver_sql("EXPLAIN QUERY PLAN " + statement, parameters).fetchall())
+    
+    engine = db_session.bind.sync_engine
+    event.listen(engine, "before_cursor_execute", capture)
+    try:
+        await manager.get_message_page(db_session, str(session.session_id), 5)
+    finally:
+        event.remove(engine, "before_cursor_execute", capture)
+    
+    plan = " ".join(str(row) for row in plans[0])
+    assert "ix_messages_session_timestamp_id" in plan
+    assert "TEMP B-TREE" not in plan
+
+@pytest.mark.asyncio
+async def test_session_pages_and_filters(db_session):
+    """Test keyset pagination and filtering of the session listing."""
+    manager = SessionManager()
+    start = datetime(2026, 1, 1, 12, 0, 0)
+    for i in range(12):
+        db_session.add(Session(
+            status="terminated" if i % 4 == 0 else "active",
+            created_at=start + timedelta(minutes=i // 2),
+            session_metadata={"n": i},
+        ))
+    await db_session.commit()
+    
+    seen, before, has_more = [], None, True
+    while has_more:
+        page, has_more = await manager.get_session_page(db_session, 4, before=before)
+        seen += page
+        before = encode_session_cursor(page[-1])
+    assert sorted(s.session_metadata["n"] for s in seen) == [1, 2, 3, 5, 6, 7, 9, 10, 11]
+    assert [s.created_at for s in seen] == sorted((s.created_at for s in seen), reverse=True)
+    
+    terminated, _ = await manager.get_session_page(db_session, 10, statuses=["terminated"])
+    assert [s.session_metadata["n"] for s in terminated] == [8, 4, 0]
+    
+    window, _ = await manager.get_session_page(
+        db_session, 10,
+        created_after=start + timedelta(minutes=1),
+        created_before=start + timedelta(minutes=3),
+    )
+    assert sorted(s.session_metadata["n"] for s in window) == [2, 3, 5]
+    
+    assert await manager.summarize_sessions(db_session) == {"active": 9}
+    assert await manager.summarize_sessions(
+        db_session, statuses=["active", "terminated"]
+    ) == {"active": 9, "terminated": 3}
+
+def count_statements(db_session):
+    statements = []
+    
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+    
+    event.listen(db_session.bind.sync_engine, "before_cursor_execute", capture)
+    return statements
+
+@pytest.mark.asyncio
+async def test_message_insert_is_one_statement(db_session):
+    """Test that creating a message is a single existence-checked INSERT ... RETURNING."""
+    manager = SessionManager()
+    session = await manager.create_session(db_session, SessionCreate())
+    statements = count_statements(db_session)
+    
+    message = await manager.create_message(
+        db_session, str(session.session_id), MessageCreate(content="Hello", message_metadata={"k": 1})
+    )
+    
+    assert len(statements) == 1
+    assert statements[0].lstrip().upper().startswith("INSERT")
+    assert message.content == "Hello"
+    assert message.message_metadata == {"k": 1}
+    assert message.timestamp is not None
+    
+    with pytest.raises(ValueError, match="not found"):
+        await manager.create_message(db_session, str(uuid.uuid4()), MessageCreate(content="Hello"))
+    assert len(await manager.get_session_messages(db_session, str(session.session_id))) == 1
+
+@pytest.mark.asyncio
+async def test_live_sessions_are_cached_until_terminated(db_session):
+    """Test that session checks hit the cache and terminating a session invalidates it."""
+    manager = SessionManager(session_cache=LiveSessionCache(ttl=60, max_size=10))
+    session = await manager.create_session(db_session, SessionCreate(), worker_id="node-a:1")
+    session_id = str(session.session_id)
+    
+    assert (await manager.check_session(db_session, session_id)).owner == "node-a:1"
+    statements = count_statements(db_session)
+    assert (await manager.check_session(db_session, session_id)).owner == "node-a:1"
+    assert statements == []
+    
+    await manager.record_owner(db_session, session_id, "node-b:2")
+    assert (await manager.check_session(db_session, session_id)).owner == "node-b:2"
+    
+    await manager.terminate_session(db_session, session_id)
+    statements.clear()
+    # Terminated sessions still exist but are looked up every time
+    assert await manager.check_session(db_session, session_id) is not None
+    assert await manager.check_session(db_session, session_id) is not None
+    assert len(statements) == 2
+    assert await manager.check_session(db_session, str(uuid.uuid4())) is None
+
+def test_live_session_cache_expires_and_evicts():
+    """Test TTL expiry and LRU eviction of the live-session cache."""
+    cache = LiveSessionCache(ttl=60, max_size=2)
+    cache.put("a", None)
+    cache.put("b", None)
+    cache.get("a")
+    cache.put("c", None)
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+    
+    with mock.patch("computer_use_backend.services.session_cache.time.monotonic", return_value=time.monotonic() + 61):
+        assert cache.get("a") is None
+    assert cache.stats()["size"] == 1
+
+def make_writer(db_session, **kwargs) -> MessageWriter:
+    """A MessageWriter on the test database."""
+    return MessageWriter(async_sessionmaker(db_session.bind, expire_on_commit=False), **kwargs)
+
+@pytest.mark.asyncio
+async def test_message_writer_batches_sessions_together(db_session):
+    """Test that concurrent writes from several sessions share one INSERT and commit."""
+    manager = SessionManager()
+    session_ids = [str((await manager.create_session(db_session, SessionCreate())).session_id) for _ in range(3)]
+    writer = make_writer(db_session, batch_size=100, flush_interval=0.01)
+    
+    messages = await asyncio.gather(*(
+        writer.write(session_id, MessageCreate(content=f"{session_id}-{i}"))
+        for i in range(4)
+        for session_id in session_ids
+    ))
+    
+    assert writer.stats()["batches"] == 1
+    assert writer.stats()["rows"] == 12
+    assert writer.stats()["pending"] == 0
+    for session_id in session_ids:
+        stored = await manager.get_session_messages(db_session, session_id)
+        assert [m.content for m in stored] == [f"{session_id}-{i}" for i in range(4)]
+    assert {m.message_id for m in messages} == {
+        m.message_id for s in session_ids for m in await manager.get_session_messages(db_session, s)
+    }
+    await writer.close()
+
+@pytest.mark.asyncio
+async def test_message_writer_flushes_full_batches_without_waiting(db_session):
+    """Test that a full batch is written before the flush interval is up."""
+    manager = SessionManager()
+    session_id = str((await manager.create_session(db_session, SessionCreate())).session_id)
+    writer = make_writer(db_session, batch_size=5, flush_interval=60)
+    
+    for i in range(6):
+        await writer.submit(session_id, MessageCreate(content=str(i)))
+    for _ in range(100):
+        if writer.stats()["batches"]:
+            break
+        await asyncio.sleep(0.01)
+    
+    assert writer.stats()["rows"] == 5
+    assert [m.content for m in writer.pending(session_id)] == ["5"]
+    await writer.close()
+
+@pytest.mark.asyncio
+async def test_message_pages_include_buffered_messages(db_session):
+    """Test that buffered messages are read back, in order and only once, before and after they land."""
+    manager = SessionManager()
+    session_id = str((await manager.create_session(db_session, SessionCreate())).session_id)
+    for i in range(3):
+        await manager.create_message(db_session, session_id, MessageCreate(content=f"stored {i}"))
+    writer = make_writer(db_session, flush_interval=60)
+    for i in range(3):
+        await writer.submit(session_id, MessageCreate(content=f"buffered {i}", role=MessageRole.ASSISTANT))
+    expected = [f"stored {i}" for i in range(3)] + [f"buffered {i}" for i in range(3)]
+    
+    async def page(**kwargs):
+        messages, has_more = await manager.get_message_page(
+            db_session, session_id, pending=writer.pending(session_id), **kwargs
+        )
+        return [m.content for m in messages], has_more
+    
+    assert await page(limit=10) == (expected, False)
+    latest, has_more = await manager.get_message_page(
+        db_session, session_id, 4, pending=writer.pending(session_id)
+    )
+    assert [m.content for m in latest] == expected[2:]
+    assert has_more
+    assert await page(limit=10, before=encode_message_cursor(latest[0])) == (expected[:2], False)
+    assert await page(limit=2, after=encode_message_cursor(latest[0])) == (expected[3:5], True)
+    
+    await writer.flush()
+    assert writer.pending(session_id) == []
+    assert await page(limit=10) == (expected, False)
+    # A batch that commits between taking the pending rows and the query isn't doubled
+    messages, _ = await manager.get_message_page(db_session, session_id, 10, pending=latest)
+    assert [m.content for m in messages] == expected
+    await writer.close()
+
+@pytest.mark.asyncio
+async def test_message_writer_close_writes_out_the_buffer(db_session):
+    """Test that closing the writer commits everything still buffered."""
+    manager = SessionManager()
+    session_id = str((await manager.create_session(db_session, SessionCreate())).session_id)
+    writer = make_writer(db_session, flush_interval=60)
+    for i in range(250):
+        await writer.submit(session_id, MessageCreate(content=str(i)))
+    
+    await writer.close()
+    
+    assert len(await manager.get_session_messages(db_session, session_id)) == 250
+    assert writer.stats()["pending"] == 0
+    with pytest.raises(RuntimeError, match="closed"):
+        await writer.submit(session_id, MessageCreate(content="late"))
+
+@pytest.mark.asyncio
+async def test_message_writer_fails_only_rejected_rows(db_session):
+    """Test that a row the database rejects fails on its own and the rest of its batch is kept."""
+    manager = SessionManager()
+    session_id = str((await manager.create_session(db_session, SessionCreate())).session_id)
+    existing = await manager.create_message(db_session, session_id, MessageCreate(content="first"))
+    writer = make_writer(db_session, flush_interval=60)
+    
+    writes = [
+        asyncio.create_task(writer.write(session_id, MessageCreate(content=content)))
+        for content in ("ok 1", "duplicate", "ok 2")
+    ]
+    await asyncio.sleep(0)
+    writer.pending(session_id)[1].message_id = existing.message_id
+    await writer.flush()
+    results = await asyncio.gather(*writes, return_exceptions=True)
+    
+    assert isinstance(results[1], ValueError)
+    assert [r.content for r in (results[0], results[2])] == ["ok 1", "ok 2"]
+    stored = await manager.get_session_messages(db_session, session_id)
+    assert [m.content for m in stored] == ["first", "ok 1", "ok 2"]
+    assert writer.stats()["failed_rows"] == 1
+    await writer.close()
+
+@pytest.mark.asyncio
+async def test_message_writer_retries_submitted_rows_through_an_outage(db_session):
+    """Test that waiting writers fail fast while the database is down and buffered replies are kept."""
+    manager = SessionManager()
+    session_id = str((await manager.create_session(db_session, SessionCreate())).session_id)
+    writer = make_writer(db_session, flush_interval=60)
+    connect = writer.session_factory
+    calls = []
+    
+    def flaky_factory():
+        calls.append(1)
+        if len(calls) == 1:
+            raise ConnectionError("database is down")
+        return connect()
+    
+    writer.session_factory = flaky_factory
+    await writer.submit(session_id, MessageCreate(content="reply", role=MessageRole.ASSISTANT))
+    write = asyncio.create_task(writer.write(session_id, MessageCreate(content="question")))
+    await asyncio.sleep(0)
+    
+    with pytest.raises(RuntimeError):
+        await writer.flush()
+    with pytest.raises(RuntimeError, match="database is down"):
+        await write
+    assert [m.content for m in writer.pending(session_id)] == ["reply"]
+    
+    await writer.flush()
+    assert [m.content for m in await manager.get_session_messages(db_session, session_id)] == ["reply"]
+    await writer.close()
+
+@pytest.mark.asyncio
+async def test_message_writer_close_waits_for_the_batch_being_written(db_session):
+    """Test that closing the writer during a slow insert neither loses nor strands that batch."""
+    manager = SessionManager()
+    session_id = str((await manager.create_session(db_session, SessionCreate())).session_id)
+    writer = make_writer(db_session, flush_interval=0)
+    insert = writer._insert
+    
+    async def slow_insert(messages):
+        await asyncio.sleep(0.2)
+        await insert(messages)
+    
+    writer._insert = slow_insert
+    for i in range(4):
+        await writer.submit(session_id, MessageCreate(content=str(i)))
+    write = asyncio.create_task(writer.write(session_id, MessageCreate(content="4")))
+    for _ in range(100):
+        if writer._in_flight:
+            break
+        await asyncio.sleep(0.01)
+    assert len(writer._in_flight) == 5
+    
+    await writer.close()
+    
+    assert (await asyncio.wait_for(write, 1)).content == "4"
+    stored = await manager.get_session_messages(db_session, session_id)
+    assert [m.content for m in stored] == [str(i) for i in range(5)]
+
+@pytest.mark.asyncio
+async def test_session_keeps_its_conversation_after_its_worker_is_evicted(db_session, monkeypatch):
+    """Test that a message sent after eviction reaches an agent that has the earlier turns."""
+    async def no_vnc(self):
+        pass
+    
+    # Run the mock agent
+    monkeypatch.setattr(get_settings(), "anthropic_api_key", "")
+    with mock.patch.object(Worker, "_init_vnc", no_vnc):
+        pool = WorkerPool()
+        pool.warm_pool_size = 0
+        pool.max_workers = 1
+        manager = SessionManager(worker_pool=pool)
+        try:
+            session_id = str((await manager.create_session(db_session, SessionCreate())).session_id)
+            other_id = str((await manager.create_session(db_session, SessionCreate())).session_id)
+            with mock.patch.object(manager, "get_message_page") as get_message_page:
+                first = await manager.get_or_create_worker(session_id, db=db_session)
+            # A session's first worker has no history to look up
+            get_message_page.assert_not_called()
+            await manager.create_message(db_session, session_id, MessageCreate(content="my name is Ada"))
+            await manager.create_message(
+                db_session, session_id, MessageCreate(content="Nice to meet you", role=MessageRole.ASSISTANT)
+            )
+            
+            # The only slot goes to another session, evicting the idle worker
+            await manager.get_or_create_worker(other_id, db=db_session)
+            assert first.status == "terminated"
+            
+            worker = await manager.get_or_create_worker(session_id, db=db_session)
+            assert worker is not first
+            async for _ in worker.process_message("what is my name?"):
+                pass
+            
+            assert worker.agent_service.get_conversation_history() == [
+                {"role": "user", "content": "my name is Ada"},
+                {"role": "assistant", "content": "Nice to meet you"},
+                {"role": "user", "content": "what is my name?"},
+            ]
+        finally:
+            await pool.cleanup_all()
+
+@pytest.mark.asyncio
+async def test_message_writer_does_not_rewrite_a_batch_cancelled_during_commit(db_session):
+    """Test that a batch whose commit may have gone through is failed, not written twice."""
+    manager = SessionManager()
+    session_id = str((await manager.create_session(db_session, SessionCreate())).session_id)
+    writer = make_writer(db_session, flush_interval=0)
+    committed = asyncio.Event()
+    commit = AsyncSession.commit
+    
+    async def slow_commit(self):
+        await commit(self)
+        committed.set()
+        await asyncio.sleep(1)
+    
+    with mock.patch.object(AsyncSession, "commit", slow_commit):
+        write = asyncio.create_task(writer.write(session_id, MessageCreate(content="once")))
+        await asyncio.wait_for(committed.wait(), 1)
+        writer._task.cancel()
+        with pytest.raises(RuntimeError, match="interrupted"):
+            await write
+    await writer.close()
+    
+    stored = await manager.get_session_messages(db_session, session_id)
+    assert [m.content for m in stored] == ["once"]
+
+@pytest.mark.asyncio
+async def test_message_writer_drops_messages_for_unknown_sessions(db_session):
+    """Test that a message for a session that doesn't exist fails without failing its batch."""
+    manager = SessionManager()
+    session_id = str((await manager.create_session(db_session, SessionCreate())).session_id)
+    writer = make_writer(db_session, flush_interval=60)
+    
+    writes = [
+        asyncio.create_task(writer.write(sid, MessageCreate(content="hi")))
+        for sid in (session_id, str(uuid.uuid4()))
+    ]
+    await asyncio.sleep(0)
+    await writer.flush()
+    results = await asyncio.gather(*writes, return_exceptions=True)
+    
+    assert results[0].content == "hi"
+    assert isinstance(results[1], ValueError)
+    assert len(await manager.get_session_messages(db_session, session_id)) == 1
+    assert writer.stats()["failed_rows"] == 1
+    await writer.close()
@@ -0,0 +1,113 @@
+"""
+Tests for display and VNC port allocation.
+"""
+
+import os
+import socket
+import subprocess
+from unittest import mock
+
+import pytest
+
+from computer_use_backend.services.display_allocator import DisplayAllocator, DisplaysExhausted
+from computer_use_backend.services.worker import Worker
+
+
+def free_port_base(size: int) -> int:
+    """A port base whose first `size` display ports are all free."""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    return min(port, 60000) - 100
+
+
+@pytest.fixture
+def allocator(tmp_path):
+    return DisplayAllocator(100, free_port_base(4), 4, lock_dir=str(tmp_path))
+
+
+def dead_pid() -> int:
+    process = subprocess.Popen(["true"])
+    process.wait()
+    return process.pid
+
+
+def test_slots_are_unique_and_map_display_to_port(allocator):
+    slots = [allocator.acquire() for _ in range(4)]
+
+    assert [s.display_num for s in slots] == [100, 101, 102, 103]
+    assert all(s.vnc_port == allocator.port_base + s.display_num for s in slots)
+    with pytest.raises(DisplaysExhausted):
+        allocator.acquire()
+
+
+def test_released_slot_is_reused_first(allocator):
+    first, second, _ = (allocator.acquire() for _ in range(3))
+    allocator.release(second)
+    allocator.release(second)
+
+    assert allocator.in_use == 2
+    assert allocator.acquire() == second
+    allocator.release(first)
+    assert allocator.acquire() == first
+
+
+def test_stale_lock_is_removed(allocator, tmp_path):
+    lock = tmp_path / ".X100-lock"
+    lock.write_text(f"{dead_pid():>10}\n")
+    (tmp_path / ".X11-unix").mkdir()
+    (tmp_path / ".X11-unix" / "X100").touch()
+
+    slot = allocator.acquire()
+
+    assert slot.display_num == 100
+    assert not lock.exists()
+    assert not (tmp_path / ".X11-unix" / "X100").exists()
+    assert allocator.stats()["stale_locks_removed"] == 1
+
+
+def test_display_held_by_live_process_is_skipped(allocator, tmp_path):
+    (tmp_path / ".X100-lock").write_text(f"{os.getpid():>10}\n")
+
+    slot = allocator.acquire()
+
+    assert slot.display_num == 101
+    assert (tmp_path / ".X100-lock").exists()
+    # The held slot stays free and is retried later
+    assert [allocator.acquire().display_num for _ in range(2)] == [102, 103]
+    with pytest.raises(DisplaysExhausted):
+        allocator.acquire()
+
+
+def test_port_in_use_is_skipped(allocator):
+    with socket.socket() as sock:
+        sock.bind(("0.0.0.0", allocator.port_base + 100))
+        sock.listen()
+        assert allocator.acquire().display_num == 101
+
+
+async def test_worker_releases_display_when_vnc_fails(allocator):
+    with mock.patch(
+        "computer_use_backend.services.worker.VNCServer.start",
+        side_effect=RuntimeError("Xvfb not found"),
+    ):
+        worker = Worker("session-1", displays=allocator)
+        await worker._init_vnc()
+
+    assert worker.vnc_server is None
+    assert worker.display_num is None
+    assert allocator.in_use == 0
+
+
+async def test_workers_get_distinct_displays(allocator):
+    with mock.patch("computer_use_backend.services.worker.VNCServer.start"):
+        workers = [Worker(f"session-{i}", displays=allocator) for i in range(3)]
+        for worker in workers:
+            await worker._init_vnc()
+
+    assert len({w.display_num for w in workers}) == 3
+    assert len({w.vnc_port for w in workers}) == 3
+
+    for worker in workers:
+        await worker._cleanup_vnc()
+    assert allocator.in_use == 0
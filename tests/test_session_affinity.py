@@ -0,0 +1,331 @@
+"""
+Tests for placing sessions on nodes and routing their requests to the owner.
+"""
+
+import asyncio
+import time
+from types import SimpleNamespace
+
+import httpx
+import pytest
+from fastapi import FastAPI, Request, WebSocket
+from fastapi.testclient import TestClient
+from starlette.testclient import WebSocketDenialResponse
+
+from computer_use_backend.services.session_affinity import (
+    FORWARD_SECRET_HEADER,
+    FORWARDED_HEADER,
+    SessionAffinity,
+)
+from computer_use_backend.services.worker_registry import (
+    InMemoryWorkerRegistry,
+    NodeInfo,
+    RedisWorkerRegistry,
+)
+
+from .redis_stub import StubRedisServer
+
+
+def fake_pool(max_workers=10, workers=0):
+    return SimpleNamespace(
+        max_workers=max_workers,
+        active_slots=workers,
+        queued=0,
+    )
+
+
+def make_node(registry, owner, address=None, client=None, forward_secret=None, **pool):
+    affinity = SessionAffinity(registry, fake_pool(**pool), client=client)
+    affinity.owner_id = owner
+    affinity.address = address
+    affinity.forward_secret = forward_secret
+    return affinity
+
+
+def owner_app():
+    """Stands in for the node that owns the session."""
+    app = FastAPI()
+
+    @app.post("/sessions/{session_id}/messages", status_code=201)
+    async def create_message(session_id: str, request: Request):
+        return {
+            "handled_by": "owner",
+            "forwarded_by": request.headers.get(FORWARDED_HEADER),
+            "secret": request.headers.get(FORWARD_SECRET_HEADER),
+            "body": await request.json(),
+            "query": dict(request.query_params),
+        }
+
+    return app
+
+
+def front_app(affinity):
+    """The node the load balancer happened to pick."""
+    app = FastAPI()
+
+    @app.post("/sessions/{session_id}/messages", status_code=201)
+    async def create_message(session_id: str, request: Request):
+        forwarded = await affinity.route(request, session_id, claim=True)
+        if forwarded is not None:
+            return forwarded
+        return {"handled_by": "front"}
+
+    return app
+
+
+@pytest.fixture
+async def registry():
+    async with StubRedisServer() as broker:
+        registry = RedisWorkerRegistry(broker.url, node_ttl=15)
+        yield registry
+        await registry.close()
+
+
+async def post(app, path, json=None, **kwargs):
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://front") as client:
+        return await client.post(path, json=json or {"content": "hi"}, **kwargs)
+
+
+async def test_registry_tracks_owners_and_session_counts(registry):
+    await registry.heartbeat(NodeInfo("a:1", None, capacity=10, updated_at=time.time()))
+
+    assert await registry.claim("s1", "a:1") == "a:1"
+    assert await registry.claim("s1", "b:2") == "a:1"
+    assert await registry.claim("s2", "a:1") == "a:1"
+    assert [n.sessions for n in await registry.nodes()] == [2]
+
+    await registry.release("s1")
+    await registry.release("s1")
+    assert await registry.owner_of("s1") is None
+    assert [n.sessions for n in await registry.nodes()] == [1]
+
+
+async def test_stale_nodes_are_dropped(registry):
+    await registry.heartbeat(NodeInfo("a:1", None, capacity=10, updated_at=time.time()))
+    await registry.heartbeat(NodeInfo("b:2", None, capacity=10, updated_at=time.time() - 60))
+
+    assert [n.owner for n in await registry.nodes()] == ["a:1"]
+
+
+async def test_new_sessions_go_to_least_loaded_node(registry):
+    busy = make_node(registry, "a:1", max_workers=10, workers=8)
+    idle = make_node(registry, "b:2", max_workers=10, workers=1)
+    await busy.start()
+    await idle.start()
+
+    assert await busy.place_session("s1") == "b:2"
+    assert await registry.owner_of("s1") == "b:2"
+
+    await busy.close()
+    await idle.close()
+
+
+async def test_ties_spread_by_assigned_sessions(registry):
+    a = make_node(registry, "a:1")
+    b = make_node(registry, "b:2")
+    await a.start()
+    await b.start()
+
+    owners = [await a.place_session(f"s{i}") for i in range(4)]
+
+    assert sorted(owners) == ["a:1", "a:1", "b:2", "b:2"]
+    await a.close()
+    await b.close()
+
+
+async def test_request_is_forwarded_to_owner(registry):
+    owner = make_node(registry, "b:2", address="http://node-b")
+    await owner.start()
+    client = httpx.AsyncClient(transport=httpx.ASGITransport(app=owner_app()))
+    front = make_node(registry, "a:1", client=client, forward_secret="s3cret")
+    await registry.claim("s1", "b:2")
+
+    response = await post(
+        front_app(front),
+        "/sessions/s1/messages?x=1",
+        json={"content": "hello"},
+        headers={FORWARD_SECRET_HEADER: "guess"},
+    )
+
+    assert response.status_code == 201
+    assert response.headers["x-session-owner"] == "b:2"
+    assert response.json() == {
+        "handled_by": "owner",
+        "forwarded_by": "a:1",
+        "secret": "s3cret",
+        "body": {"content": "hello"},
+        "query": {"x": "1"},
+    }
+    assert front.forwarded == 1
+    await client.aclose()
+    await owner.close()
+
+
+async def test_unowned_session_is_claimed_locally(registry):
+    front = make_node(registry, "a:1")
+
+    response = await post(front_app(front), "/sessions/s1/messages")
+
+    assert response.json() == {"handled_by": "front"}
+    assert await registry.owner_of("s1") == "a:1"
+
+
+async def test_forwarded_request_is_never_forwarded_again(registry):
+    owner = make_node(registry, "b:2", address="http://node-b")
+    await owner.start()
+    await registry.claim("s1", "b:2")
+    front = make_node(registry, "a:1", forward_secret="s3cret")
+
+    response = await post(
+        front_app(front),
+        "/sessions/s1/messages",
+        headers={FORWARDED_HEADER: "c:3", FORWARD_SECRET_HEADER: "s3cret"},
+    )
+
+    assert response.json() == {"handled_by": "front"}
+    await owner.close()
+
+
+@pytest.mark.parametrize("secret", [None, "guess"])
+async def test_forwarded_header_without_the_secret_is_still_routed(registry, secret):
+    owner = make_node(registry, "b:2", address="http://node-b")
+    await owner.start()
+    await registry.claim("s1", "b:2")
+    front = make_node(registry, "a:1", forward_secret="s3cret")
+    front.forwarding = False
+    headers = {FORWARDED_HEADER: "c:3"}
+    if secret:
+        headers[FORWARD_SECRET_HEADER] = secret
+
+    response = await post(front_app(front), "/sessions/s1/messages", headers=headers)
+
+    assert response.status_code == 307
+    assert response.headers["x-session-owner"] == "b:2"
+    await owner.close()
+
+
+async def test_redirect_hint_when_forwarding_is_off(registry):
+    owner = make_node(registry, "b:2", address="http://node-b:8000")
+    await owner.start()
+    await registry.claim("s1", "b:2")
+    front = make_node(registry, "a:1")
+    front.forwarding = False
+
+    response = await post(front_app(front), "/sessions/s1/messages?x=1")
+
+    assert response.status_code == 307
+    assert response.headers["location"] == "http://node-b:8000/sessions/s1/messages?x=1"
+    assert response.headers["x-session-owner"] == "b:2"
+    await owner.close()
+
+
+async def test_owner_without_address_gets_misdirected_hint(registry):
+    owner = make_node(registry, "b:2")
+    await owner.start()
+    await registry.claim("s1", "b:2")
+    front = make_node(registry, "a:1")
+
+    response = await post(front_app(front), "/sessions/s1/messages")
+
+    assert response.status_code == 421
+    assert response.json()["owner"] == "b:2"
+    await owner.close()
+
+
+async def test_unreachable_owner_returns_503(registry):
+    owner = make_node(registry, "b:2", address="http://127.0.0.1:9")
+    await owner.start()
+    await registry.claim("s1", "b:2")
+    front = make_node(registry, "a:1")
+
+    response = await post(front_app(front), "/sessions/s1/messages")
+
+    assert response.status_code == 503
+    assert "retry-after" in response.headers
+    await front.close()
+    await owner.close()
+
+
+async def test_session_of_dead_node_is_taken_over(registry):
+    await registry.heartbeat(NodeInfo("b:2", "http://node-b", capacity=10, updated_at=time.time() - 60))
+    await registry.claim("s1", "b:2")
+    front = make_node(registry, "a:1")
+
+    response = await post(front_app(front), "/sessions/s1/messages")
+
+    assert response.json() == {"handled_by": "front"}
+    assert await registry.owner_of("s1") == "a:1"
+    assert front.taken_over == 1
+
+
+async def test_racing_take_overs_have_one_winner(registry):
+    await registry.heartbeat(NodeInfo("a:1", None, capacity=10, updated_at=time.time()))
+    await registry.heartbeat(NodeInfo("b:2", None, capacity=10, updated_at=time.time()))
+    await registry.heartbeat(NodeInfo("c:3", None, capacity=10, updated_at=time.time()))
+    await registry.claim("s1", "c:3")
+
+    won = await asyncio.gather(
+        registry.take_over("s1", "a:1", "c:3"),
+        registry.take_over("s1", "b:2", "c:3"),
+    )
+
+    assert sorted(won) == [False, True]
+    winner = "a:1" if won[0] else "b:2"
+    assert await registry.owner_of("s1") == winner
+    counts = {n.owner: n.sessions for n in await registry.nodes()}
+    assert counts == {"a:1": int(won[0]), "b:2": int(won[1]), "c:3": 0}
+
+
+async def test_release_only_removes_the_expected_owner(registry):
+    await registry.heartbeat(NodeInfo("a:1", None, capacity=10, updated_at=time.time()))
+    await registry.claim("s1", "a:1")
+
+    await registry.release("s1", owner="b:2")
+    assert await registry.owner_of("s1") == "a:1"
+    await registry.release("s1", owner="a:1")
+    assert await registry.owner_of("s1") is None
+    assert [n.sessions for n in await registry.nodes()] == [0]
+
+
+def test_websocket_for_another_node_gets_owner_hint():
+    registry = InMemoryWorkerRegistry(node_ttl=15)
+    owner = make_node(registry, "b:2", address="http://node-b")
+    front = make_node(registry, "a:1")
+
+    async def setup():
+        await registry.heartbeat(owner.node_info())
+        await registry.claim("s1", "b:2")
+
+    asyncio.run(setup())
+    app = FastAPI()
+
+    @app.websocket("/vnc/{session_id}/stream")
+    async def stream(websocket: WebSocket, session_id: str):
+        if await front.route_websocket(websocket, session_id):
+            return
+        await websocket.accept()
+        await websocket.send_text("local")
+        await websocket.close()
+
+    with TestClient(app) as client:
+        with pytest.raises(WebSocketDenialResponse) as denied:
+            with client.websocket_connect("/vnc/s1/stream"):
+                pass
+        with client.websocket_connect("/vnc/s2/stream") as websocket:
+            assert websocket.receive_text() == "local"
+
+    assert denied.value.status_code == 307
+    assert denied.value.headers["location"] == "ws://node-b/vnc/s1/stream"
+    assert denied.value.headers["x-session-owner"] == "b:2"
+
+
+async def test_in_memory_registry_keeps_everything_local():
+    registry = InMemoryWorkerRegistry(node_ttl=15)
+    node = make_node(registry, "a:1")
+    await node.start()
+
+    assert await node.place_session("s1") == "a:1"
+    assert await node.resolve("s1") is None
+    await node.close()
+
@@ -0,0 +1,278 @@
+"""
+Tests for StreamHandler broadcasting.
+"""
+
+import asyncio
+import json
+from datetime import datetime
+from unittest import mock
+
+from computer_use_backend.models.schemas import AgentUpdate, UpdateType
+from computer_use_backend.services import stream_handler as stream_handler_module
+from computer_use_backend.services.stream_handler import StreamHandler
+
+
+class FakeWebSocket:
+    def __init__(self, delay=0.0, fail=False):
+        self.delay = delay
+        self.fail = fail
+        self.sent = []
+        self.closed_with = None
+        # Cleared to simulate a client that stopped reading
+        self.reading = asyncio.Event()
+        self.reading.set()
+
+    async def send_text(self, data):
+        if self.fail:
+            raise RuntimeError("socket closed")
+        await asyncio.sleep(self.delay)
+        await self.reading.wait()
+        self.sent.append(data)
+
+    async def close(self, code=1000, reason=None):
+        self.closed_with = code
+
+
+def make_update(content="hello", update_type=UpdateType.THINKING, **metadata):
+    return AgentUpdate(
+        update_type=update_type,
+        content=content,
+        timestamp=datetime(2024, 1, 1),
+        metadata=metadata or {"status": "processing"},
+    )
+
+
+def contents(ws):
+    return [json.loads(frame).get("content", json.loads(frame).get("count")) for frame in ws.sent]
+
+
+async def stalled_client(handler, policy, queue_size=3):
+    handler.slow_client_policy = policy
+    handler.client_queue_size = queue_size
+    ws = FakeWebSocket()
+    await handler.register_client("s1", ws)
+    ws.reading.clear()
+    # The first frame is picked up by the writer and blocks in send
+    await handler.broadcast_update("s1", make_update("in-flight"))
+    await asyncio.sleep(0)
+    return ws
+
+
+async def test_update_is_serialized_once_for_all_clients():
+    handler = StreamHandler()
+    clients = [FakeWebSocket() for _ in range(5)]
+    for ws in clients:
+        await handler.register_client("s1", ws)
+
+    with mock.patch.object(
+        stream_handler_module, "encode_update", wraps=stream_handler_module.encode_update
+    ) as encode:
+        await handler.broadcast_update("s1", make_update())
+        await handler.wait_idle()
+
+    assert encode.call_count == 1
+    payloads = {ws.sent[0] for ws in clients}
+    assert len(payloads) == 1
+    assert json.loads(payloads.pop()) == {
+        "type": "agent_update",
+        "seq": 1,
+        "update_type": "thinking",
+        "content": "hello",
+        "timestamp": "2024-01-01T00:00:00",
+        "metadata": {"status": "processing"},
+    }
+
+
+async def test_slow_client_does_not_delay_others():
+    handler = StreamHandler()
+    slow = FakeWebSocket(delay=0.5)
+    fast = [FakeWebSocket() for _ in range(3)]
+    for ws in [slow, *fast]:
+        await handler.register_client("s1", ws)
+
+    start = asyncio.get_running_loop().time()
+    await handler.broadcast_update("s1", make_update())
+    # Broadcasting only queues
+    assert asyncio.get_running_loop().time() - start < 0.05
+    await asyncio.sleep(0.05)
+
+    assert all(len(ws.sent) == 1 for ws in fast)
+    assert slow.sent == []
+    await handler.wait_idle("s1")
+    assert len(slow.sent) == 1
+    await handler.close()
+
+
+async def test_failed_client_is_unregistered():
+    handler = StreamHandler()
+    good, bad = FakeWebSocket(), FakeWebSocket(fail=True)
+    await handler.register_client("s1", good)
+    await handler.register_client("s1", bad)
+
+    await handler.broadcast_update("s1", make_update())
+    await asyncio.sleep(0.01)
+
+    assert handler.connections["s1"] == {good}
+    await handler.unregister_client("s1", good)
+    assert "s1" not in handler.connections
+    assert handler.get_total_connections() == 0
+
+
+async def test_stalled_client_never_blocks_the_broadcaster():
+    handler = StreamHandler()
+    ws = await stalled_client(handler, "drop_oldest")
+
+    for i in range(100):
+        await asyncio.wait_for(handler.broadcast_update("s1", make_update(f"progress {i}")), 0.1)
+
+    channel = handler._channels[ws]
+    assert len(channel.queue) == 3
+    assert channel.dropped == 97
+    await handler.close()
+
+
+async def test_drop_oldest_keeps_results_and_newest_progress():
+    handler = StreamHandler()
+    ws = await stalled_client(handler, "drop_oldest")
+
+    await handler.broadcast_update("s1", make_update("p1"))
+    await handler.broadcast_update("s1", make_update("result", UpdateType.TOOL_RESULT, tool_id="t1"))
+    await handler.broadcast_update("s1", make_update("p2"))
+    await handler.broadcast_update("s1", make_update("p3"))
+    ws.reading.set()
+    await handler.wait_idle()
+
+    assert contents(ws) == ["in-flight", "result", "p2", "p3"]
+    await handler.close()
+
+
+async def test_coalesce_folds_skipped_progress_into_one_notice():
+    handler = StreamHandler()
+    ws = await stalled_client(handler, "coalesce")
+
+    await handler.broadcast_update("s1", make_update("result", UpdateType.TOOL_RESULT, tool_id="t1"))
+    for i in range(5):
+        await handler.broadcast_update("s1", make_update(f"p{i}"))
+    ws.reading.set()
+    await handler.wait_idle()
+
+    frames = [json.loads(frame) for frame in ws.sent]
+    assert [f.get("content") for f in frames[:2]] == ["in-flight", "result"]
+    assert frames[2] == {"type": "updates_skipped", "count": 4}
+    assert frames[3]["content"] == "p4"
+    assert handler._channels[ws].dropped == 4
+    await handler.close()
+
+
+async def test_disconnect_policy_drops_the_slow_client():
+    handler = StreamHandler()
+    ws = await stalled_client(handler, "disconnect")
+    other = FakeWebSocket()
+    await handler.register_client("s1", other)
+
+    for i in range(4):
+        await handler.broadcast_update("s1", make_update(f"p{i}"))
+        # Give the healthy client's writer a turn
+        await asyncio.sleep(0)
+    await asyncio.sleep(0.01)
+
+    assert handler.connections["s1"] == {other}
+    assert ws.closed_with == 1013
+    assert len(other.sent) == 4
+    await handler.close()
+
+
+async def test_updates_get_per_session_sequence_numbers():
+    handler = StreamHandler()
+    ws = FakeWebSocket()
+    await handler.register_client("s1", ws)
+
+    updates = [make_update(f"u{i}") for i in range(3)]
+    for update in updates:
+        await handler.broadcast_update("s1", update)
+    await handler.broadcast_update("s2", make_update("other session"))
+    await handler.wait_idle()
+
+    assert [u.seq for u in updates] == [1, 2, 3]
+    assert [json.loads(frame)["seq"] for frame in ws.sent] == [1, 2, 3]
+    assert handler.last_seq("s2") == 1
+    await handler.close()
+
+
+async def test_reconnect_replays_only_missed_updates():
+    handler = StreamHandler()
+    # Broadcast while nobody is connected
+    for i in range(5):
+        await handler.broadcast_update("s1", make_update(f"u{i + 1}"))
+
+    ws = FakeWebSocket()
+    await handler.register_client("s1", ws, since=3)
+    await handler.broadcast_update("s1", make_update("u6"))
+    await handler.wait_idle()
+
+    assert [json.loads(frame)["seq"] for frame in ws.sent] == [4, 5, 6]
+    assert contents(ws) == ["u4", "u5", "u6"]
+    await handler.close()
+
+
+async def test_resume_outside_replay_ring_requires_resync():
+    handler = StreamHandler()
+    handler.replay_size = 3
+    for i in range(5):
+        await handler.broadcast_update("s1", make_update(f"u{i + 1}"))
+
+    evicted, ahead, current = FakeWebSocket(), FakeWebSocket(), FakeWebSocket()
+    await handler.register_client("s1", evicted, since=1)
+    # A sequence number from before a server restart
+    await handler.register_client("s1", ahead, since=99)
+    await handler.register_client("s1", current, since=5)
+    await handler.wait_idle()
+
+    resync = {"type": "resync_required", "session_id": "s1", "last_seq": 5}
+    assert [json.loads(frame) for frame in evicted.sent] == [resync]
+    assert [json.loads(frame) for frame in ahead.sent] == [resync]
+    assert current.sent == []
+
+    handler.discard_session("s1")
+    assert handler.last_seq("s1") == 0
+    await handler.close()
+
+
+async def test_trimmed_session_frees_its_ring_and_keeps_counting():
+    handler = StreamHandler()
+    for i in range(5):
+        await handler.broadcast_update("s1", make_update(f"u{i + 1}"))
+
+    handler.trim_session("s1")
+    assert not handler._logs["s1"].entries
+    stale, current = FakeWebSocket(), FakeWebSocket()
+    await handler.register_client("s1", stale, since=3)
+    await handler.register_client("s1", current, since=5)
+    await handler.broadcast_update("s1", make_update("u6"))
+    await handler.wait_idle()
+
+    assert json.loads(stale.sent[0])["type"] == "resync_required"
+    assert [json.loads(frame)["seq"] for frame in current.sent] == [6]
+    await handler.close()
+
+
+def test_websocket_endpoint_resumes_from_since():
+    from fastapi import FastAPI
+    from fastapi.testclient import TestClient
+
+    from computer_use_backend.routers import websocket as websocket_router
+
+    handler = StreamHandler()
+    for i in range(4):
+        asyncio.run(handler.broadcast_update("s1", make_update(f"u{i + 1}")))
+
+    app = FastAPI()
+    app.include_router(websocket_router.router, prefix="/ws")
+    with mock.patch.object(websocket_router, "get_shared_stream_handler", return_value=handler):
+        with TestClient(app).websocket_connect("/ws/s1/stream?since=2") as ws:
+            connected = ws.receive_json()
+            replayed = [ws.receive_json() for _ in range(2)]
+
+    assert connected["type"] == "connected"
+    assert connected["last_seq"] == 4
+    assert [(u["seq"], u["content"]) for u in replayed] == [(3, "u3"), (4, "u4")]
@@ -0,0 +1,160 @@
+"""
+Tests for the WebSocket RFB proxy, against a local fake RFB server.
+"""
+
+import asyncio
+import hashlib
+import socket
+from types import SimpleNamespace
+from unittest import mock
+
+import pytest
+import uvicorn
+import websockets
+from fastapi import FastAPI
+
+from computer_use_backend.routers import vnc
+from computer_use_backend.services.vnc_proxy import VNCProxy
+
+BANNER = b"RFB 003.008\n"
+BULK_SIZE = 4 * 1024 * 1024
+
+
+class FakeRFBServer:
+    """
+    Sends the RFB banner and echoes input. b"bulk" streams a 4 MiB payload and
+    b"flood" one far larger than any socket buffers.
+    """
+
+    def __init__(self):
+        self.received = bytearray()
+        self.bulk = bytes(range(256)) * (BULK_SIZE // 256)
+        self.bulk_sent = asyncio.Event()
+        self.server = None
+
+    async def start(self) -> int:
+        self.server = await asyncio.start_server(self.handle, "127.0.0.1", 0)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def handle(self, reader, writer):
+        writer.write(BANNER)
+        await writer.drain()
+        while data := await reader.read(65536):
+            self.received += data
+            if data in (b"bulk", b"flood"):
+                writer.write(self.bulk * (1 if data == b"bulk" else 16))
+                await writer.drain()
+                self.bulk_sent.set()
+            else:
+                writer.write(data)
+                await writer.drain()
+        writer.close()
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+
+@pytest.fixture
+async def rfb_server():
+    server = FakeRFBServer()
+    server.port = await server.start()
+    yield server
+    await server.stop()
+
+
+@pytest.fixture
+async def proxy_url(rfb_server):
+    """Serve the VNC router with uvicorn, backed by a worker on the fake server."""
+    app = FastAPI()
+    app.include_router(vnc.router, prefix="/vnc")
+    worker = SimpleNamespace(vnc_server=object(), vnc_port=rfb_server.port)
+    pool = mock.Mock(get_worker=mock.AsyncMock(side_effect=lambda sid: worker if sid == "s1" else None))
+
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(app, log_level="warning", ws="websockets"))
+    with mock.patch.object(vnc, "get_shared_worker_pool", return_value=pool):
+        task = asyncio.create_task(server.serve(sockets=[sock]))
+        while not server.started:
+            await asyncio.sleep(0.01)
+        yield f"ws://127.0.0.1:{port}/vnc"
+        server.should_exit = True
+        await task
+    sock.close()
+
+
+async def test_proxy_relays_rfb_in_both_directions(proxy_url, rfb_server):
+    async with websockets.connect(f"{proxy_url}/s1/stream", subprotocols=["binary"]) as ws:
+        assert ws.subprotocol == "binary"
+        assert await ws.recv() == BANNER
+
+        await ws.send(b"RFB 003.008\n")
+        assert await ws.recv() == b"RFB 003.008\n"
+
+        await ws.send(b"bulk")
+        received = bytearray()
+        while len(received) < BULK_SIZE:
+            frame = await ws.recv()
+            assert isinstance(frame, bytes)
+            received += frame
+
+        assert hashlib.sha256(received).digest() == hashlib.sha256(rfb_server.bulk).digest()
+        stats = VNCProxy.session_stats("s1")
+        assert len(stats) == 1
+        assert stats[0]["bytes_to_client"] == len(BANNER) + 12 + BULK_SIZE
+        assert stats[0]["bytes_to_server"] == 12 + 4
+        assert stats[0]["frames_to_server"] == 2
+
+    # The proxy notices the browser going away and closes upstream
+    for _ in range(100):
+        if not VNCProxy.session_stats("s1"):
+            break
+        await asyncio.sleep(0.01)
+    assert VNCProxy.session_stats("s1") == []
+    assert bytes(rfb_server.received) == b"RFB 003.008\nbulk"
+
+
+async def test_proxy_rejects_session_without_vnc(proxy_url):
+    async with websockets.connect(f"{proxy_url}/unknown/stream") as ws:
+        with pytest.raises(websockets.ConnectionClosed) as exc_info:
+            await ws.recv()
+    assert exc_info.value.rcvd.code == 1008
+
+
+class SlowWebSocket:
+    """A browser that accepts one frame and then stops reading."""
+
+    def __init__(self):
+        self.frames = []
+        self.unblock = asyncio.Event()
+        self.closed = asyncio.Event()
+
+    async def send_bytes(self, data):
+        self.frames.append(bytes(data))
+        if len(self.frames) > 1:
+            await self.unblock.wait()
+
+    async def receive(self):
+        await self.closed.wait()
+        return {"type": "websocket.disconnect"}
+
+
+async def test_slow_client_applies_backpressure(rfb_server):
+    ws = SlowWebSocket()
+    proxy = VNCProxy(ws, "s2", rfb_server.port, buffer_size=16 * 1024)
+    await proxy.connect()
+    # Ask for the flood directly on the upstream socket
+    proxy._sock.send(b"flood")
+    task = asyncio.create_task(proxy.run())
+
+    await asyncio.sleep(0.3)
+    # Only one buffer is in flight and the rest waits in x11vnc
+    assert proxy.stats.frames_to_client == 1
+    assert sum(len(f) for f in ws.frames) <= len(BANNER) + 2 * 16 * 1024
+    assert not rfb_server.bulk_sent.is_set()
+
+    ws.closed.set()
+    ws.unblock.set()
+    await asyncio.wait_for(task, 2)
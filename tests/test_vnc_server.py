@@ -0,0 +1,211 @@
+"""
+Tests for VNC server process management and startup readiness.
+"""
+
+import asyncio
+import sys
+import time
+from pathlib import Path
+from unittest import mock
+
+import pytest
+
+from computer_use_backend.services import vnc_server
+from computer_use_backend.services.vnc_server import (
+    ManagedProcess,
+    VNCServer,
+    rfb_ready,
+    wait_until_ready,
+)
+
+
+async def running_process(name="proc", **kwargs) -> ManagedProcess:
+    process = ManagedProcess(name, **kwargs)
+    await process.start(["sleep", "30"])
+    return process
+
+
+async def test_wait_until_ready_backs_off_and_reports_time():
+    process = await running_process()
+    calls = []
+
+    async def probe():
+        calls.append(time.perf_counter())
+        return len(calls) == 5
+
+    try:
+        elapsed = await wait_until_ready(probe, process, timeout=5)
+    finally:
+        await process.stop(1)
+
+    # 10 + 20 + 40 + 80 ms of backoff
+    assert 0.14 <= elapsed < 0.5
+    gaps = [b - a for a, b in zip(calls, calls[1:])]
+    assert gaps == sorted(gaps)
+
+
+async def test_wait_until_ready_times_out():
+    process = await running_process("Xvfb")
+
+    async def probe():
+        return False
+
+    try:
+        with pytest.raises(RuntimeError, match="Xvfb not ready after 0.1s"):
+            await wait_until_ready(probe, process, timeout=0.1)
+    finally:
+        await process.stop(1)
+
+
+async def test_wait_until_ready_fails_fast_with_stderr_when_process_exits():
+    process = ManagedProcess("x11vnc")
+    await process.start(["sh", "-c", "echo 'port in use' >&2; exit 1"])
+
+    async def probe():
+        return False
+
+    with pytest.raises(RuntimeError, match="x11vnc failed to start: port in use"):
+        await wait_until_ready(probe, process, timeout=5)
+    await process.stop(1)
+
+
+async def test_chatty_stderr_is_drained_into_bounded_ring():
+    process = ManagedProcess("chatty", stderr_lines=10)
+    # Far more than a pipe buffer holds, then stay alive
+    script = "import sys, time\nfor i in range(20000): print('line', i, file=sys.stderr)\ntime.sleep(30)"
+    await process.start([sys.executable, "-c", script])
+    try:
+        for _ in range(100):
+            if process.stderr and process.stderr[-1] == "line 19999":
+                break
+            await asyncio.sleep(0.05)
+        assert list(process.stderr)[0] == "line 19990"
+        assert len(process.stderr) == 10
+        assert process.running
+    finally:
+        await process.stop(1)
+
+
+async def test_stop_escalates_to_sigkill():
+    process = ManagedProcess("stubborn")
+    await process.start(["sh", "-c", "trap '' TERM; sleep 30"])
+    await asyncio.sleep(0.1)
+
+    start = time.perf_counter()
+    await process.stop(timeout=0.2)
+
+    assert 0.2 <= time.perf_counter() - start < 2
+    assert process.returncode == -9
+    assert not process.running
+
+
+async def test_exit_watcher_reports_unexpected_exit_only():
+    exits = []
+    crashed = ManagedProcess("Xvfb", on_exit=lambda name, code: exits.append((name, code)))
+    await crashed.start(["sh", "-c", "sleep 0.1; exit 3"])
+    stopped = await running_process(on_exit=lambda name, code: exits.append((name, code)))
+
+    await stopped.stop(1)
+    await asyncio.sleep(0.4)
+
+    assert exits == [("Xvfb", 3)]
+    await crashed.stop(1)
+
+
+async def test_rfb_ready_requires_protocol_banner():
+    async def rfb(reader, writer):
+        writer.write(b"RFB 003.008\n")
+        await writer.drain()
+        writer.close()
+
+    async def silent(reader, writer):
+        writer.close()
+
+    server = await asyncio.start_server(rfb, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    async with server:
+        assert await rfb_ready(port)
+
+    server = await asyncio.start_server(silent, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    async with server:
+        assert not await rfb_ready(port)
+
+    assert not await rfb_ready(port)
+
+
+@pytest.fixture
+async def fake_vnc(tmp_path):
+    """
+    A VNCServer whose Xvfb and x11vnc are stand-in processes. Each becomes
+    ready 0.2s after it starts by opening the socket the real one would.
+    """
+    async def rfb(reader, writer):
+        writer.write(b"RFB 003.008\n")
+        await writer.drain()
+        writer.close()
+
+    async def accept(reader, writer):
+        writer.close()
+
+    probe_server = await asyncio.start_server(accept, "127.0.0.1", 0)
+    port = probe_server.sockets[0].getsockname()[1]
+    probe_server.close()
+    await probe_server.wait_closed()
+
+    server = VNCServer("session-1", 150, vnc_port=port)
+    server.fbdir = tmp_path / "fb"
+    socket_path = tmp_path / "X150"
+    servers = []
+    create_subprocess_exec = asyncio.create_subprocess_exec
+
+    async def serve_after(delay, start):
+        await asyncio.sleep(delay)
+        servers.append(await start())
+
+    async def fake_exec(*cmd, **kwargs):
+        if cmd[0] == "Xvfb":
+            start = lambda: asyncio.start_unix_server(accept, str(socket_path))
+        else:
+            start = lambda: asyncio.start_server(rfb, "127.0.0.1", port)
+        asyncio.create_task(serve_after(0.2, start))
+        return await create_subprocess_exec("sleep", "30", **kwargs)
+
+    with (
+        mock.patch.object(VNCServer, "x11_socket_dir", Path(tmp_path)),
+        mock.patch.object(vnc_server.asyncio, "create_subprocess_exec", fake_exec),
+    ):
+        yield server
+
+    await server.stop()
+    for started in servers:
+        started.close()
+        await started.wait_closed()
+
+
+async def test_start_waits_for_display_socket_and_rfb_banner(fake_vnc):
+    await fake_vnc.start()
+
+    health = await fake_vnc.health_check()
+    assert health["is_running"]
+    assert health["xvfb_running"] and health["x11vnc_running"]
+    assert set(health["startup_seconds"]) == {"xvfb", "x11vnc"}
+    assert all(0.2 <= s < 1.0 for s in health["startup_seconds"].values())
+
+    await fake_vnc.stop()
+    health = await fake_vnc.health_check()
+    assert not health["xvfb_running"] and not health["x11vnc_running"]
+
+
+async def test_crashed_display_is_reported(fake_vnc):
+    exits = []
+    fake_vnc.on_exit = lambda name, code: exits.append((name, code))
+    await fake_vnc.start()
+
+    fake_vnc.xvfb_process.process.kill()
+    await asyncio.sleep(0.3)
+
+    assert exits == [("Xvfb", -9)]
+    health = await fake_vnc.health_check()
+    assert not health["is_running"]
+    assert health["exit_codes"] == {"Xvfb": -9}
@@ -0,0 +1,317 @@
+"""
+Tests for WorkerPool worker lifecycle.
+"""
+
+import asyncio
+import time
+from unittest import mock
+
+import pytest
+
+from computer_use_backend.services.worker import (
+    AdmissionQueueFull,
+    AdmissionTimeout,
+    Worker,
+    WorkerPool,
+)
+
+# Stand-in for Xvfb/x11vnc startup cost
+STARTUP_DELAY = 0.3
+
+
+async def slow_init_vnc(self):
+    await asyncio.sleep(STARTUP_DELAY)
+
+
+@pytest.fixture
+async def worker_pool():
+    with mock.patch.object(Worker, "_init_vnc", slow_init_vnc):
+        pool = WorkerPool()
+        pool.warm_pool_size = 2
+        yield pool
+        await pool.cleanup_all()
+
+
+async def wait_for_warm(pool: WorkerPool, count: int) -> None:
+    for _ in range(100):
+        if len(pool.warm_workers) >= count:
+            return
+        await asyncio.sleep(0.05)
+    raise AssertionError(f"warm pool never reached {count} workers")
+
+
+async def test_warm_worker_is_handed_out_instantly(worker_pool):
+    await worker_pool.start()
+    await wait_for_warm(worker_pool, 2)
+
+    start = time.perf_counter()
+    worker = await worker_pool.spawn_worker("session-1")
+    elapsed = time.perf_counter() - start
+
+    assert elapsed < STARTUP_DELAY / 2
+    assert worker.status == "ready"
+    assert worker.session_id == "session-1"
+    assert worker.agent_service is not None
+    assert worker_pool.warm_pool_stats["hits"] == 1
+    assert worker_pool.warm_pool_stats["misses"] == 0
+
+
+async def test_warm_pool_is_refilled_in_background(worker_pool):
+    await worker_pool.start()
+    await wait_for_warm(worker_pool, 2)
+
+    await worker_pool.spawn_worker("session-1")
+    await worker_pool.spawn_worker("session-2")
+    assert len(worker_pool.warm_workers) == 0
+
+    await wait_for_warm(worker_pool, 2)
+    health = await worker_pool.health_check()
+    assert health["warm_pool"]["size"] == 2
+    assert health["warm_pool"]["refills"] == 4
+    assert health["warm_pool"]["avg_refill_seconds"] >= STARTUP_DELAY
+
+
+async def test_empty_warm_pool_falls_back_to_inline_start(worker_pool):
+    worker = await worker_pool.spawn_worker("session-1")
+
+    assert worker.status == "ready"
+    assert worker_pool.warm_pool_stats["misses"] == 1
+    health = await worker_pool.health_check()
+    assert health["warm_pool"]["misses"] == 1
+
+
+async def test_warm_pool_respects_max_workers(worker_pool):
+    worker_pool.max_workers = 3
+    await worker_pool.spawn_worker("session-1")
+    await worker_pool.spawn_worker("session-2")
+    await asyncio.sleep(STARTUP_DELAY * 3)
+
+    assert len(worker_pool.warm_workers) == 1
+
+
+async def test_cleanup_all_includes_warm_workers(worker_pool):
+    await worker_pool.start()
+    await wait_for_warm(worker_pool, 2)
+    warm = list(worker_pool.warm_workers)
+
+    await worker_pool.cleanup_all()
+
+    assert worker_pool.warm_workers == []
+    assert all(w.status == "terminated" for w in warm)
+
+
+async def test_max_workers_follows_max_concurrent_sessions(worker_pool):
+    assert worker_pool.max_workers == worker_pool.settings.max_concurrent_sessions
+
+
+async def test_reaper_tears_down_idle_workers_only(worker_pool):
+    idle = await worker_pool.spawn_worker("idle-session")
+    busy = await worker_pool.spawn_worker("busy-session")
+    fresh = await worker_pool.spawn_worker("fresh-session")
+    worker_pool.worker_timeout = 60
+    idle.last_activity -= 120
+    busy.last_activity -= 120
+    busy.status = "processing"
+
+    retired = []
+    worker_pool.on_worker_retired = retired.append
+
+    await worker_pool.reap_idle()
+
+    assert retired == ["idle-session"]
+    assert "idle-session" not in worker_pool.workers
+    assert idle.status == "terminated"
+    assert idle.agent_service is None
+    assert worker_pool.workers["busy-session"] is busy
+    assert worker_pool.workers["fresh-session"] is fresh
+
+
+async def test_full_pool_evicts_least_recently_used_idle_worker(worker_pool):
+    worker_pool.max_workers = 2
+    oldest = await worker_pool.spawn_worker("session-1")
+    await worker_pool.spawn_worker("session-2")
+    oldest.last_activity -= 10
+
+    worker = await worker_pool.spawn_worker("session-3")
+
+    assert set(worker_pool.workers) == {"session-2", "session-3"}
+    assert worker.status == "ready"
+    assert oldest.status == "terminated"
+
+
+async def test_full_pool_of_busy_workers_refuses_when_queue_is_full(worker_pool):
+    worker_pool.max_workers = 1
+    worker_pool.admission_queue_size = 0
+    busy = await worker_pool.spawn_worker("session-1")
+    busy.status = "processing"
+
+    with pytest.raises(AdmissionQueueFull, match="Max workers") as exc_info:
+        await worker_pool.spawn_worker("session-2")
+    assert exc_info.value.retry_after == worker_pool.admission_retry_after
+
+
+async def test_queued_request_is_admitted_when_a_worker_frees_up(worker_pool):
+    worker_pool.max_workers = 1
+    worker_pool.warm_pool_size = 0
+    busy = await worker_pool.spawn_worker("session-1")
+    busy.status = "processing"
+    positions = []
+
+    async def on_queue_position(position):
+        positions.append(position)
+
+    waiting = asyncio.create_task(worker_pool.spawn_worker("session-2", on_queue_position))
+    await asyncio.sleep(0.05)
+    assert not waiting.done()
+    assert positions == [1]
+    assert (await worker_pool.health_check())["admission_queue"]["waiting"] == 1
+
+    # Finishing the message makes the busy worker evictable
+    busy.status = "ready"
+    busy.on_idle()
+    worker = await asyncio.wait_for(waiting, 2)
+
+    assert worker.session_id == "session-2"
+    assert set(worker_pool.workers) == {"session-2"}
+    assert busy.status == "terminated"
+    assert not worker_pool._admission_queue
+
+
+async def test_queue_admits_in_arrival_order_and_reports_positions(worker_pool):
+    worker_pool.max_workers = 1
+    worker_pool.warm_pool_size = 0
+    busy = await worker_pool.spawn_worker("session-1")
+    busy.status = "processing"
+    positions = {"session-2": [], "session-3": []}
+
+    def tracker(session_id):
+        async def on_queue_position(position):
+            positions[session_id].append(position)
+        return on_queue_position
+
+    second = asyncio.create_task(worker_pool.spawn_worker("session-2", tracker("session-2")))
+    await asyncio.sleep(0.01)
+    third = asyncio.create_task(worker_pool.spawn_worker("session-3", tracker("session-3")))
+    await asyncio.sleep(0.01)
+
+    await worker_pool.terminate_worker("session-1")
+    admitted = await asyncio.wait_for(second, 2)
+    admitted.status = "processing"
+    assert not third.done()
+
+    await worker_pool.terminate_worker("session-2")
+    await asyncio.wait_for(third, 2)
+
+    assert positions == {"session-2": [1], "session-3": [2, 1]}
+
+
+async def test_queued_request_times_out(worker_pool):
+    worker_pool.max_workers = 1
+    worker_pool.admission_timeout = 0.1
+    busy = await worker_pool.spawn_worker("session-1")
+    busy.status = "processing"
+
+    with pytest.raises(AdmissionTimeout):
+        await worker_pool.spawn_worker("session-2")
+    assert not worker_pool._admission_queue
+    assert set(worker_pool.workers) == {"session-1"}
+
+
+async def test_idle_session_expires_after_session_timeout(worker_pool):
+    expired = []
+
+    async def on_session_expired(session_id):
+        expired.append(session_id)
+
+    worker_pool.on_session_expired = on_session_expired
+    worker_pool.worker_timeout = 60
+    worker_pool.session_timeout = 600
+    worker = await worker_pool.spawn_worker("session-1")
+    worker.last_activity -= 120
+
+    await worker_pool.reap_idle()
+    assert "session-1" not in worker_pool.workers
+    assert expired == []
+
+    # Once the session has been idle for session_timeout it is expired
+    worker_pool._idle_sessions["session-1"] -= 1000
+    await worker_pool.reap_idle()
+    assert expired == ["session-1"]
+    assert worker_pool._idle_sessions == {}
+
+
+async def test_reaper_runs_in_background(worker_pool):
+    worker_pool.warm_pool_size = 0
+    worker_pool.reap_interval = 0.05
+    worker_pool.worker_timeout = 0
+    worker = await worker_pool.spawn_worker("session-1")
+    await worker_pool.start()
+
+    await asyncio.sleep(0.2)
+    assert worker.status == "terminated"
+    assert worker_pool.workers == {}
+
+
+async def test_worker_with_dead_display_is_replaced(worker_pool):
+    worker_pool.warm_pool_size = 0
+    worker = await worker_pool.spawn_worker("session-1")
+
+    worker._on_vnc_exit("Xvfb", 1)
+
+    assert worker.status == "unhealthy"
+    assert await worker_pool.get_worker("session-1") is None
+    replacement = await worker_pool.spawn_worker("session-1")
+    assert replacement is not worker
+    assert replacement.status == "ready"
+    assert worker.status == "terminated"
+
+
+async def test_unhealthy_worker_keeps_status_after_processing(worker_pool):
+    worker = await worker_pool.spawn_worker("session-1")
+
+    async for _ in worker.process_message("hello"):
+        worker._on_vnc_exit("x11vnc", -9)
+
+    assert worker.status == "unhealthy"
+    await worker_pool.reap_idle()
+    assert "session-1" not in worker_pool.workers
+
+
+async def test_worker_that_fails_to_start_releases_its_display(worker_pool):
+    async def take_display(self):
+        self.display = self.displays.acquire()
+        self.display_num = self.display.display_num
+
+    async def broken_agent(self):
+        raise RuntimeError("agent failed")
+
+    with mock.patch.object(Worker, "_init_vnc", take_display), \
+            mock.patch.object(Worker, "_init_agent", broken_agent):
+        await worker_pool.start()
+        await wait_for_warm(worker_pool, 2)
+        # Bound from the warm pool, then started inline once it is empty
+        for _ in range(3):
+            with pytest.raises(RuntimeError, match="agent failed"):
+                await worker_pool.spawn_worker("session-1")
+            worker_pool.warm_pool_size = 0
+
+    assert worker_pool.workers == {}
+    assert worker_pool.displays.in_use == len(worker_pool.warm_workers)
+
+
+async def test_failed_refill_releases_its_display(worker_pool):
+    async def take_display(self):
+        self.display = self.displays.acquire()
+        self.display_num = self.display.display_num
+
+    async def broken_vm(self):
+        await take_display(self)
+        raise RuntimeError("no VM")
+
+    worker_pool.warm_pool_size = 1
+    with mock.patch.object(Worker, "_init_vnc", broken_vm):
+        with pytest.raises(RuntimeError, match="no VM"):
+            await worker_pool._warm_one()
+
+    assert worker_pool.warm_pool_stats["refill_failures"] == 1
+    assert worker_pool.displays.in_use == 0
@@ -0,0 +1,174 @@
+"""
+Tests for running a worker's agent in a child process.
+"""
+
+import asyncio
+import os
+import signal
+from unittest import mock
+
+import pytest
+
+from computer_use_backend.models.schemas import UpdateType
+from computer_use_backend.services.display_allocator import DisplayAllocator
+from computer_use_backend.services.vnc_server import VNCServer
+from computer_use_backend.services.worker import Worker
+from computer_use_backend.services.worker_process import (
+    AgentProcess,
+    MAX_FRAME_SIZE,
+    read_frame,
+    write_frame,
+)
+
+
+async def no_vnc(self):
+    self.display_num = 7
+
+
+@pytest.fixture(autouse=True)
+def mock_agent(monkeypatch):
+    # The child reads its settings from the inherited environment
+    monkeypatch.setenv("ANTHROPIC_API_KEY", "")
+
+
+@pytest.fixture
+async def worker():
+    with mock.patch.object(Worker, "_init_vnc", no_vnc):
+        worker = Worker("session-1")
+        worker.settings = worker.settings.model_copy(update={"worker_execution": "process"})
+        await worker.initialize()
+        yield worker
+        await worker.cleanup()
+
+
+async def test_frames_round_trip_and_oversized_frames_are_refused():
+    server_reader, server_writer = None, None
+    connected = asyncio.Event()
+
+    async def on_connect(reader, writer):
+        nonlocal server_reader, server_writer
+        server_reader, server_writer = reader, writer
+        connected.set()
+
+    server = await asyncio.start_server(on_connect, "127.0.0.1", 0)
+    host, port = server.sockets[0].getsockname()[:2]
+    reader, writer = await asyncio.open_connection(host, port)
+    await connected.wait()
+
+    await write_frame(writer, {"op": "update", "text": "é" * 10})
+    await write_frame(writer, {"op": "done"})
+    assert await read_frame(server_reader) == {"op": "update", "text": "é" * 10}
+    assert await read_frame(server_reader) == {"op": "done"}
+
+    writer.write((MAX_FRAME_SIZE + 1).to_bytes(4, "big"))
+    await writer.drain()
+    with pytest.raises(ConnectionError):
+        await read_frame(server_reader)
+
+    writer.close()
+    server_writer.close()
+    server.close()
+
+
+async def test_updates_stream_back_from_the_child(worker):
+    assert worker.status == "ready"
+    assert worker.agent_process.pid not in (None, os.getpid())
+
+    updates = [update async for update in worker.process_message("what is 2+2?")]
+
+    assert updates[0].update_type == UpdateType.THINKING
+    assert updates[-1].update_type == UpdateType.COMPLETE
+    assert worker.status == "ready"
+
+
+async def test_worker_leaves_the_api_process_display_alone(monkeypatch):
+    monkeypatch.setenv("DISPLAY", ":99")
+    with mock.patch.object(VNCServer, "start", mock.AsyncMock()), \
+            mock.patch.object(VNCServer, "stop", mock.AsyncMock()):
+        worker = Worker("session-1")
+        await worker.initialize()
+        assert worker.vnc_server is not None
+        await worker.cleanup()
+
+    assert os.environ["DISPLAY"] == ":99"
+
+
+async def test_abandoned_message_is_cancelled_in_the_child(worker):
+    stream = worker.process_message("hello")
+    await stream.__anext__()
+    await stream.aclose()
+
+    assert worker.status == "ready"
+    # The child is still usable afterwards
+    updates = [update async for update in worker.process_message("hello again")]
+    assert updates[-1].update_type == UpdateType.COMPLETE
+
+
+async def test_warm_worker_starts_child_before_binding():
+    with mock.patch.object(Worker, "_init_vnc", no_vnc):
+        worker = Worker()
+        worker.settings = worker.settings.model_copy(update={"worker_execution": "process"})
+        await worker.initialize()
+        try:
+            assert worker.status == "warm"
+            assert worker.agent_process.running
+            assert worker.agent_service is None
+
+            await worker.bind("session-2")
+            assert worker.agent_process.session_id == "session-2"
+        finally:
+            pid = worker.agent_process.pid
+            await worker.cleanup()
+
+    assert worker.agent_process is None
+    with pytest.raises(ProcessLookupError):
+        os.kill(pid, 0)
+
+
+async def test_child_death_marks_worker_unhealthy(worker):
+    os.kill(worker.agent_process.pid, signal.SIGKILL)
+    for _ in range(100):
+        if worker.status == "unhealthy":
+            break
+        await asyncio.sleep(0.02)
+
+    assert worker.status == "unhealthy"
+
+
+async def test_process_message_fails_once_the_child_is_gone():
+    agent = AgentProcess(display_num=None)
+    await agent.start()
+    await agent.bind("session-3")
+    await agent.close()
+
+    with pytest.raises(RuntimeError, match="not running"):
+        async for _ in agent.process_message("hi"):
+            pass
+
+
+async def test_failed_bind_in_child_releases_display_and_child(tmp_path):
+    displays = DisplayAllocator(display_base=90, port_base=5990, size=1, lock_dir=str(tmp_path))
+
+    async def take_display(self):
+        self.display = self.displays.acquire()
+        self.display_num = self.display.display_num
+
+    started = []
+    start = AgentProcess.start
+
+    async def record_start(self):
+        await start(self)
+        started.append(self)
+
+    with mock.patch.object(Worker, "_init_vnc", take_display), \
+            mock.patch.object(AgentProcess, "start", record_start), \
+            mock.patch.object(AgentProcess, "bind", side_effect=asyncio.TimeoutError()):
+        worker = Worker("session-4", displays=displays)
+        worker.settings = worker.settings.model_copy(update={"worker_execution": "process"})
+        with pytest.raises(asyncio.TimeoutError):
+            await worker.initialize()
+
+    assert worker.status == "failed"
+    assert displays.in_use == 0
+    assert worker.agent_process is None
+    assert not started[0].running
@@ -1,6 +1,15 @@
+import os
+import statistics
+import time
+
 import pytest
 
-from computer_use_demo.tools.bash import BashTool20241022, BashTool20250124, ToolError
+from computer_use_demo.tools.bash import (
+    BashTool20241022,
+    BashTool20250124,
+    ToolError,
+    _BashSession,
+)
 
 
 @pytest.fixture(params=[BashTool20241022, BashTool20250124])
@@ -69,3 +78,65 @@ async def test_bash_tool_timeout(bash_tool):
         match="timed out: bash has not returned in 0.1 seconds and must be restarted",
     ):
         await bash_tool(command="sleep 1")
+
+
+@pytest.mark.asyncio
+async def test_bash_tool_returns_without_polling_delay(bash_tool):
+    await bash_tool(command="true")
+    durations = []
+    for _ in range(20):
+        start = time.perf_counter()
+        result = await bash_tool(command="echo fast")
+        durations.append(time.perf_counter() - start)
+        assert result.output == "fast"
+    assert statistics.median(durations) < 0.005
+
+
+@pytest.mark.asyncio
+async def test_bash_tool_bounds_large_output(bash_tool):
+    result = await bash_tool(command="head -c 10000000 /dev/zero | tr '\\0' a; echo")
+    session = bash_tool._session
+    kept = session._max_head_bytes + session._max_tail_bytes
+    assert len(result.output) < kept + 100
+    assert f"<response clipped: {10000001 - kept} bytes omitted>" in result.output
+    assert result.output.startswith("a" * 100)
+    assert result.output.endswith("a" * 100)
+
+    # the session keeps working after a large command
+    result = await bash_tool(command="echo after")
+    assert result.output == "after"
+
+
+@pytest.mark.asyncio
+async def test_bash_session_sentinel_split_across_reads():
+    session = _BashSession()
+    session._read_size = 3
+    await session.start()
+    try:
+        result = await session.run("echo out; echo err >&2")
+        assert result.output == "out"
+        assert result.error == "err"
+        result = await session.run("echo again")
+        assert result.output == "again"
+        assert result.error == ""
+    finally:
+        session.stop()
+
+
+@pytest.mark.asyncio
+async def test_bash_tool_reports_exited_shell(bash_tool):
+    result = await bash_tool(command="echo bye; exit 3")
+    assert result.output == "bye"
+    assert result.system == "tool must be restarted"
+    assert "returncode 3" in result.error
+
+
+@pytest.mark.asyncio
+async def test_bash_tool_env_is_per_shell():
+    tool = BashTool20250124(env={"DISPLAY": ":42"})
+    try:
+        result = await tool(command="echo $DISPLAY; echo ${PATH:+has-path}")
+        assert result.output == ":42\nhas-path"
+        assert os.environ.get("DISPLAY") != ":42"
+    finally:
+        tool.stop()
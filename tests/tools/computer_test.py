@@ -1,6 +1,12 @@
+import asyncio
+import base64
+import io
+import struct
+import threading
 from unittest.mock import AsyncMock, patch
 
 import pytest
+from PIL import Image
 
 from computer_use_demo.tools.computer import (
     ComputerTool20241022,
@@ -16,6 +22,22 @@ def computer_tool(request):
     return request.param()
 
 
+def write_xwd(path, width, height, color):
+    """Write a 32bpp ZPixmap XWD file like the one Xvfb keeps under -fbdir."""
+    name = b"Xvfb screen\x00"
+    header_size = 100 + len(name)
+    bytes_per_line = width * 4
+    header = struct.pack(
+        ">25I",
+        header_size, 7, 2, 24, width, height, 0, 0, 32, 0, 32, 32,
+        bytes_per_line, 4, 0xFF0000, 0xFF00, 0xFF, 8, 256, 0,
+        width, height, 0, 0, 0,
+    )
+    r, g, b = color
+    pixel = bytes([b, g, r, 0])  # LSBFirst -> BGRX
+    path.write_bytes(header + name + pixel * width * height)
+
+
 @pytest.mark.asyncio
 async def test_computer_tool_mouse_move(computer_tool):
     with patch.object(computer_tool, "shell", new_callable=AsyncMock) as mock_shell:
@@ -138,3 +160,151 @@ async def test_computer_tool_missing_coordinate(computer_tool):
 async def test_computer_tool_missing_text(computer_tool):
     with pytest.raises(ToolError, match="text is required for type"):
         await computer_tool(action="type")
+
+
+@pytest.fixture
+def framebuffer_dir(tmp_path, monkeypatch):
+    write_xwd(tmp_path / "Xvfb_screen0", 64, 48, (255, 0, 0))
+    monkeypatch.setenv("XVFB_FBDIR", str(tmp_path))
+    return tmp_path
+
+
+@pytest.mark.asyncio
+async def test_computer_tool_screenshot_from_framebuffer(framebuffer_dir):
+    computer_tool = ComputerTool20250124()
+    computer_tool.width, computer_tool.height = 64, 48
+    with patch.object(computer_tool, "shell", new_callable=AsyncMock) as mock_shell:
+        result = await computer_tool.screenshot()
+        mock_shell.assert_not_called()
+
+    image = Image.open(io.BytesIO(base64.b64decode(result.base64_image)))
+    assert image.format == "PNG"
+    assert image.size == (64, 48)
+    assert image.getpixel((10, 10)) == (255, 0, 0)
+
+
+@pytest.mark.asyncio
+async def test_computer_tool_framebuffer_is_resized(framebuffer_dir):
+    write_xwd(framebuffer_dir / "Xvfb_screen0", 1920, 1080, (0, 128, 255))
+    computer_tool = ComputerTool20250124()
+    computer_tool.width, computer_tool.height = 1920, 1080
+
+    result = await computer_tool.screenshot()
+
+    image = Image.open(io.BytesIO(base64.b64decode(result.base64_image)))
+    assert image.size == (1366, 768)
+    assert image.getpixel((100, 100)) == (0, 128, 255)
+
+
+@pytest.mark.asyncio
+async def test_computer_tool_screenshot_falls_back_without_framebuffer(monkeypatch):
+    monkeypatch.delenv("XVFB_FBDIR", raising=False)
+    computer_tool = ComputerTool20250124()
+    assert computer_tool._framebuffer is None
+    with patch.object(
+        computer_tool, "_screenshot_subprocess", new_callable=AsyncMock
+    ) as mock_subprocess:
+        mock_subprocess.return_value = ToolResult(base64_image="base64_screenshot")
+        result = await computer_tool.screenshot()
+        mock_subprocess.assert_called_once()
+    assert result.base64_image == "base64_screenshot"
+
+
+@pytest.mark.asyncio
+async def test_computer_tool_stop_waits_for_capture_in_progress(framebuffer_dir):
+    computer_tool = ComputerTool20250124()
+    computer_tool.width, computer_tool.height = 64, 48
+    framebuffer = computer_tool._framebuffer
+    entered, release = threading.Event(), threading.Event()
+    pixels = framebuffer.pixels
+
+    def slow_pixels():
+        entered.set()
+        release.wait(5)
+        return pixels()
+
+    framebuffer.pixels = slow_pixels
+    screenshot = asyncio.create_task(computer_tool.screenshot())
+    await asyncio.to_thread(entered.wait, 5)
+    stop = asyncio.create_task(asyncio.to_thread(computer_tool.stop))
+    await asyncio.sleep(0.05)
+    assert not stop.done()
+
+    release.set()
+    result, _ = await asyncio.gather(screenshot, stop)
+    image = Image.open(io.BytesIO(base64.b64decode(result.base64_image)))
+    assert image.getpixel((10, 10)) == (255, 0, 0)
+    assert computer_tool._framebuffer is None
+    with pytest.raises(ValueError, match="closed"):
+        framebuffer.capture_png()
+
+
+async def repaint_framebuffer(path, interval, stop):
+    """Keep changing the first pixel of the framebuffer until `stop` is set."""
+    header_size = struct.unpack_from(">I", path.read_bytes())[0]
+    value = 0
+    with open(path, "r+b") as f:
+        while not stop.is_set():
+            value = (value + 1) % 256
+            f.seek(header_size)
+            f.write(bytes([value, value, value, 0]))
+            f.flush()
+            await asyncio.sleep(interval)
+
+
+@pytest.mark.asyncio
+async def test_computer_tool_settles_early_on_static_screen(framebuffer_dir):
+    computer_tool = ComputerTool20250124()
+    computer_tool.width, computer_tool.height = 64, 48
+    with patch(
+        "computer_use_demo.tools.computer.run", new_callable=AsyncMock
+    ) as mock_run:
+        mock_run.return_value = (0, "", "")
+        result = await computer_tool.shell("xdotool click 1")
+
+    assert result.base64_image
+    assert computer_tool._settle_quiet_window <= result.settle_time < 1.0
+
+
+@pytest.mark.asyncio
+async def test_computer_tool_waits_for_screen_to_settle(framebuffer_dir):
+    computer_tool = ComputerTool20250124()
+    stop = asyncio.Event()
+    painter = asyncio.create_task(
+        repaint_framebuffer(framebuffer_dir / "Xvfb_screen0", 0.02, stop)
+    )
+    asyncio.get_running_loop().call_later(0.5, stop.set)
+    try:
+        settle_time = await computer_tool.wait_for_settle()
+    finally:
+        stop.set()
+        await painter
+
+    assert settle_time >= 0.5 + computer_tool._settle_quiet_window
+    assert settle_time < computer_tool._screenshot_delay
+
+
+@pytest.mark.asyncio
+async def test_computer_tool_settle_is_capped(framebuffer_dir):
+    computer_tool = ComputerTool20250124()
+    computer_tool._screenshot_delay = 0.5
+    stop = asyncio.Event()
+    painter = asyncio.create_task(
+        repaint_framebuffer(framebuffer_dir / "Xvfb_screen0", 0.02, stop)
+    )
+    try:
+        settle_time = await computer_tool.wait_for_settle()
+    finally:
+        stop.set()
+        await painter
+
+    assert 0.5 <= settle_time < 0.5 + 2 * computer_tool._settle_poll_interval
+
+
+@pytest.mark.asyncio
+async def test_computer_tool_settle_falls_back_to_fixed_delay(monkeypatch):
+    monkeypatch.delenv("XVFB_FBDIR", raising=False)
+    monkeypatch.setenv("SCREEN_SETTLE_TIMEOUT", "0.1")
+    computer_tool = ComputerTool20250124()
+    assert computer_tool._framebuffer is None
+    assert 0.1 <= await computer_tool.wait_for_settle() < 0.3
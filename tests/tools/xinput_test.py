@@ -0,0 +1,260 @@
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, patch
+
+import pytest
+from Xlib import X, XK
+
+from computer_use_demo.tools.computer import ComputerTool20250124
+from computer_use_demo.tools.xinput import (
+    InputEvent,
+    UnsupportedCommand,
+    XInputChannel,
+    XInputError,
+)
+
+SHIFT = 50
+
+
+class FakeDisplay:
+    """Just enough of Xlib.display.Display for XInputChannel."""
+
+    def __init__(self):
+        self.sent = []
+        self.syncs = 0
+        self.flushes = 0
+        self.fail = False
+        self.dead = False
+        self.closed = False
+
+    def keysym_to_keycodes(self, keysym):
+        if ord("a") <= keysym <= ord("z"):
+            return [(keysym - ord("a") + 38, 0)]
+        if ord("A") <= keysym <= ord("Z"):
+            return [(keysym - ord("A") + 38, 1)]
+        if keysym == ord(" "):
+            return [(65, 0)]
+        if keysym == ord("!"):
+            return [(10, 1)]
+        if keysym == XK.string_to_keysym("Return"):
+            return [(36, 0)]
+        if keysym == XK.string_to_keysym("Control_L"):
+            return [(37, 0)]
+        if keysym == XK.string_to_keysym("Shift_L"):
+            return [(SHIFT, 0)]
+        return []
+
+    def keysym_to_keycode(self, keysym):
+        codes = self.keysym_to_keycodes(keysym)
+        return codes[0][0] if codes else 0
+
+    def flush(self):
+        self.flushes += 1
+
+    def sync(self):
+        if self.fail:
+            raise OSError("broken pipe")
+        self.syncs += 1
+
+    def screen(self):
+        pointer = SimpleNamespace(root_x=12, root_y=34, child=None)
+        return SimpleNamespace(root=SimpleNamespace(query_pointer=lambda: pointer))
+
+    def has_extension(self, name):
+        return name == "XTEST"
+
+    def get_input_focus(self):
+        if self.dead:
+            raise OSError("connection reset")
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def display():
+    return FakeDisplay()
+
+
+@pytest.fixture
+def channel(display):
+    def fake_input(d, event_type, detail=0, x=0, y=0):
+        d.sent.append((event_type, detail, x, y))
+
+    with patch("computer_use_demo.tools.xinput.xtest.fake_input", fake_input):
+        yield XInputChannel(display)
+
+
+def test_compile_click_with_modifier(channel):
+    events = channel.compile("mousemove --sync 10 20 keydown ctrl click 1 keyup ctrl")
+    assert events == [
+        InputEvent(X.MotionNotify, x=10, y=20),
+        InputEvent(X.KeyPress, 37),
+        InputEvent(X.ButtonPress, 1),
+        InputEvent(X.ButtonRelease, 1),
+        InputEvent(X.KeyRelease, 37),
+    ]
+
+
+def test_compile_repeated_click_uses_delay(channel):
+    events = channel.compile("click --repeat 2 --delay 10 1")
+    assert events[2] == InputEvent(None, delay=0.01)
+    assert [e.event_type for e in events].count(X.ButtonPress) == 2
+
+
+def test_compile_key_combo_and_type_with_shift(channel):
+    events = channel.compile("key -- ctrl+a Return")
+    assert [(e.event_type, e.detail) for e in events if e.event_type] == [
+        (X.KeyPress, 37),
+        (X.KeyPress, 38),
+        (X.KeyRelease, 38),
+        (X.KeyRelease, 37),
+        (X.KeyPress, 36),
+        (X.KeyRelease, 36),
+    ]
+
+    events = channel.compile("type --delay 0 -- 'Hi!'")
+    assert [(e.event_type, e.detail) for e in events] == [
+        (X.KeyPress, SHIFT),
+        (X.KeyPress, 45),
+        (X.KeyRelease, 45),
+        (X.KeyRelease, SHIFT),
+        (X.KeyPress, 46),
+        (X.KeyRelease, 46),
+        (X.KeyPress, SHIFT),
+        (X.KeyPress, 10),
+        (X.KeyRelease, 10),
+        (X.KeyRelease, SHIFT),
+    ]
+
+
+@pytest.mark.parametrize(
+    "args",
+    ["search --name firefox", "key -- XF86Unknown", "type -- é", "mousemove 1", "type 'oops"],
+)
+def test_compile_rejects_unsupported_commands(channel, args):
+    with pytest.raises(UnsupportedCommand):
+        channel.compile(args)
+
+
+@pytest.mark.asyncio
+async def test_execute_batches_into_one_round_trip(channel, display):
+    output = await channel.run("mousemove --sync 5 6 click 1 getmouselocation --shell")
+    assert display.sent == [
+        (X.MotionNotify, 0, 5, 6),
+        (X.ButtonPress, 1, 0, 0),
+        (X.ButtonRelease, 1, 0, 0),
+    ]
+    assert display.syncs == 1
+    assert output == "X=12\nY=34\nSCREEN=0\nWINDOW=0\n"
+
+
+@pytest.mark.asyncio
+async def test_execute_closes_channel_on_connection_loss(channel, display):
+    display.fail = True
+    with pytest.raises(XInputError):
+        await channel.run("click 1")
+    assert channel.closed
+
+
+@pytest.mark.asyncio
+async def test_computer_tool_uses_input_channel(channel, display):
+    computer_tool = ComputerTool20250124()
+    computer_tool._input = channel
+    with (
+        patch("computer_use_demo.tools.computer.run", new_callable=AsyncMock) as mock_run,
+        patch.object(computer_tool, "screenshot", new_callable=AsyncMock),
+        patch.object(computer_tool, "wait_for_settle", new_callable=AsyncMock),
+    ):
+        result = await computer_tool(action="left_click", coordinate=[100, 200])
+        mock_run.assert_not_called()
+    assert display.syncs == 1
+    assert (X.ButtonPress, 1, 0, 0) in display.sent
+    assert not result.error
+
+
+@pytest.mark.asyncio
+async def test_computer_tool_falls_back_to_xdotool(channel, display):
+    computer_tool = ComputerTool20250124()
+    computer_tool._input = channel
+    with (
+        patch("computer_use_demo.tools.computer.run", new_callable=AsyncMock) as mock_run,
+        patch.object(computer_tool, "screenshot", new_callable=AsyncMock),
+        patch.object(computer_tool, "wait_for_settle", new_callable=AsyncMock),
+    ):
+        mock_run.return_value = (0, "", "")
+        await computer_tool(action="key", text="XF86Unknown")
+        mock_run.assert_called_once_with(f"{computer_tool.xdotool} key -- XF86Unknown")
+    assert display.sent == []
+
+
+@pytest.fixture
+def displays(monkeypatch):
+    """Fake X connections opened by XInputChannel.for_display, newest last."""
+    opened = []
+
+    def connect(name):
+        opened.append(FakeDisplay())
+        return opened[-1]
+
+    monkeypatch.setattr(XInputChannel, "_channels", {})
+    monkeypatch.setattr("computer_use_demo.tools.xinput.xdisplay.Display", connect)
+    monkeypatch.setenv("DISPLAY_NUM", "3")
+    return opened
+
+
+def test_for_display_shares_a_live_channel_until_released(displays):
+    first = XInputChannel.for_display(3)
+    second = XInputChannel.for_display(3)
+    assert first is second
+    assert len(displays) == 1
+
+    first.release()
+    assert not first.closed
+    second.release()
+    assert first.closed and displays[0].closed
+    assert XInputChannel.for_display(3) is not first
+
+
+def test_for_display_replaces_a_dead_connection(displays):
+    stale = XInputChannel.for_display(3)
+    # Xvfb restarted on the same display number
+    displays[0].dead = True
+
+    fresh = XInputChannel.for_display(3)
+
+    assert fresh is not stale
+    assert stale.closed
+    assert len(displays) == 2
+
+
+@pytest.mark.asyncio
+async def test_computer_tool_retries_undelivered_input_with_xdotool(channel, display, displays):
+    computer_tool = ComputerTool20250124()
+    computer_tool._input = channel
+    display.fail = True
+    with (
+        patch("computer_use_demo.tools.computer.run", new_callable=AsyncMock) as mock_run,
+        patch.object(computer_tool, "screenshot", new_callable=AsyncMock),
+        patch.object(computer_tool, "wait_for_settle", new_callable=AsyncMock),
+    ):
+        mock_run.return_value = (0, "", "")
+        result = await computer_tool(action="left_click", coordinate=[100, 200])
+        mock_run.assert_called_once_with(f"{computer_tool.xdotool} mousemove --sync 100 200 click 1")
+        assert not result.error
+
+        # The next action reconnects
+        await computer_tool(action="left_click", coordinate=[100, 200])
+        mock_run.assert_called_once()
+    assert computer_tool._input is not channel
+    assert displays[-1].syncs == 1
+
+
+def test_computer_tool_stop_releases_input(displays):
+    computer_tool = ComputerTool20250124()
+    channel = computer_tool._input
+    assert channel is not None
+
+    computer_tool.stop()
+
+    assert channel.closed
+    assert computer_tool._input is None